@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class HisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'his'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import (  # noqa: F401
+            beds, counters, dashboard_cache, duplicates, lab_worklist, notifications, reference_ranges, search_index,
+            vitals_series,
+        )
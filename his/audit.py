@@ -0,0 +1,333 @@
+# his/audit.py
+"""
+Buffered AuditLog writer.
+
+record() appends the entry to this process's spill file and to an in-memory
+buffer, and returns without touching the database. A background thread
+writes the buffer with bulk_create once HIS_AUDIT_BATCH_SIZE entries are
+waiting or every HIS_AUDIT_FLUSH_INTERVAL seconds, then deletes the spill
+segments those entries came from. The buffer is also flushed at interpreter
+exit.
+
+If the process dies first, the spill segments stay in HIS_AUDIT_SPILL_DIR.
+They are replayed by the next writer to start and by the flush_audit_log
+command. Every entry carries an event_id and is inserted with
+ignore_conflicts, so a segment replayed after a partial flush does not
+duplicate rows.
+
+When a batch is refused, its entries are written one at a time, so one bad
+entry (say, an actor deleted meanwhile) cannot hold back the rest. An entry
+that still fails is retried on later flushes, and after
+HIS_AUDIT_MAX_ATTEMPTS failed flushes it is moved to a dead-letter file in
+the "dead" subdirectory. `flush_audit_log --dead-letters` replays those
+files once the cause is fixed.
+
+Set HIS_AUDIT_ASYNC = False to write each entry immediately (tests,
+management commands).
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 2.0  # seconds
+DEFAULT_MAX_ATTEMPTS = 10
+SEGMENT_SUFFIX = '.jsonl'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _spill_dir():
+    return Path(_setting('HIS_AUDIT_SPILL_DIR', Path(settings.BASE_DIR) / 'spool' / 'audit'))
+
+
+def _to_row(entry):
+    return AuditLog(
+        event_id=entry['event_id'],
+        actor_id=entry['actor_id'],
+        action=entry['action'],
+        model=entry['model'],
+        object_id=entry['object_id'],
+        timestamp=parse_datetime(entry['timestamp']),
+        details=entry['details'],
+        ip_address=entry['ip_address'],
+    )
+
+
+def _insert(entries):
+    AuditLog.objects.bulk_create(
+        [_to_row(entry) for entry in entries],
+        batch_size=_setting('HIS_AUDIT_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        ignore_conflicts=True,
+    )
+
+
+def _write(entries):
+    """
+    Insert `entries`; if the batch is refused, insert them one at a time.
+    Returns the entries that could not be written. A lost connection is
+    raised instead, since every entry would fail the same way.
+    """
+    try:
+        with transaction.atomic():
+            _insert(entries)
+        return []
+    except (OperationalError, InterfaceError):
+        raise
+    except DatabaseError:
+        if len(entries) == 1:
+            return list(entries)
+    failed = []
+    for entry in entries:
+        try:
+            with transaction.atomic():
+                _insert([entry])
+        except (OperationalError, InterfaceError):
+            raise
+        except DatabaseError:
+            failed.append(entry)
+    return failed
+
+
+_dead_letter_lock = threading.Lock()
+
+
+def _dead_letter_dir():
+    return _spill_dir() / 'dead'
+
+
+def _dead_letter(entries):
+    """Append entries that keep failing to this process's dead-letter file."""
+    directory = _dead_letter_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with _dead_letter_lock, open(directory / f"audit-dead-{os.getpid()}{SEGMENT_SUFFIX}", 'a', encoding='utf-8') as handle:
+        for entry in entries:
+            handle.write(json.dumps(entry) + '\n')
+    logger.error('%d audit entries could not be written; moved to %s', len(entries), directory)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AuditWriter:
+    """Per-process audit buffer backed by append-only spill segments."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        self._closed_segments = []  # segments whose entries are all in the buffer
+        self._segment = None
+        self._segment_number = 0
+        self._thread = None
+        self._pid = None
+        self.token = None  # distinguishes this process's segments from a previous one with the same pid
+
+    # Spill file ---------------------------------------------------------------
+
+    def _open_segment(self):
+        directory = _spill_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        self._segment_number += 1
+        path = directory / f"audit-{os.getpid()}-{self.token}-{self._segment_number}{SEGMENT_SUFFIX}"
+        self._segment = (path, open(path, 'a', encoding='utf-8'))
+
+    def _spill(self, entry):
+        if self._segment is None:
+            self._open_segment()
+        handle = self._segment[1]
+        handle.write(json.dumps(entry) + '\n')
+        handle.flush()
+        if _setting('HIS_AUDIT_FSYNC', False):
+            os.fsync(handle.fileno())
+
+    def _rotate(self):
+        if self._segment is not None:
+            path, handle = self._segment
+            handle.close()
+            self._closed_segments.append(path)
+            self._segment = None
+
+    # Public API ---------------------------------------------------------------
+
+    def record(self, entry):
+        with self._lock:
+            self._ensure_started()
+            self._spill(entry)
+            self._buffer.append(entry)
+            full = len(self._buffer) >= _setting('HIS_AUDIT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of entries written."""
+        with self._lock:
+            if not self._buffer:
+                return 0
+            batch, self._buffer = self._buffer, []
+            self._rotate()
+            segments, self._closed_segments = self._closed_segments, []
+        try:
+            close_old_connections()
+            failed = _write(batch)
+        except Exception:
+            logger.exception('Audit flush of %d entries failed; keeping them for the next attempt', len(batch))
+            failed = batch
+        retry, dead = [], []
+        for entry in failed:
+            entry['attempts'] = entry.get('attempts', 0) + 1
+            (dead if entry['attempts'] >= _setting('HIS_AUDIT_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS) else retry).append(entry)
+        if dead:
+            _dead_letter(dead)
+        if retry:
+            # The segments hold the retried entries too; they go once those are written
+            with self._lock:
+                self._buffer[:0] = retry
+                self._closed_segments[:0] = segments
+        else:
+            for path in segments:
+                path.unlink(missing_ok=True)
+        return len(batch) - len(failed)
+
+    def close(self):
+        self._wakeup.set()
+        self.flush()
+
+    # Background thread --------------------------------------------------------
+
+    def _ensure_started(self):
+        # Called under the lock; a forked worker must start its own thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.token = uuid.uuid4().hex[:12]
+        self._buffer, self._closed_segments, self._segment = [], [], None
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            recover()
+        except Exception:
+            logger.exception('Replaying audit spill segments failed')
+        interval = _setting('HIS_AUDIT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+writer = AuditWriter()
+atexit.register(writer.close)
+
+
+def recover(include_live=False):
+    """
+    Insert the entries of spill segments left behind by processes that are
+    no longer running (every segment but this process's own when
+    include_live is set), then delete the segments. Returns the number of
+    entries replayed.
+    """
+    directory = _spill_dir()
+    if not directory.is_dir():
+        return 0
+    replayed = 0
+    for path in sorted(directory.glob(f"audit-*{SEGMENT_SUFFIX}")):
+        try:
+            _, pid, token, _ = path.name.split('-')
+            pid = int(pid)
+        except ValueError:
+            continue
+        if token == writer.token:
+            continue
+        if not include_live and pid != os.getpid() and _pid_alive(pid):
+            continue
+        entries = []
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break  # torn last line from a crash mid-write
+        failed = _write(entries) if entries else []
+        if failed:
+            _dead_letter(failed)
+        path.unlink(missing_ok=True)
+        replayed += len(entries) - len(failed)
+    return replayed
+
+
+def replay_dead_letters():
+    """
+    Retry the entries of every dead-letter file. Entries that still fail are
+    kept in their file. Returns (written, still failing).
+    """
+    directory = _dead_letter_dir()
+    if not directory.is_dir():
+        return 0, 0
+    written = failing = 0
+    with _dead_letter_lock:
+        for path in sorted(directory.glob(f"audit-dead-*{SEGMENT_SUFFIX}")):
+            with open(path, encoding='utf-8') as handle:
+                entries = [json.loads(line) for line in handle if line.strip()]
+            failed = _write(entries) if entries else []
+            if failed:
+                path.write_text(''.join(json.dumps(entry) + '\n' for entry in failed), encoding='utf-8')
+            else:
+                path.unlink(missing_ok=True)
+            written += len(entries) - len(failed)
+            failing += len(failed)
+    return written, failing
+
+
+def record(action, actor=None, model='', object_id='', details=None, ip_address=None):
+    """Queue one AuditLog entry."""
+    entry = {
+        'event_id': str(uuid.uuid4()),
+        'actor_id': getattr(actor, 'pk', actor),
+        'action': action,
+        'model': model,
+        'object_id': str(object_id) if object_id is not None else '',
+        'timestamp': timezone.now().isoformat(),
+        'details': details,
+        'ip_address': ip_address,
+    }
+    # Exactly what the spill file and a replay will see: a round trip turns
+    # dates, UUIDs and Decimals in details into strings up front
+    entry = json.loads(json.dumps(entry, default=str))
+    if not _setting('HIS_AUDIT_ASYNC', True):
+        _insert([entry])
+        return
+    writer.record(entry)
+
+
+def record_request(request, action, model='', object_id='', details=None, actor=None):
+    """Queue an entry for the user and client address of `request`."""
+    ip_address = request.META.get('REMOTE_ADDR')
+    if actor is None and request.user.is_authenticated:
+        actor = request.user
+    if details is None:
+        details = {'ip_address': ip_address}
+    record(action, actor=actor, model=model, object_id=object_id, details=details, ip_address=ip_address)
@@ -0,0 +1,182 @@
+# his/beds.py
+"""
+Bed state: assignment, transfer and release.
+
+A bed is claimed with a conditional UPDATE (... WHERE is_occupied = false
+AND is_maintenance = false), so when two nurses assign the same bed at the
+same moment exactly one UPDATE matches a row and the other gets
+BedUnavailable. The claim also records the visit as the bed's
+current_visit. The claim, the release of the visit's previous bed and the
+visit's own bed change commit together, under a lock on the visit row, so
+two moves of the same visit (or a move racing its discharge) run one after
+the other and each starts from the bed the visit really holds.
+
+Each Ward carries an occupied_beds counter that is adjusted in the same
+transaction, so availability is read from the ward row instead of counting
+beds. Beds saved or deleted directly (admin, fixtures) adjust the counter
+through the signal receivers below; reconcile() recounts from the beds
+table and is run by the reconcile_bed_occupancy command.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from . import counters
+from .models import Bed, Visit, Ward
+
+
+class BedUnavailable(Exception):
+    pass
+
+
+class VisitNotActive(BedUnavailable):
+    """The visit was discharged (or otherwise closed) before it got the bed."""
+
+
+def _shift_wards(deltas):
+    # Fixed ward order so concurrent transfers between the same wards cannot deadlock
+    for ward_id in sorted(deltas):
+        if deltas[ward_id]:
+            Ward.objects.filter(pk=ward_id).update(occupied_beds=F('occupied_beds') + deltas[ward_id])
+
+
+def _free(bed_id, visit):
+    """
+    Mark a bed free if `visit` still occupies it; returns its ward id, or
+    None if nothing changed. A stale visit whose bed has since gone to
+    another patient leaves that patient's bed alone.
+    """
+    ward_id = Bed.objects.filter(pk=bed_id).values_list('ward_id', flat=True).first()
+    if ward_id is None or not Bed.objects.filter(pk=bed_id, is_occupied=True, current_visit=visit).update(
+        is_occupied=False, current_visit=None,
+    ):
+        return None
+    return ward_id
+
+
+def assign(visit, bed):
+    """
+    Put `visit` in `bed`, moving it out of its current bed if it has one.
+    Raises BedUnavailable if the bed is occupied or under maintenance, and
+    VisitNotActive if the visit is no longer active.
+    """
+    bed_id = getattr(bed, 'pk', bed)
+    with transaction.atomic():
+        # The caller's copy may be stale: take the bed and status from the locked row
+        current = Visit.objects.select_for_update().only('status', 'bed').get(pk=visit.pk)
+        visit.bed_id = current.bed_id
+        if current.status != 'active':
+            raise VisitNotActive(f"Visit {visit.pk} is {current.status}")
+        if visit.bed_id == bed_id:
+            return
+        deltas = {}
+        # The old bed lets go of the visit first (current_visit is one-to-one);
+        # a failed claim below rolls this back
+        if visit.bed_id:
+            old_ward_id = _free(visit.bed_id, visit)
+            if old_ward_id is not None:
+                deltas[old_ward_id] = -1
+        if not Bed.objects.filter(pk=bed_id, is_occupied=False, is_maintenance=False).update(
+            is_occupied=True, current_visit=visit,
+        ):
+            raise BedUnavailable(f"Bed {bed_id} is occupied or under maintenance")
+        ward_id = Bed.objects.filter(pk=bed_id).values_list('ward_id', flat=True).get()
+        deltas[ward_id] = deltas.get(ward_id, 0) + 1
+        _shift_wards(deltas)
+        counters.adjust({'beds.occupied': sum(deltas.values())})
+
+        visit.bed_id = bed_id
+        visit.save(update_fields=['bed'])
+
+
+def transfer(visit, bed):
+    """Move an admitted visit to another bed; see assign()."""
+    assign(visit, bed)
+
+
+def release(visit):
+    """Free the visit's bed and clear visit.bed; the caller saves the visit."""
+    if not visit.bed_id:
+        return
+    with transaction.atomic():
+        ward_id = _free(visit.bed_id, visit)
+        if ward_id is not None:
+            _shift_wards({ward_id: -1})
+            counters.adjust({'beds.occupied': -1})
+    visit.bed_id = None
+
+
+def bed_map(wards=None):
+    """Every bed of the active wards (or of `wards`) with its occupant, as one joined query."""
+    if wards is None:
+        wards = Ward.objects.filter(is_active=True)
+    return (
+        Bed.objects.filter(ward__in=wards)
+        .select_related('ward', 'current_visit__patient')
+        .order_by('ward__name', 'bed_number')
+    )
+
+
+def census(wards=None):
+    """Bed availability of every active ward (or of `wards`) from the ward rows: one query."""
+    if wards is None:
+        wards = Ward.objects.filter(is_active=True)
+    rows = []
+    for ward in wards.order_by('name').values('id', 'name', 'ward_type', 'total_beds', 'occupied_beds'):
+        ward['available_beds'] = ward['total_beds'] - ward['occupied_beds']
+        ward['occupancy_rate'] = (
+            round(ward['occupied_beds'] / ward['total_beds'] * 100, 1) if ward['total_beds'] > 0 else 0
+        )
+        rows.append(ward)
+    return {
+        'wards': rows,
+        'total_beds': sum(row['total_beds'] for row in rows),
+        'occupied_beds': sum(row['occupied_beds'] for row in rows),
+        'available_beds': sum(row['available_beds'] for row in rows),
+    }
+
+
+def reconcile():
+    """Recount occupied beds per ward; returns the number of wards corrected."""
+    with transaction.atomic():
+        actual = dict(
+            Bed.objects.filter(is_occupied=True).values('ward_id').annotate(total=Count('pk'))
+            .values_list('ward_id', 'total')
+        )
+        changed = 0
+        for ward_id, stored in Ward.objects.select_for_update().values_list('pk', 'occupied_beds'):
+            if stored != actual.get(ward_id, 0):
+                Ward.objects.filter(pk=ward_id).update(occupied_beds=actual.get(ward_id, 0))
+                changed += 1
+    return changed
+
+
+# Direct Bed saves and deletes --------------------------------------------------
+
+def _remember_previous(sender, instance, raw=False, **kwargs):
+    instance._beds_previous = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._beds_previous = Bed.objects.filter(pk=instance.pk).values_list('ward_id', 'is_occupied').first()
+
+
+def _on_bed_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {}
+    previous = getattr(instance, '_beds_previous', None)
+    if previous and previous[1]:
+        deltas[previous[0]] = deltas.get(previous[0], 0) - 1
+    if instance.is_occupied:
+        deltas[instance.ward_id] = deltas.get(instance.ward_id, 0) + 1
+    _shift_wards(deltas)
+
+
+def _on_bed_deleted(sender, instance, **kwargs):
+    if instance.is_occupied:
+        _shift_wards({instance.ward_id: -1})
+
+
+pre_save.connect(_remember_previous, sender=Bed, dispatch_uid='beds_pre_save')
+post_save.connect(_on_bed_saved, sender=Bed, dispatch_uid='beds_post_save')
+post_delete.connect(_on_bed_deleted, sender=Bed, dispatch_uid='beds_post_delete')
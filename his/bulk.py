@@ -0,0 +1,28 @@
+# his/bulk.py
+"""
+bulk_create() with primary keys.
+
+Django sets the primary keys of bulk-inserted objects only on backends that
+can return rows from a bulk INSERT. Others, djongo among them, leave them
+None. Code that uses the new rows as foreign-key targets, or in pk__in
+filters, calls create() instead: on those backends the ids are read back
+with one query, matched on fields that identify each new row.
+"""
+
+
+def create(model, objects, key, **kwargs):
+    """
+    Insert `objects` with bulk_create() and make sure each has its pk.
+    `key` names the fields (attnames) that tell the new rows apart. Where
+    older rows share a key, the newest one (highest pk) is the new row, so
+    call this inside the transaction that serialises the writers.
+    """
+    objects = model.objects.bulk_create(objects, **kwargs)
+    missing = {tuple(getattr(obj, field) for field in key): obj for obj in objects if obj.pk is None}
+    if missing:
+        rows = model.objects.filter(**{f'{key[0]}__in': {values[0] for values in missing}}).order_by('pk')
+        for *values, pk in rows.values_list(*key, 'pk'):
+            obj = missing.get(tuple(values))
+            if obj is not None:
+                obj.pk = pk
+    return objects
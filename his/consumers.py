@@ -0,0 +1,55 @@
+# his/consumers.py
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.utils import timezone
+
+from . import notifications
+from .models import Notification
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes a user's notifications and unread count to their open tabs.
+
+    On connect the tab gets a 'snapshot' message; afterwards 'notification'
+    messages for new rows and 'count' messages when the unread count changes.
+    Tabs may send {"action": "mark_read", "id": <id>}.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.group = notifications.group_name(user.id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        await self.send_json(await database_sync_to_async(notifications.snapshot)(user.id))
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group'):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('action') == 'mark_read':
+            await database_sync_to_async(self._mark_read)(content.get('id'))
+
+    def _mark_read(self, notification_id):
+        # Saving goes through post_save, which pushes the new count to every tab
+        notification = Notification.objects.filter(
+            id=notification_id, recipient=self.scope['user'], is_read=False
+        ).first()
+        if notification:
+            notification.is_read = True
+            notification.read_at = timezone.now()
+            notification.save()
+
+    async def notification_created(self, event):
+        await self.send_json({
+            'type': 'notification',
+            'notification': event['notification'],
+            'unread_count': event['unread_count'],
+        })
+
+    async def notification_count(self, event):
+        await self.send_json({'type': 'count', 'unread_count': event['unread_count']})
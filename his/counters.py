@@ -0,0 +1,365 @@
+# his/counters.py
+"""
+Materialized dashboard counters.
+
+Each Counter below describes one dashboard figure as a filter over a model,
+optionally summing a field and optionally bucketed by day or month of a
+date field. The same description is used two ways:
+
+* incrementally: model signals work out how much a saved or deleted row
+  contributed before and after, and add the difference to the matching
+  DashboardCounter row once the transaction commits;
+* in bulk: reconcile() recomputes the figures from the source tables,
+  repairing drift from queryset.update(), bulk_create() and raw SQL, which
+  bypass signals. Run the reconcile_dashboard_counters command periodically.
+
+Dashboards read their figures with read(), one query for all of them.
+"""
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.expressions import BaseExpression
+from django.db.models.functions import TruncDate, TruncMonth
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import (
+    DashboardCounter, Patient, Visit, Appointment, Staff, LeaveRequest, PharmacyStock,
+    Invoice, Payment, InsuranceClaim, LabOrder, LabResult, MedicationDispense, Bed
+)
+
+
+class Counter:
+    """One dashboard figure: COUNT(*) or SUM(amount) over model rows matching filters."""
+
+    def __init__(self, name, model, filters=None, exclude=None, amount=None, bucket=None):
+        self.name = name
+        self.model = model
+        self.filters = filters or {}
+        self.exclude = exclude or {}
+        self.amount = amount            # field to sum; None counts rows
+        self.bucket = bucket            # (date field, 'day' | 'month') or None
+
+    @property
+    def fields(self):
+        """Field attnames the figure depends on."""
+        names = set()
+        for lookups in (self.filters, self.exclude):
+            for lookup, value in lookups.items():
+                names.add(lookup.split('__')[0])
+                if isinstance(value, F):
+                    names.add(value.name)
+        if self.amount:
+            names.add(self.amount)
+        if self.bucket:
+            names.add(self.bucket[0])
+        return {self.model._meta.get_field(name).attname for name in names}
+
+    def key(self, when=None):
+        if not self.bucket:
+            return self.name
+        if self.bucket[1] == 'month':
+            return f"{self.name}:{when:%Y-%m}"
+        return f"{self.name}:{when.isoformat()}"
+
+    # Instance side -----------------------------------------------------------
+
+    def _matches(self, obj, lookups):
+        for lookup, expected in lookups.items():
+            field, _, op = lookup.partition('__')
+            value = getattr(obj, self.model._meta.get_field(field).attname)
+            if isinstance(expected, F):
+                expected = getattr(obj, expected.name)
+            if op == '':
+                matched = value == expected
+            elif op == 'in':
+                matched = value in expected
+            elif op == 'lte':
+                matched = value is not None and expected is not None and value <= expected
+            else:
+                raise ValueError(f"Unsupported counter lookup: {lookup}")
+            if not matched:
+                return False
+        return True
+
+    def contribution(self, obj):
+        """{key: amount} this row adds to the figure, empty if it does not count."""
+        if not self._matches(obj, self.filters):
+            return {}
+        if self.exclude and self._matches(obj, self.exclude):
+            return {}
+        when = None
+        if self.bucket:
+            when = _local_date(getattr(obj, self.bucket[0]))
+            if when is None:
+                return {}
+        amount = 1
+        if self.amount:
+            amount = Decimal(str(getattr(obj, self.amount) or 0))
+        return {self.key(when): amount}
+
+    # Query side --------------------------------------------------------------
+
+    def queryset(self):
+        queryset = self.model._default_manager.filter(**self.filters)
+        if self.exclude:
+            queryset = queryset.exclude(**self.exclude)
+        return queryset
+
+    def compute(self, since=None):
+        """{key: value} recomputed from the source table (bucketed figures from `since` on)."""
+        aggregate = Sum(self.amount) if self.amount else Count('pk')
+        queryset = self.queryset()
+        if not self.bucket:
+            return {self.key(): queryset.aggregate(value=aggregate)['value'] or 0}
+
+        field, period = self.bucket
+        trunc = TruncMonth(field) if period == 'month' else TruncDate(field)
+        if since is not None:
+            if period == 'month':
+                since = since.replace(day=1)
+            queryset = queryset.filter(**{f"{field}__date__gte": since})
+        rows = queryset.annotate(bucket_start=trunc).values('bucket_start').annotate(value=aggregate)
+        return {
+            self.key(_local_date(row['bucket_start'])): row['value'] or 0
+            for row in rows if row['bucket_start'] is not None
+        }
+
+    def compute_key(self, key):
+        """Recompute a single key from the source table."""
+        if not self.bucket:
+            return self.compute()[key]
+        field, period = self.bucket
+        stamp = key.split(':', 1)[1]
+        if period == 'month':
+            start = datetime.date.fromisoformat(f"{stamp}-01")
+            lookups = {f"{field}__year": start.year, f"{field}__month": start.month}
+        else:
+            lookups = {f"{field}__date": datetime.date.fromisoformat(stamp)}
+        aggregate = Sum(self.amount) if self.amount else Count('pk')
+        return self.queryset().filter(**lookups).aggregate(value=aggregate)['value'] or 0
+
+
+COUNTERS = [
+    Counter('patients.total', Patient),
+    Counter('patients.registered', Patient, bucket=('created_at', 'day')),
+    Counter('visits.active', Visit, filters={'status': 'active'}),
+    Counter('visits.admitted', Visit, bucket=('admitted_at', 'day')),
+    Counter('visits.discharged', Visit, bucket=('discharged_at', 'day')),
+    Counter('appointments.scheduled', Appointment, bucket=('appointment_date', 'day')),
+    Counter('staff.active', Staff, filters={'active': True}),
+    Counter('leave_requests.pending', LeaveRequest, filters={'status': 'pending'}),
+    Counter('pharmacy.low_stock', PharmacyStock, filters={'low_stock': True}),
+    Counter('dispenses.recorded', MedicationDispense, bucket=('dispensed_at', 'day')),
+    Counter('invoices.sent', Invoice, filters={'status': 'sent'}),
+    Counter('invoices.outstanding', Invoice, exclude={'status': 'paid'}, amount='total_amount'),
+    Counter('payments.revenue', Payment, amount='amount', bucket=('paid_at', 'day')),
+    Counter('payments.revenue_monthly', Payment, amount='amount', bucket=('paid_at', 'month')),
+    Counter('insurance_claims.submitted', InsuranceClaim, filters={'status': 'submitted'}),
+    Counter('insurance_claims.pending_amount', InsuranceClaim,
+            filters={'status__in': ['submitted', 'under_review']}, amount='claim_amount'),
+    Counter('lab_orders.ordered', LabOrder, filters={'status': 'ordered'}),
+    Counter('lab_orders.processing', LabOrder, filters={'status__in': ['sample_collected', 'in_progress']}),
+    Counter('lab_results.reported', LabResult, bucket=('reported_at', 'day')),
+    Counter('beds.occupied', Bed, filters={'is_occupied': True}),
+    Counter('beds.in_service', Bed, filters={'is_maintenance': False}),
+]
+
+COUNTERS_BY_NAME = {counter.name: counter for counter in COUNTERS}
+
+
+def _local_date(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = parse_datetime(value) or parse_date(value)
+        if value is None:
+            return None
+    if isinstance(value, datetime.datetime):
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return timezone.localdate(value)
+    return value
+
+
+def _counter_for_key(key):
+    return COUNTERS_BY_NAME[key.split(':', 1)[0]]
+
+
+# Reading ---------------------------------------------------------------------
+
+def read(spec):
+    """
+    Read several figures in one query.
+
+    `spec` maps a context name to a counter name, a (name, date) pair for a
+    bucketed figure, or a (name, [dates]) pair to sum several buckets.
+    Missing rows are computed from the source tables and stored.
+    """
+    wanted = {}
+    for alias, ref in spec.items():
+        if isinstance(ref, str):
+            wanted[alias] = [ref]
+        else:
+            name, when = ref
+            dates = when if isinstance(when, (list, tuple)) else [when]
+            wanted[alias] = [COUNTERS_BY_NAME[name].key(day) for day in dates]
+
+    keys = {key for keys in wanted.values() for key in keys}
+    values = dict(DashboardCounter.objects.filter(key__in=keys).values_list('key', 'value'))
+    for key in keys - values.keys():
+        values[key] = _store_computed(key)
+
+    result = {}
+    for alias, keys in wanted.items():
+        total = sum((values[key] for key in keys), Decimal(0))
+        result[alias] = total if _counter_for_key(keys[0]).amount else int(total)
+    return result
+
+
+def _store_computed(key):
+    value = _counter_for_key(key).compute_key(key)
+    try:
+        with transaction.atomic():
+            DashboardCounter.objects.update_or_create(key=key, defaults={'value': value})
+    except IntegrityError:
+        # Another worker created it first with the same source figure.
+        pass
+    return Decimal(value)
+
+
+# Incremental maintenance -----------------------------------------------------
+
+def _apply(deltas):
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        updated = DashboardCounter.objects.filter(key=key).update(value=F('value') + delta)
+        if not updated:
+            # First write to this figure (or bucket): the committed source
+            # rows already include this change, so compute rather than add.
+            _store_computed(key)
+
+
+def adjust(deltas):
+    """Apply {key: delta} on commit, for changes made with queryset.update(), which sends no signals."""
+    deltas = dict(deltas)
+    transaction.on_commit(lambda: _apply(deltas))
+
+
+def record_bulk(model, changes):
+    """
+    Apply on commit the counter changes of rows written with bulk_create() or
+    bulk_update(), which send no signals. `changes` holds (before, after)
+    pairs of objects with the counted attributes; before is None for a new row.
+    """
+    counters = _counters_for(model)
+    deltas = {}
+    for before, after in changes:
+        for key, amount in _contributions(before, counters).items():
+            deltas[key] = deltas.get(key, 0) - amount
+        for key, amount in _contributions(after, counters).items():
+            deltas[key] = deltas.get(key, 0) + amount
+    adjust(deltas)
+
+
+def _snapshot(instance, counters):
+    """Current values of the counted fields, re-read from the database if they hold expressions."""
+    fields = set().union(*(counter.fields for counter in counters))
+    values = {name: getattr(instance, name) for name in fields}
+    if any(isinstance(value, BaseExpression) for value in values.values()):
+        values = type(instance)._default_manager.filter(pk=instance.pk).values(*fields).first() or {}
+    return SimpleNamespace(**values)
+
+
+def _contributions(state, counters):
+    totals = {}
+    if state is None:
+        return totals
+    for counter in counters:
+        for key, amount in counter.contribution(state).items():
+            totals[key] = totals.get(key, 0) + amount
+    return totals
+
+
+def _counters_for(sender):
+    return [counter for counter in COUNTERS if counter.model is sender]
+
+
+def _remember_previous(sender, instance, raw=False, update_fields=None, **kwargs):
+    counters = _counters_for(sender)
+    instance._counter_previous = None
+    instance._counter_skip = False
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    fields = set().union(*(counter.fields for counter in counters))
+    if update_fields is not None and not fields & {
+        sender._meta.get_field(name).attname for name in update_fields
+    }:
+        instance._counter_skip = True
+        return
+    previous = sender._default_manager.filter(pk=instance.pk).values(*fields).first()
+    if previous is not None:
+        instance._counter_previous = SimpleNamespace(**previous)
+
+
+def _record_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw or getattr(instance, '_counter_skip', False):
+        return
+    counters = _counters_for(sender)
+    before = _contributions(getattr(instance, '_counter_previous', None), counters)
+    after = _contributions(_snapshot(instance, counters), counters)
+    deltas = {key: after.get(key, 0) - before.get(key, 0) for key in before.keys() | after.keys()}
+    transaction.on_commit(lambda: _apply(deltas))
+
+
+def _record_delete(sender, instance, **kwargs):
+    counters = _counters_for(sender)
+    deltas = {key: -amount for key, amount in _contributions(_snapshot(instance, counters), counters).items()}
+    transaction.on_commit(lambda: _apply(deltas))
+
+
+for _model in {counter.model for counter in COUNTERS}:
+    pre_save.connect(_remember_previous, sender=_model, dispatch_uid=f"counters_pre_save_{_model.__name__}")
+    post_save.connect(_record_save, sender=_model, dispatch_uid=f"counters_post_save_{_model.__name__}")
+    post_delete.connect(_record_delete, sender=_model, dispatch_uid=f"counters_post_delete_{_model.__name__}")
+
+
+# Reconciliation --------------------------------------------------------------
+
+def reconcile(days=45):
+    """
+    Recompute every figure from the source tables; bucketed figures only for
+    the last `days` days. Returns the number of counter rows that changed.
+    """
+    since = timezone.localdate() - datetime.timedelta(days=days)
+    fresh = {}
+    for counter in COUNTERS:
+        computed = counter.compute(since=since if counter.bucket else None)
+        fresh.update({key: Decimal(value) for key, value in computed.items()})
+
+    # Buckets in the window that no longer have source rows drop to zero.
+    window_start = {name: counter.key(since.replace(day=1) if counter.bucket[1] == 'month' else since)
+                    for name, counter in COUNTERS_BY_NAME.items() if counter.bucket}
+    changed = []
+    with transaction.atomic():
+        existing = {row.key: row for row in DashboardCounter.objects.select_for_update()}
+        for key, row in existing.items():
+            name = key.split(':', 1)[0]
+            if key not in fresh and name in window_start and key >= window_start[name]:
+                fresh[key] = Decimal(0)
+        for key, value in fresh.items():
+            row = existing.get(key)
+            if row is None:
+                changed.append(DashboardCounter(key=key, value=value))
+            elif row.value != value:
+                row.value = value
+                row.updated_at = timezone.now()
+                changed.append(row)
+        DashboardCounter.objects.bulk_create([row for row in changed if row.pk is None])
+        DashboardCounter.objects.bulk_update([row for row in changed if row.pk is not None], ['value', 'updated_at'])
+    return len(changed)
@@ -0,0 +1,160 @@
+# his/dashboard_cache.py
+"""
+Cache for the role-specific blocks of the main dashboard.
+
+Fragments are keyed by role, user (or 'all' for blocks shared by everyone in
+a role) and day, and live in the cache alias named by HIS_DASHBOARD_CACHE.
+Saves and deletes of the rows a fragment is built from invalidate just the
+keys they affect; the cache timeout only bounds drift from bulk writes that
+skip signals.
+
+The alias must be shared by every worker that serves the dashboard: a
+local-memory cache is per process, so with several workers an invalidation
+in one would not reach the others, and a file-based cache only spans one
+host. Point HIS_DASHBOARD_CACHE at Redis or Memcached for those deployments.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from .models import Appointment, Bed, Invoice, Payment, Visit, Vitals, Ward
+
+ROLES = ('doctor', 'nurse', 'finance')
+
+
+def get_cache():
+    return caches[getattr(settings, 'HIS_DASHBOARD_CACHE', 'default')]
+
+
+def fragment_key(role, user_id=None, day=None):
+    day = day or timezone.localdate()
+    return f"dashboard:{role}:{user_id or 'all'}:{day.isoformat()}"
+
+
+def _bump(role, outcome):
+    cache = get_cache()
+    key = f"dashboard:stats:{role}:{outcome}"
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr(); start over from this event.
+        cache.set(key, 1, timeout=None)
+
+
+def cached_fragment(role, user_id, compute):
+    """Return the cached fragment for (role, user), computing and storing it on a miss."""
+    cache = get_cache()
+    key = fragment_key(role, user_id)
+    value = cache.get(key)
+    if value is not None:
+        _bump(role, 'hits')
+        return value
+    _bump(role, 'misses')
+    value = compute()
+    cache.set(key, value, getattr(settings, 'HIS_DASHBOARD_CACHE_TIMEOUT', 300))
+    return value
+
+
+def invalidate(role, user_ids):
+    keys = [fragment_key(role, user_id) for user_id in set(user_ids)]
+    if keys:
+        get_cache().delete_many(keys)
+
+
+def stats():
+    """Hit/miss counts and hit rate per role since the stats keys were created."""
+    cache = get_cache()
+    raw = cache.get_many([f"dashboard:stats:{role}:{outcome}" for role in ROLES for outcome in ('hits', 'misses')])
+    result = {}
+    for role in ROLES:
+        hits = raw.get(f"dashboard:stats:{role}:hits", 0)
+        misses = raw.get(f"dashboard:stats:{role}:misses", 0)
+        total = hits + misses
+        result[role] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+    return result
+
+
+# Invalidation ----------------------------------------------------------------
+#
+# Invalidations run on commit, after the dashboard counter updates queued by
+# his/counters.py for the same save (receivers connected earlier run first),
+# so a reader cannot re-cache a figure from before the commit.
+
+TRACKED_FIELDS = {
+    Appointment: ['doctor_id'],
+    Visit: ['attending_doctor_id', 'bed_id'],
+    Ward: ['nurse_in_charge_id'],
+}
+
+
+def _remember_previous(sender, instance, raw=False, **kwargs):
+    instance._dashboard_previous = {}
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._dashboard_previous = sender._default_manager.filter(pk=instance.pk).values(
+        *TRACKED_FIELDS[sender]
+    ).first() or {}
+
+
+def _take_previous(instance):
+    # Popped so a later delete() of the same instance does not reuse it
+    return instance.__dict__.pop('_dashboard_previous', {})
+
+
+def _ward_nurses(bed_ids):
+    bed_ids = [bed_id for bed_id in bed_ids if bed_id]
+    if not bed_ids:
+        return []
+    return list(Bed.objects.filter(id__in=bed_ids).values_list('ward__nurse_in_charge_id', flat=True))
+
+
+def _on_appointment_change(sender, instance, **kwargs):
+    doctors = [instance.doctor_id, _take_previous(instance).get('doctor_id')]
+    transaction.on_commit(lambda: invalidate('doctor', filter(None, doctors)))
+
+
+def _on_visit_change(sender, instance, **kwargs):
+    previous = _take_previous(instance)
+    doctors = [instance.attending_doctor_id, previous.get('attending_doctor_id')]
+    beds = [instance.bed_id, previous.get('bed_id')]
+
+    def run():
+        invalidate('doctor', filter(None, doctors))
+        invalidate('nurse', filter(None, _ward_nurses(beds)))
+        invalidate('nurse', [None])  # vitals_pending is shared by all nurses
+    transaction.on_commit(run)
+
+
+def _on_vitals_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate('nurse', [None]))
+
+
+def _on_ward_change(sender, instance, **kwargs):
+    nurses = [instance.nurse_in_charge_id, _take_previous(instance).get('nurse_in_charge_id')]
+    transaction.on_commit(lambda: invalidate('nurse', filter(None, nurses)))
+
+
+def _on_billing_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate('finance', [None]))
+
+
+for _model in TRACKED_FIELDS:
+    pre_save.connect(_remember_previous, sender=_model, dispatch_uid=f"dashboard_cache_pre_save_{_model.__name__}")
+
+for _model, _receiver in [
+    (Appointment, _on_appointment_change),
+    (Visit, _on_visit_change),
+    (Vitals, _on_vitals_change),
+    (Ward, _on_ward_change),
+    (Payment, _on_billing_change),
+    (Invoice, _on_billing_change),
+]:
+    post_save.connect(_receiver, sender=_model, dispatch_uid=f"dashboard_cache_post_save_{_model.__name__}")
+    post_delete.connect(_receiver, sender=_model, dispatch_uid=f"dashboard_cache_post_delete_{_model.__name__}")
@@ -0,0 +1,160 @@
+# his/dispensing.py
+"""
+Dispensing with First-Expiry-First-Out batch allocation.
+
+dispense_prescription() works out what is still outstanding on each
+PrescriptionItem, reads the unexpired PharmacyStock batches of those
+medications, and takes each item's quantity from the batch that expires
+first (batches without an expiry date last). It then writes one
+MedicationDispense and one ledger StockMovement per batch used with
+bulk_create, and takes the quantities off the batches with a single
+conditional UPDATE (his/stock_ledger.py), all in one transaction. If a
+concurrent dispense emptied a batch in the meantime, the UPDATE refuses,
+the transaction rolls back and the allocation is retried. A prescription
+of any length costs the same handful of queries.
+
+If a medication is short the whole prescription is rolled back with
+InsufficientStock, unless partial dispensing was asked for, in which case
+what is on hand is dispensed and the shortfall is reported.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import bulk, counters, stock_ledger
+from .models import MedicationDispense, PharmacyStock, Prescription, StockMovement
+
+ZERO = Decimal('0')
+ALLOCATION_ATTEMPTS = 3
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        self.shortages = shortages  # [{'item', 'medication_name', 'requested', 'available'}]
+        super().__init__(', '.join(
+            f"{shortage['medication_name']}: {shortage['available']} of {shortage['requested']} available"
+            for shortage in shortages
+        ))
+
+
+def fefo_key(batch):
+    return (batch.expiry_date is None, batch.expiry_date, batch.pk)
+
+
+def allocate(wanted, batches):
+    """
+    FEFO allocation. `wanted` is a list of (item id, medication name, quantity)
+    and `batches` the usable PharmacyStock rows. Returns (allocations,
+    shortages): allocations maps item id to [(batch, quantity)], shortages
+    maps item id to the quantity that could not be covered. Batch quantities
+    are decremented in place.
+    """
+    by_medication = {}
+    for batch in sorted(batches, key=fefo_key):
+        by_medication.setdefault(batch.medication_name, []).append(batch)
+
+    allocations, shortages = OrderedDict(), {}
+    for item_id, medication_name, quantity in wanted:
+        remaining = quantity
+        for batch in by_medication.get(medication_name, []):
+            if remaining <= 0:
+                break
+            taken = min(batch.quantity, remaining)
+            if taken <= 0:
+                continue
+            batch.quantity -= taken
+            remaining -= taken
+            allocations.setdefault(item_id, []).append((batch, taken))
+        if remaining > 0:
+            shortages[item_id] = remaining
+    return allocations, shortages
+
+
+def outstanding_items(prescription):
+    """Items of `prescription` with their undispensed quantity as `outstanding`."""
+    return [
+        item for item in prescription.items.annotate(
+            outstanding=F('quantity') - Coalesce(
+                Sum('dispenses__quantity_dispensed'), Value(ZERO), output_field=DecimalField()
+            ),
+        ).order_by('pk')
+        if item.outstanding > 0
+    ]
+
+
+def dispense_prescription(prescription, dispensed_by=None, patient_counseled=False, partial=False):
+    """
+    Dispense everything still outstanding on `prescription`. Returns
+    (dispenses, shortages) with shortages as for InsufficientStock; raises
+    InsufficientStock instead when `partial` is not set.
+    """
+    for attempt in range(ALLOCATION_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return _dispense(prescription, dispensed_by, patient_counseled, partial)
+        except stock_ledger.NegativeBalance:
+            # Another dispense emptied a batch between our read and our write
+            if attempt == ALLOCATION_ATTEMPTS - 1:
+                raise
+
+
+def _dispense(prescription, dispensed_by, patient_counseled, partial):
+    # Serialises dispenses of the same prescription so nothing is dispensed twice
+    list(Prescription.objects.select_for_update().filter(pk=prescription.pk).values_list('pk'))
+    items = outstanding_items(prescription)
+    if not items:
+        return [], []
+    today = timezone.localdate()
+    now = timezone.now()
+
+    batches = list(
+        PharmacyStock.objects
+        .filter(medication_name__in={item.medication_name for item in items}, quantity__gt=0)
+        .exclude(expiry_date__lt=today)
+        .only('pk', 'medication_name', 'batch_number', 'expiry_date', 'quantity')
+    )
+    allocations, missing = allocate(
+        [(item.pk, item.medication_name, item.outstanding) for item in items], batches,
+    )
+    shortages = [
+        {
+            'item': item.pk,
+            'medication_name': item.medication_name,
+            'requested': item.outstanding,
+            'available': item.outstanding - missing[item.pk],
+        }
+        for item in items if item.pk in missing
+    ]
+    if shortages and not partial:
+        raise InsufficientStock(shortages)
+
+    dispenses, taken_from = [], []
+    for item_id, parts in allocations.items():
+        for batch, quantity in parts:
+            dispenses.append(MedicationDispense(
+                prescription_item_id=item_id, batch_number=batch.batch_number,
+                quantity_dispensed=quantity, dispensed_by=dispensed_by, dispensed_at=now,
+                patient_counseled=patient_counseled,
+            ))
+            taken_from.append(batch)
+    if not dispenses:
+        return [], shortages
+    # The movements point at the dispenses, and apply_movements() reads them back by id
+    bulk.create(MedicationDispense, dispenses, key=['prescription_item_id', 'batch_number'])
+    movements = bulk.create(StockMovement, [
+        StockMovement(
+            stock=batch, kind='dispense', quantity=-dispense.quantity_dispensed,
+            dispense=dispense, created_by=dispensed_by, created_at=now,
+        )
+        for dispense, batch in zip(dispenses, taken_from)
+    ], key=['dispense_id'])
+    # Last statement before commit: the batch rows are locked only from here
+    stock_ledger.apply_movements(movements)
+
+    # bulk_create sends no signals; keep the dispense dashboard counter in step
+    counters.record_bulk(MedicationDispense, [(None, dispense) for dispense in dispenses])
+    return dispenses, shortages
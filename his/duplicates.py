@@ -0,0 +1,315 @@
+# his/duplicates.py
+"""
+Duplicate-patient detection.
+
+Each patient gets a few PatientMatchKey rows ("blocking keys"). Two patients
+are only ever compared in detail when they share a key, which keeps both the
+check at registration and the whole-table scan close to linear:
+
+* 'n:<codes>:<window>' Soundex of first and last name (sorted, so swapped
+                       names still collide) plus a birth-year window. Every
+                       year y is stored under windows y // 2 and (y + 1) // 2,
+                       so birth years one apart always share a window. The
+                       birth year comes from the DOB, or from the age at
+                       registration when only the age is known;
+* 'p:<code>:<digits>'  Soundex of the first name plus the last
+                       PHONE_SUFFIX_LENGTH digits of the contact number.
+
+Placeholder names used by the emergency desk ("Emergency Patient") never get
+a name key, otherwise every unidentified admission would match every other.
+Keys are rebuilt on Patient save; rows written with bulk_create() or update()
+need the find_duplicate_patients --rebuild-keys command.
+"""
+from datetime import date
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import Patient, PatientMatchKey
+from .search_index import digits_only, normalize
+
+PHONE_SUFFIX_LENGTH = 7
+PLACEHOLDER_NAMES = {'emergency', 'patient', 'unknown', 'unidentified'}
+MATCH_FIELDS = ['uid', 'mrn', 'first_name', 'last_name', 'dob', 'age', 'contact_number', 'created_at']
+INDEXED_FIELDS = {'first_name', 'last_name', 'dob', 'age', 'contact_number'}
+
+# A pair scoring at least this much is reported as a likely duplicate
+DUPLICATE_THRESHOLD = 0.75
+# Registration checks read at most this many patients sharing a key
+MAX_CANDIDATES = 50
+# The batch scan skips keys shared by more patients than this (too common to be evidence)
+MAX_BLOCK_SIZE = 200
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def soundex(word):
+    """American Soundex code of a word ('' for an empty word)."""
+    letters = [char for char in normalize(word) if char.isalpha()]
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], '')
+    for char in letters[1:]:
+        digit = _SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def _is_placeholder(name):
+    words = normalize(name).split()
+    return not words or all(word in PLACEHOLDER_NAMES for word in words)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_date(value):
+    if isinstance(value, date) or not value:
+        return value or None
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def birth_year(dob=None, age=None, registered_at=None):
+    dob = _to_date(dob)
+    if dob:
+        return dob.year
+    age = _to_int(age)
+    if age is None:
+        return None
+    return timezone.localtime(registered_at or timezone.now()).year - age
+
+
+def match_keys(first_name, last_name='', dob=None, age=None, contact_number='', registered_at=None):
+    keys = set()
+    first = soundex(first_name)
+    if not _is_placeholder(f"{first_name} {last_name}"):
+        codes = '-'.join(sorted(filter(None, [first, soundex(last_name)])))
+        year = birth_year(dob, age, registered_at)
+        if year is not None:
+            keys.update(f"n:{codes}:{window}" for window in {year // 2, (year + 1) // 2})
+    phone = digits_only(contact_number)
+    if len(phone) >= PHONE_SUFFIX_LENGTH:
+        keys.add(f"p:{first}:{phone[-PHONE_SUFFIX_LENGTH:]}")
+    return keys
+
+
+def _keys_for(patient):
+    return match_keys(
+        patient.first_name, patient.last_name, patient.dob, patient.age,
+        patient.contact_number, patient.created_at,
+    )
+
+
+def index_patients(patients):
+    """Replace the match keys of the given Patient instances."""
+    patients = list(patients)
+    rows = [PatientMatchKey(patient_id=patient.pk, key=key) for patient in patients for key in _keys_for(patient)]
+    with transaction.atomic():
+        PatientMatchKey.objects.filter(patient_id__in=[patient.pk for patient in patients]).delete()
+        PatientMatchKey.objects.bulk_create(rows, batch_size=5000)
+    return len(rows)
+
+
+def rebuild(chunk_size=2000):
+    """Rebuild every match key; returns (patients, keys) written."""
+    PatientMatchKey.objects.all().delete()
+    patients = keys = 0
+    chunk = []
+    for patient in Patient.objects.only(*MATCH_FIELDS).order_by('pk').iterator(chunk_size=chunk_size):
+        chunk.append(patient)
+        if len(chunk) == chunk_size:
+            keys += index_patients(chunk)
+            patients += len(chunk)
+            chunk = []
+    if chunk:
+        keys += index_patients(chunk)
+        patients += len(chunk)
+    return patients, keys
+
+
+# Scoring -----------------------------------------------------------------------
+
+def _name_similarity(a_first, a_last, b_first, b_last):
+    a = normalize(f"{a_first} {a_last}")
+    return max(
+        SequenceMatcher(None, a, normalize(f"{b_first} {b_last}")).ratio(),
+        SequenceMatcher(None, a, normalize(f"{b_last} {b_first}")).ratio(),
+    )
+
+
+def score(a, b):
+    """
+    Likelihood (0-1) that two patients are the same person. `a` and `b`
+    are dicts with the MATCH_FIELDS values. Names weigh half; birth date and
+    phone a quarter each, with unknown values counting as half a match.
+    """
+    total = 0.5 * _name_similarity(a['first_name'], a['last_name'], b['first_name'], b['last_name'])
+
+    a_dob, b_dob = _to_date(a['dob']), _to_date(b['dob'])
+    a_year = birth_year(a_dob, a['age'], a.get('created_at'))
+    b_year = birth_year(b_dob, b['age'], b.get('created_at'))
+    if a_dob and b_dob and a_dob == b_dob:
+        total += 0.25
+    elif a_year is None or b_year is None:
+        total += 0.125
+    elif abs(a_year - b_year) <= 1:
+        total += 0.2
+
+    a_phone = digits_only(a['contact_number'])[-PHONE_SUFFIX_LENGTH:]
+    b_phone = digits_only(b['contact_number'])[-PHONE_SUFFIX_LENGTH:]
+    if not a_phone or not b_phone:
+        total += 0.125
+    elif a_phone == b_phone:
+        total += 0.25
+    return round(total, 3)
+
+
+def find_candidates(first_name, last_name='', dob=None, age=None, contact_number='',
+                    exclude=None, limit=5, threshold=DUPLICATE_THRESHOLD):
+    """
+    Existing patients likely to be the person being registered, as a list of
+    (patient, score) pairs, best first.
+    """
+    keys = match_keys(first_name, last_name, dob, age, contact_number)
+    if not keys:
+        return []
+    ids = PatientMatchKey.objects.filter(key__in=keys).values_list('patient_id', flat=True)
+    if exclude is not None:
+        ids = ids.exclude(patient_id=exclude)
+    ids = list(ids.distinct()[:MAX_CANDIDATES])
+    if not ids:
+        return []
+
+    probe = {
+        'first_name': first_name, 'last_name': last_name or '', 'dob': dob, 'age': age,
+        'contact_number': contact_number or '', 'created_at': None,
+    }
+    scored = []
+    for patient in Patient.objects.filter(pk__in=ids).only(*MATCH_FIELDS):
+        value = score(probe, {field: getattr(patient, field) for field in MATCH_FIELDS})
+        if value >= threshold:
+            scored.append((patient, value))
+    scored.sort(key=lambda pair: pair[1], reverse=True)
+    return scored[:limit]
+
+
+def describe(candidates):
+    """JSON-friendly form of find_candidates() output."""
+    return [
+        {
+            'patient_id': str(patient.uid),
+            'mrn': patient.mrn,
+            'name': f"{patient.first_name} {patient.last_name}".strip(),
+            'score': value,
+        }
+        for patient, value in candidates
+    ]
+
+
+# Whole-table scan --------------------------------------------------------------
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+
+
+def _blocks(max_block_size):
+    """Groups of patient ids sharing a key, read in one ordered pass over the key index."""
+    rows = PatientMatchKey.objects.order_by('key', 'patient_id').values_list('key', 'patient_id')
+    current, members = None, []
+    for key, patient_id in rows.iterator(chunk_size=5000):
+        if key != current:
+            if 1 < len(members) <= max_block_size:
+                yield members
+            current, members = key, []
+        members.append(patient_id)
+    if 1 < len(members) <= max_block_size:
+        yield members
+
+
+def find_clusters(threshold=DUPLICATE_THRESHOLD, max_block_size=MAX_BLOCK_SIZE, batch_size=2000):
+    """
+    Clusters of likely duplicate patients across the whole table, as lists
+    of patient ids. Only patients sharing a blocking key are compared, and
+    matching pairs are merged transitively.
+    """
+    clusters = _UnionFind()
+    compared = set()
+    pending = []
+
+    def flush():
+        ids = {patient_id for block in pending for patient_id in block}
+        values = {
+            row['uid']: row for row in Patient.objects.filter(pk__in=ids).values(*MATCH_FIELDS)
+        }
+        for block in pending:
+            for i, a in enumerate(block):
+                for b in block[i + 1:]:
+                    pair = (a, b) if str(a) < str(b) else (b, a)
+                    if pair in compared or a not in values or b not in values:
+                        continue
+                    compared.add(pair)
+                    if score(values[a], values[b]) >= threshold:
+                        clusters.union(a, b)
+        pending.clear()
+
+    pending_size = 0
+    for block in _blocks(max_block_size):
+        pending.append(block)
+        pending_size += len(block)
+        if pending_size >= batch_size:
+            flush()
+            pending_size = 0
+    if pending:
+        flush()
+
+    groups = {}
+    for patient_id in list(clusters.parent):
+        groups.setdefault(clusters.find(patient_id), []).append(patient_id)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def _reindex_patient(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not INDEXED_FIELDS & set(update_fields):
+        return
+    index_patients([instance])
+
+
+post_save.connect(_reindex_patient, sender=Patient, dispatch_uid='duplicates_reindex_patient')
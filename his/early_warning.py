@@ -0,0 +1,170 @@
+# his/early_warning.py
+"""
+NEWS2 early warning scores for every active inpatient.
+
+The latest Vitals row of each active IPD visit is loaded in one query and
+the readings are scored one parameter column at a time against the NEWS2
+bands, so a ward of any size costs one query and a handful of list passes.
+Supplemental oxygen and consciousness (AVPU) are not recorded in Vitals;
+patients are scored as on room air and alert, using SpO2 scale 1.
+
+worklist() returns the visits sorted by acuity for the ward view, and
+escalate() notifies the attending doctor and the ward's nurse in charge of
+medium and high risk scores, once per reading.
+"""
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.db.models import OuterRef, Subquery
+from django.urls import reverse
+from django.utils import timezone
+
+from . import notifications
+from .models import Notification, Visit, Vitals
+
+# parameter -> (upper bounds of each band, score of each band); a value equal
+# to a bound falls in that bound's band
+BANDS = {
+    'respiratory_rate': ([8, 11, 20, 24], [3, 1, 0, 2, 3]),
+    'oxygen_saturation': ([91, 93, 95], [3, 2, 1, 0]),
+    'systolic_bp': ([90, 100, 110, 219], [3, 2, 1, 0, 3]),
+    'pulse': ([40, 50, 90, 110, 130], [3, 1, 0, 1, 2, 3]),
+    'temperature': ([35.0, 36.0, 38.0, 39.0], [3, 1, 0, 1, 2]),
+}
+PARAMETERS = list(BANDS)
+
+LOW, LOW_MEDIUM, MEDIUM, HIGH = 'low', 'low-medium', 'medium', 'high'
+RISK_RANK = {HIGH: 3, MEDIUM: 2, LOW_MEDIUM: 1, LOW: 0}
+ESCALATE = {MEDIUM: 'high', HIGH: 'urgent'}  # risk -> notification priority
+# NEWS2 asks for at least 12-hourly observations; older readings are flagged
+STALE_AFTER = timedelta(hours=12)
+
+
+def score_column(parameter, values):
+    """NEWS2 sub-scores for a column of readings; None stays None."""
+    bounds, scores = BANDS[parameter]
+    return [None if value is None else scores[bisect_left(bounds, float(value))] for value in values]
+
+
+def risk(total, red_flag):
+    if total >= 7:
+        return HIGH
+    if total >= 5:
+        return MEDIUM
+    if red_flag:
+        return LOW_MEDIUM
+    return LOW
+
+
+def latest_vitals(visits):
+    """Latest Vitals row of each visit in `visits`, as one query."""
+    latest = Vitals.objects.filter(visit=OuterRef('pk')).order_by('-recorded_at', '-id').values('id')[:1]
+    return (
+        Vitals.objects.filter(pk__in=Subquery(visits.annotate(latest_id=Subquery(latest)).values('latest_id')))
+        .values_list('visit_id', 'id', 'recorded_at', *PARAMETERS)
+    )
+
+
+def scores(visits=None, now=None):
+    """
+    {visit_id: score dict} for the latest reading of each visit (default:
+    all active IPD visits). Visits without vitals are left out.
+    """
+    if visits is None:
+        visits = Visit.objects.filter(status='active', visit_type='ipd')
+    now = now or timezone.now()
+    rows = list(latest_vitals(visits))
+    if not rows:
+        return {}
+
+    visit_ids, vitals_ids, recorded = [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
+    columns = {
+        parameter: score_column(parameter, [row[3 + index] for row in rows])
+        for index, parameter in enumerate(PARAMETERS)
+    }
+    totals = [sum(column[i] or 0 for column in columns.values()) for i in range(len(rows))]
+    red_flags = [any(column[i] == 3 for column in columns.values()) for i in range(len(rows))]
+
+    result = {}
+    for i, visit_id in enumerate(visit_ids):
+        result[visit_id] = {
+            'vitals_id': vitals_ids[i],
+            'recorded_at': recorded[i],
+            'score': totals[i],
+            'risk': risk(totals[i], red_flags[i]),
+            'red_flag': red_flags[i],
+            'components': {parameter: columns[parameter][i] for parameter in PARAMETERS},
+            'missing': [parameter for parameter in PARAMETERS if columns[parameter][i] is None],
+            'stale': now - recorded[i] > STALE_AFTER,
+        }
+    return result
+
+
+def worklist(ward=None, now=None):
+    """
+    Active IPD visits (optionally on one ward) sorted by acuity: risk, then
+    score, then the oldest reading first. Visits with no vitals come last.
+    """
+    visits = Visit.objects.filter(status='active', visit_type='ipd')
+    if ward is not None:
+        visits = visits.filter(bed__ward=ward)
+    by_visit = scores(visits, now)
+    entries = [
+        {'visit': visit, 'news2': by_visit.get(visit.pk)}
+        for visit in visits.select_related('patient', 'bed__ward', 'attending_doctor')
+    ]
+
+    def acuity(entry):
+        news2 = entry['news2']
+        if news2 is None:
+            return (1, 0, 0, 0)
+        return (0, -RISK_RANK[news2['risk']], -news2['score'], news2['recorded_at'].timestamp())
+
+    entries.sort(key=acuity)
+    return entries
+
+
+def _action_url(entry):
+    return f"{reverse('ward-management')}?visit={entry['visit'].pk}&vitals={entry['news2']['vitals_id']}"
+
+
+def escalate(entries):
+    """
+    Notify the attending doctor and ward nurse in charge of every medium or
+    high risk entry from worklist(). A reading is escalated once: entries
+    whose action URL already has a notification are skipped. Returns the
+    notifications created.
+    """
+    due = [
+        entry for entry in entries
+        if entry['news2'] and entry['news2']['risk'] in ESCALATE and not entry['news2']['stale']
+    ]
+    if not due:
+        return []
+    sent = set(
+        Notification.objects.filter(action_url__in=[_action_url(entry) for entry in due])
+        .values_list('recipient_id', 'action_url')
+    )
+
+    rows = []
+    for entry in due:
+        visit, news2 = entry['visit'], entry['news2']
+        ward = visit.bed.ward if visit.bed_id else None
+        url = _action_url(entry)
+        recipients = {visit.attending_doctor_id, ward.nurse_in_charge_id if ward else None} - {None}
+        for recipient_id in recipients:
+            if (recipient_id, url) in sent:
+                continue
+            rows.append(Notification(
+                recipient_id=recipient_id,
+                title=f"NEWS2 {news2['score']} ({news2['risk']} risk): {visit.patient.first_name} {visit.patient.last_name}",
+                message=(
+                    f"Visit {visit.visit_id}"
+                    + (f", {ward.name} bed {visit.bed.bed_number}" if ward else '')
+                    + f". Reading at {timezone.localtime(news2['recorded_at']):%Y-%m-%d %H:%M} scored {news2['score']}"
+                    + ('; one parameter scored 3' if news2['red_flag'] else '') + '.'
+                ),
+                priority=ESCALATE[news2['risk']],
+                action_url=url,
+            ))
+    return notifications.bulk_notify(rows)
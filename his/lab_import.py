@@ -0,0 +1,306 @@
+# his/lab_import.py
+"""
+Bulk entry of lab results from analyzer output files.
+
+Two formats are read:
+
+CSV with a header row. order_id and test_code are required; result_value,
+result_text, is_abnormal (true/false or an analyzer flag such as H or LL)
+and reported_at are optional:
+
+    order_id,test_code,result_value,is_abnormal,reported_at
+    1042,GLU,5.4,,2025-09-16T10:01:00Z
+
+ASTM E1394-style records as sent by chemistry analyzers. The delimiters are
+taken from the H record. Each O record names the order (its specimen id is
+the LabOrder id) and its R records carry one result each:
+
+    H|\\^&|||Analyzer
+    O|1|1042||^^^GLU
+    R|1|^^^GLU|5.4|mmol/L|3.9-5.8|N||F||||20250916100100
+    L|1|N
+
+All results of a file are validated together. The LabOrderItems are resolved
+from (order id, test code) pairs with one query, the results are flagged
+against their tests' reference ranges (his/reference_ranges.py) and written
+with bulk_create, and the items and orders are marked completed with one
+UPDATE per status, all in a single transaction. Invalid lines are reported
+by index and never block the valid ones.
+
+Analyzers retransmit, so importing a file again is harmless. A result whose
+item already has the same value is skipped. A different value for an item
+that already has a result is rejected, since that is an amendment and goes
+through the result itself. The items are locked before that check, so a
+retransmission that races the original import waits for it and then skips.
+"""
+import csv
+import io
+from datetime import datetime
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import bulk, counters, lab_worklist, reference_ranges
+from .models import LabOrder, LabOrderItem, LabResult
+
+DEFAULT_MAX_RESULTS = 5000
+FIELDS = ['order_id', 'test_code', 'result_value', 'result_text', 'is_abnormal', 'reported_at']
+# ASTM abnormal flags meaning "outside the reference range"
+ABNORMAL_FLAGS = {'L', 'H', 'LL', 'HH', '<', '>', 'A', 'AA', 'U', 'D', 'B', 'W'}
+TRUE_VALUES = {'true', '1', 'yes', 'y'}
+FALSE_VALUES = {'false', '0', 'no', 'n', ''}
+CLOSED_ORDER_STATUSES = {'cancelled'}
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def max_results():
+    return getattr(settings, 'HIS_LAB_IMPORT_MAX_RESULTS', DEFAULT_MAX_RESULTS)
+
+
+def detect_format(text, content_type=''):
+    if 'csv' in content_type:
+        return 'csv'
+    if 'astm' in content_type:
+        return 'astm'
+    first = text.lstrip()[:2]
+    return 'astm' if first[:1] == 'H' and first[1:2] and not first[1:2].isalnum() else 'csv'
+
+
+def parse_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {'order_id', 'test_code'} <= {name.strip() for name in reader.fieldnames}:
+        raise PayloadError('CSV needs a header row with at least order_id and test_code')
+    try:
+        return [
+            {name.strip(): (value or '').strip() for name, value in row.items() if name and name.strip() in FIELDS}
+            for row in reader
+        ]
+    except csv.Error as exc:
+        raise PayloadError(f'Invalid CSV: {exc}')
+
+
+def parse_astm(text):
+    lines = [line.strip() for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n') if line.strip()]
+    if not lines or not lines[0].startswith('H') or len(lines[0]) < 5:
+        raise PayloadError('ASTM data must start with an H (header) record')
+    field, component = lines[0][1], lines[0][3]
+
+    results, order_id = [], ''
+    for line in lines[1:]:
+        # Frame numbers (e.g. "2R|...") from a raw capture are ignored
+        line = line.lstrip('0123456789')
+        parts = line.split(field)
+        kind = parts[0]
+        if kind == 'O':
+            order_id = parts[2].split(component)[0] if len(parts) > 2 else ''
+        elif kind == 'R':
+            parts += [''] * (13 - len(parts))
+            test = [piece for piece in parts[2].split(component) if piece]
+            flag = parts[6].strip()
+            results.append({
+                'order_id': order_id,
+                'test_code': test[0] if test else '',
+                'result_value': parts[3],
+                'is_abnormal': flag,
+                'reported_at': parts[12],
+            })
+    return results
+
+
+def parse_payload(body, content_type='', file_format=None):
+    try:
+        text = body.decode('utf-8-sig') if isinstance(body, bytes) else body
+    except UnicodeDecodeError:
+        raise PayloadError('File is not UTF-8 text')
+    file_format = file_format or detect_format(text, content_type)
+    if file_format == 'csv':
+        return parse_csv(text)
+    if file_format == 'astm':
+        return parse_astm(text)
+    raise PayloadError(f'Unknown format "{file_format}"; use csv or astm')
+
+
+def _abnormal(value):
+    value = str(value).strip()
+    if value.lower() in TRUE_VALUES or value.upper() in ABNORMAL_FLAGS:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError
+
+
+def _timestamp(value):
+    value = str(value).strip()
+    if value.isdigit() and len(value) in (12, 14):
+        # ASTM date-time: YYYYMMDDHHMM[SS]
+        return datetime.strptime(value.ljust(14, '0'), '%Y%m%d%H%M%S')
+    return parse_datetime(value)
+
+
+def validate(results):
+    """
+    Column-wise validation of a file's results. Returns (rows, errors): rows
+    maps the result index to LabResult field values, errors maps it to
+    {field: [messages]}.
+    """
+    errors = {}
+
+    def fail(index, field, message):
+        errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+    rows = {index: {} for index in range(len(results))}
+
+    # order_id + test_code -> LabOrderItem: one query for the whole file
+    keys = {}
+    for index, result in enumerate(results):
+        order_id, code = str(result.get('order_id') or '').strip(), str(result.get('test_code') or '').strip()
+        if not order_id.isdigit():
+            fail(index, 'order_id', 'A valid order id is required.')
+        if not code:
+            fail(index, 'test_code', 'This field is required.')
+        if index not in errors:
+            keys[index] = (int(order_id), code)
+    items = {
+        (order_id, code): (pk, order_status)
+        for pk, order_id, code, order_status in LabOrderItem.objects.filter(
+            lab_order_id__in={order_id for order_id, _ in keys.values()},
+            lab_test__code__in={code for _, code in keys.values()},
+        ).values_list('pk', 'lab_order_id', 'lab_test__code', 'lab_order__status')
+    }
+    seen = {}
+    for index, key in keys.items():
+        if key not in items:
+            fail(index, 'test_code', f'Order {key[0]} has no {key[1]} test.')
+        elif items[key][1] in CLOSED_ORDER_STATUSES:
+            fail(index, 'order_id', f'Order {key[0]} is {items[key][1]}.')
+        elif key in seen:
+            fail(index, 'test_code', f'Duplicate of result {seen[key]}.')
+        else:
+            seen[key] = index
+            rows[index]['lab_order_item_id'] = items[key][0]
+
+    now = timezone.now()
+    for index, result in enumerate(results):
+        raw = result.get('reported_at')
+        if raw in (None, ''):
+            rows[index]['reported_at'] = now
+            continue
+        try:
+            value = _timestamp(raw)
+        except ValueError:
+            value = None
+        if value is None:
+            fail(index, 'reported_at', 'Invalid datetime.')
+            continue
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        rows[index]['reported_at'] = value
+
+    for index, result in enumerate(results):
+        try:
+            rows[index]['is_abnormal'] = _abnormal(result.get('is_abnormal') or '')
+        except ValueError:
+            fail(index, 'is_abnormal', 'Use true/false or an analyzer flag such as H or L.')
+        value, text = str(result.get('result_value') or ''), str(result.get('result_text') or '')
+        if not value and not text:
+            fail(index, 'result_value', 'A result value or text is required.')
+        elif len(value) > LabResult._meta.get_field('result_value').max_length:
+            fail(index, 'result_value', 'Result value is too long.')
+        rows[index]['result_value'], rows[index]['result_text'] = value, text
+
+    return {index: row for index, row in rows.items() if index not in errors}, errors
+
+
+def _already_reported(rows, errors):
+    """
+    Drop rows whose item already has a result: skipped when the value is the
+    same, an error otherwise. Call inside the import transaction. Returns the
+    indexes skipped.
+    """
+    item_ids = [row['lab_order_item_id'] for row in rows.values()]
+    # Serialises imports of the same items, so a retransmission racing the original sees its results
+    list(LabOrderItem.objects.select_for_update().filter(pk__in=item_ids).values_list('pk'))
+    existing = {}
+    for item_id, value, text in LabResult.objects.filter(lab_order_item_id__in=item_ids).values_list(
+        'lab_order_item_id', 'result_value', 'result_text',
+    ):
+        existing.setdefault(item_id, set()).add((value, text))
+    skipped = []
+    for index, row in list(rows.items()):
+        reported = existing.get(row['lab_order_item_id'])
+        if reported is None:
+            continue
+        if (row['result_value'], row['result_text']) in reported:
+            skipped.append(index)
+        else:
+            errors[index] = {'result_value': ['This test already has a different result; amend that result instead.']}
+        del rows[index]
+    return skipped
+
+
+def import_results(results, reported_by=None):
+    """
+    Validate and store a file's results. Returns (created, skipped, errors):
+    skipped counts results that were already stored, errors is a list of
+    {'index', 'order_id', 'test_code', 'errors'}.
+    """
+    rows, errors = validate(results)
+    skipped = []
+    with transaction.atomic():
+        if rows:
+            skipped = _already_reported(rows, errors)
+        objects = [LabResult(reported_by=reported_by, **row) for _, row in sorted(rows.items())]
+        if objects:
+            # bulk_create skips the pre_save flagging; a test's reference range overrides the analyzer flag
+            critical = reference_ranges.flag(objects)
+            # The critical alerts link to the results, so they need their ids
+            bulk.create(LabResult, objects, key=['lab_order_item_id'])
+            reference_ranges.notify_critical(critical)
+            _complete([result.lab_order_item_id for result in objects])
+            # bulk_create sends no signals; keep the results-reported counter in step
+            counters.record_bulk(LabResult, [(None, result) for result in objects])
+
+    report = [
+        {
+            'index': index,
+            'order_id': results[index].get('order_id'),
+            'test_code': results[index].get('test_code'),
+            'errors': field_errors,
+        }
+        for index, field_errors in sorted(errors.items())
+    ]
+    return len(objects), len(skipped), report
+
+
+def _complete(item_ids):
+    """Mark the items completed, and their orders completed or in progress."""
+    now = timezone.now()
+    LabOrderItem.objects.filter(pk__in=item_ids).exclude(status=lab_worklist.DONE).update(
+        status=lab_worklist.DONE, completed_at=now,
+    )
+    orders = dict(
+        LabOrder.objects.filter(laborderitem__pk__in=item_ids).exclude(status__in=CLOSED_ORDER_STATUSES)
+        .distinct().values_list('pk', 'status')
+    )
+    open_orders = set(
+        LabOrderItem.objects.filter(lab_order_id__in=orders).exclude(status__in=[lab_worklist.DONE, 'cancelled'])
+        .values_list('lab_order_id', flat=True).distinct()
+    )
+    changes = {}
+    for order_id, order_status in orders.items():
+        target = 'in_progress' if order_id in open_orders else 'completed'
+        if order_status != target:
+            changes.setdefault(target, []).append(order_id)
+    for target, order_ids in changes.items():
+        LabOrder.objects.filter(pk__in=order_ids).update(status=target)
+    # The UPDATEs send no signals; keep the lab order counters in step
+    counters.record_bulk(LabOrder, [
+        (SimpleNamespace(pk=order_id, status=orders[order_id]), SimpleNamespace(pk=order_id, status=target))
+        for target, order_ids in changes.items() for order_id in order_ids
+    ])
@@ -0,0 +1,102 @@
+# his/lab_tat.py
+"""
+Lab turnaround-time (TAT) percentiles.
+
+rollup() pulls the results reported in a range of days as one columnar
+extract. A single query joins LabResult, LabOrderItem and LabOrder and
+returns only the timestamps. Each stage's durations are computed a column
+at a time:
+
+    order_to_collection    LabOrder.created_at -> sample_collected_at
+    collection_to_report   sample_collected_at -> LabResult.reported_at
+    report_to_verify       reported_at -> verified_at
+
+The durations are grouped by (report day, test, priority), and p50 / p90 /
+p99 are stored in LabTatRollup. Dashboards read those rows and never touch
+the order tables. The rollup_lab_tat command rebuilds the most recent days
+on each run, because results reported on earlier days are still being
+verified.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import LabResult, LabTatRollup
+
+STAGES = {
+    'order_to_collection': ('ordered_at', 'collected_at'),
+    'collection_to_report': ('collected_at', 'reported_at'),
+    'report_to_verify': ('reported_at', 'verified_at'),
+}
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(ordered, p):
+    """p-th percentile of a sorted list, interpolating between closest ranks."""
+    position = (len(ordered) - 1) * p / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _minutes(starts, ends):
+    """Column of stage durations in minutes; None where a timestamp is missing or out of order."""
+    return [
+        (end - start).total_seconds() / 60 if start and end and end >= start else None
+        for start, end in zip(starts, ends)
+    ]
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def extract(start, end):
+    """Columns of the results reported in [start, end), as {name: list}."""
+    rows = (
+        LabResult.objects.filter(reported_at__gte=start, reported_at__lt=end, lab_order_item__isnull=False)
+        .order_by()
+        .values_list(
+            'lab_order_item__lab_test_id', 'lab_order_item__lab_order__priority',
+            'lab_order_item__lab_order__created_at', 'lab_order_item__lab_order__sample_collected_at',
+            'reported_at', 'verified_at',
+        )
+    )
+    names = ['lab_test', 'priority', 'ordered_at', 'collected_at', 'reported_at', 'verified_at']
+    columns = list(zip(*rows.iterator(chunk_size=5000)))
+    return {name: list(column) for name, column in zip(names, columns or [()] * len(names))}
+
+
+def summarise(columns):
+    """{(day, lab test id, priority): (results, stats)} from extract() columns."""
+    days = [timezone.localdate(reported_at) for reported_at in columns['reported_at']]
+    durations = {stage: _minutes(columns[start], columns[end]) for stage, (start, end) in STAGES.items()}
+
+    groups = {}
+    for index, key in enumerate(zip(days, columns['lab_test'], columns['priority'])):
+        groups.setdefault(key, []).append(index)
+
+    summary = {}
+    for key, indexes in groups.items():
+        stats = {}
+        for stage, column in durations.items():
+            values = sorted(column[i] for i in indexes if column[i] is not None)
+            if values:
+                stats[stage] = {'count': len(values), 'max': round(values[-1], 1)}
+                stats[stage].update({f'p{p}': round(percentile(values, p), 1) for p in PERCENTILES})
+        summary[key] = (len(indexes), stats)
+    return summary
+
+
+def rollup(first_day, last_day):
+    """(Re)build the LabTatRollup rows of every day in [first_day, last_day]; returns the number written."""
+    summary = summarise(extract(_day_start(first_day), _day_start(last_day + timedelta(days=1))))
+    rollups = [
+        LabTatRollup(day=day, lab_test_id=lab_test_id, priority=priority, results=results, stats=stats)
+        for (day, lab_test_id, priority), (results, stats) in summary.items()
+    ]
+    with transaction.atomic():
+        LabTatRollup.objects.filter(day__gte=first_day, day__lte=last_day).delete()
+        LabTatRollup.objects.bulk_create(rollups, batch_size=2000)
+    return len(rollups)
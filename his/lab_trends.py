@@ -0,0 +1,47 @@
+# his/lab_trends.py
+"""
+Per-patient lab result series for trend charts.
+
+series() answers "every HbA1c of this patient over time" for one or more
+test codes. Each test is returned as columns: a list of report times
+(epoch seconds), a list of numeric values and an abnormal bitmask string
+with one "0"/"1" per result. A single query joins the results to their
+test and order and reads only those columns. Values are coerced with
+reference_ranges.numeric(), so "<0.1" or "140 mmol/L" still chart. Values
+that are not numbers (e.g. "hemolysed") stay in the series as None so the
+columns remain aligned.
+"""
+from .models import LabResult
+from .reference_ranges import numeric
+
+
+def series(patient_id, codes=None, start=None, end=None):
+    """{'series': [...]} of the patient's results of `codes` (all tests when empty) in [start, end)."""
+    results = LabResult.objects.filter(lab_order_item__lab_order__visit__patient_id=patient_id)
+    if codes:
+        results = results.filter(lab_order_item__lab_test__code__in=codes)
+    if start:
+        results = results.filter(reported_at__gte=start)
+    if end:
+        results = results.filter(reported_at__lt=end)
+    rows = results.order_by('lab_order_item__lab_test__code', 'reported_at', 'pk').values_list(
+        'lab_order_item__lab_test__code', 'lab_order_item__lab_test__name', 'lab_order_item__lab_test__unit',
+        'lab_order_item__lab_test__normal_range', 'reported_at', 'result_value', 'is_abnormal',
+    )
+
+    tests = {}
+    for code, name, unit, normal_range, reported_at, value, is_abnormal in rows.iterator(chunk_size=2000):
+        test = tests.get(code)
+        if test is None:
+            test = tests[code] = {
+                'code': code, 'name': name, 'unit': unit, 'normal_range': normal_range,
+                'timestamps': [], 'values': [], 'abnormal': [],
+            }
+        test['timestamps'].append(int(reported_at.timestamp()))
+        test['values'].append(numeric(value))
+        test['abnormal'].append('1' if is_abnormal else '0')
+
+    for test in tests.values():
+        test['abnormal'] = ''.join(test['abnormal'])
+        test['count'] = len(test['timestamps'])
+    return {'series': list(tests.values())}
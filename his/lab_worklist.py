@@ -0,0 +1,158 @@
+# his/lab_worklist.py
+"""
+Bench worklist for lab order items.
+
+When a sample is collected, the order's items are queued on the bench that
+handles them. The queue is the test's sample type, else its department,
+else 'general'. Each item is ranked by the order's priority (STAT 2,
+urgent 1, routine 0). A queue is read through the (queue, status,
+-priority_rank, queued_at) index. The next item is therefore the first
+index entry for the queue, and STAT work jumps ahead of everything queued
+before it.
+
+claim() takes that entry with a conditional UPDATE (... WHERE status =
+'queued'). On backends that support it, the read uses SELECT ... FOR UPDATE
+SKIP LOCKED, so techs pulling from the same queue at the same moment get
+different items instead of queueing behind each other's locks. complete()
+finishes an item and completes the order once nothing is left on it.
+Given a user, complete() and release() only act on that user's claims,
+again through the conditional UPDATE.
+
+escalate_aged() is run by the escalate_lab_worklist command. It raises
+items that have waited too long to urgent and then STAT, so routine work
+cannot starve behind a steady stream of urgent orders.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from . import counters
+from .models import LabOrder, LabOrderItem, LabTest
+
+WAITING, QUEUED, CLAIMED, DONE = 'ordered', 'queued', 'in_progress', 'completed'
+RANK = {'routine': 0, 'urgent': 1, 'stat': 2}
+# Items still queued after this long are raised to at least this rank
+AGE_RANKS = [(timedelta(hours=2), RANK['urgent']), (timedelta(hours=6), RANK['stat'])]
+DEFAULT_QUEUE = 'general'
+CLAIM_ATTEMPTS = 5
+
+
+class WorklistError(Exception):
+    pass
+
+
+def enqueue(lab_order, now=None):
+    """Queue the order's waiting items on their benches; returns the number queued."""
+    bench = LabTest.objects.filter(pk=OuterRef('lab_test_id')).annotate(
+        bench=Coalesce(NullIf('sample_type', Value('')), NullIf('department__name', Value('')), Value(DEFAULT_QUEUE)),
+    ).values('bench')[:1]
+    return LabOrderItem.objects.filter(lab_order=lab_order, status=WAITING).update(
+        status=QUEUED, queue=Subquery(bench), priority_rank=RANK.get(lab_order.priority, 0),
+        queued_at=now or timezone.now(),
+    )
+
+
+def waiting(queue):
+    """Queued items of `queue` in the order they will be claimed."""
+    return LabOrderItem.objects.filter(queue=queue, status=QUEUED).order_by('-priority_rank', 'queued_at', 'pk')
+
+
+def claim(queue, user, now=None):
+    """Assign the next item of `queue` to `user` and return it, or None if the queue is empty."""
+    now = now or timezone.now()
+    for _ in range(CLAIM_ATTEMPTS):
+        with transaction.atomic():
+            candidates = waiting(queue)
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            item = candidates.values_list('pk', 'lab_order_id').first()
+            if item is None:
+                return None
+            item_id, order_id = item
+            if LabOrderItem.objects.filter(pk=item_id, status=QUEUED).update(
+                status=CLAIMED, claimed_by=user, claimed_at=now,
+            ):
+                # Both statuses count as processing; no counter changes
+                LabOrder.objects.filter(pk=order_id, status='sample_collected').update(status='in_progress')
+                return LabOrderItem.objects.select_related('lab_test', 'lab_order__visit__patient').get(pk=item_id)
+        # Another tech claimed it between our read and our update; take the next one
+    return None
+
+
+def _claimed(item, user):
+    """The item if it is claimed (by `user`, when given), as a queryset to UPDATE."""
+    items = LabOrderItem.objects.filter(pk=item.pk, status=CLAIMED)
+    return items.filter(claimed_by=user) if user is not None else items
+
+
+def _not_claimed(item, user):
+    if user is None:
+        return WorklistError(f"Lab order item {item.pk} is not claimed")
+    return WorklistError(f"Lab order item {item.pk} is not claimed by {user.get_username()}")
+
+
+def release(item, user=None):
+    """Put an item claimed (by `user`, when given) back in its queue, keeping its place."""
+    if not _claimed(item, user).update(status=QUEUED, claimed_by=None, claimed_at=None):
+        raise _not_claimed(item, user)
+
+
+def complete(item, user=None, now=None):
+    """
+    Finish an item claimed (by `user`, when given); completes its order when
+    no other item is outstanding.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        if not _claimed(item, user).update(status=DONE, completed_at=now):
+            raise _not_claimed(item, user)
+        outstanding = LabOrderItem.objects.filter(lab_order_id=item.lab_order_id).exclude(
+            status__in=[DONE, 'cancelled'],
+        )
+        if not outstanding.exists() and LabOrder.objects.filter(
+            pk=item.lab_order_id, status__in=['sample_collected', 'in_progress'],
+        ).update(status='completed'):
+            counters.adjust({'lab_orders.processing': -1})
+
+
+def escalate_aged(now=None):
+    """Raise the rank of items that have waited past AGE_RANKS; returns the number raised."""
+    now = now or timezone.now()
+    raised = 0
+    for age, rank in AGE_RANKS:
+        raised += LabOrderItem.objects.filter(
+            status=QUEUED, priority_rank__lt=rank, queued_at__lt=now - age,
+        ).update(priority_rank=rank)
+    return raised
+
+
+def summary():
+    """Depth and oldest wait of every queue by rank, as one grouped query."""
+    rows = (
+        LabOrderItem.objects.filter(status=QUEUED).values('queue', 'priority_rank')
+        .annotate(waiting=Count('pk'), oldest=Min('queued_at')).order_by('queue', '-priority_rank')
+    )
+    queues = {}
+    for row in rows:
+        queue = queues.setdefault(row['queue'], {'queue': row['queue'], 'waiting': 0, 'oldest': None, 'by_rank': {}})
+        queue['waiting'] += row['waiting']
+        queue['by_rank'][row['priority_rank']] = row['waiting']
+        if queue['oldest'] is None or row['oldest'] < queue['oldest']:
+            queue['oldest'] = row['oldest']
+    return list(queues.values())
+
+
+def _reprioritise(sender, instance, created=False, raw=False, **kwargs):
+    # A priority raised after ordering (e.g. routine -> STAT) moves items already waiting
+    if raw or created:
+        return
+    LabOrderItem.objects.filter(
+        lab_order=instance, status__in=[WAITING, QUEUED], priority_rank__lt=RANK.get(instance.priority, 0),
+    ).update(priority_rank=RANK.get(instance.priority, 0))
+
+
+post_save.connect(_reprioritise, sender=LabOrder, dispatch_uid='lab_worklist_reprioritise')
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from his import reference_ranges
+
+
+class Command(BaseCommand):
+    help = "Re-flag lab results as abnormal or normal against their tests' current reference ranges"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=reference_ranges.BACKFILL_CHUNK,
+                            help='Results read per query')
+        parser.add_argument(
+            '--notify-hours', type=int, default=24,
+            help='Notify doctors of critical results reported within this many hours (0 to never notify)',
+        )
+
+    def handle(self, *args, **options):
+        # Ranges may have been edited since this process last compiled them
+        reference_ranges.compile_range.cache_clear()
+        hours = options['notify_hours']
+        changed, sent = reference_ranges.backfill(
+            chunk_size=max(options['chunk_size'], 1),
+            notify_within=timedelta(hours=hours) if hours > 0 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'{changed} result flag(s) changed, {sent} critical notification(s) sent'))
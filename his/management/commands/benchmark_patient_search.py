@@ -0,0 +1,95 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from his import search_index
+from his.models import Patient
+
+FIRST_NAMES = ['aarav', 'vivaan', 'aditya', 'vihaan', 'arjun', 'sai', 'reyansh', 'ayaan', 'krishna', 'ishaan',
+               'ananya', 'diya', 'saanvi', 'aadhya', 'pari', 'anika', 'navya', 'myra', 'sara', 'kiara',
+               'john', 'mary', 'robert', 'linda', 'michael', 'sarah', 'david', 'emily', 'james', 'priya']
+LAST_NAMES = ['sharma', 'verma', 'gupta', 'reddy', 'nair', 'iyer', 'menon', 'rao', 'patel', 'shah',
+              'khan', 'singh', 'das', 'bose', 'pillai', 'kumar', 'joshi', 'mehta', 'smith', 'johnson']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare the patient search index against the legacy icontains query on synthetic patients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1_000_000, help='Synthetic patients to create')
+        parser.add_argument('--queries', type=int, default=50, help='Queries per search type')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-legacy', action='store_true', help='Only time the index')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic patients instead of rolling back')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        try:
+            with transaction.atomic():
+                self.seed(rng, options['patients'], options['batch_size'])
+                self.run_queries(rng, options['queries'], options['skip_legacy'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Synthetic patients rolled back')
+
+    def seed(self, rng, count, batch_size):
+        started = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            batch = [
+                Patient(
+                    mrn=f"BENCH{offset + i:08d}",
+                    first_name=rng.choice(FIRST_NAMES).title(),
+                    last_name=rng.choice(LAST_NAMES).title(),
+                    contact_number=f"+91-9{rng.randrange(10**9):09d}",
+                )
+                for i in range(min(batch_size, count - offset))
+            ]
+            Patient.objects.bulk_create(batch, batch_size=batch_size)
+            search_index.index_patients(batch)
+        self.stdout.write(f'Seeded and indexed {count} patients in {time.perf_counter() - started:.1f}s')
+
+    def run_queries(self, rng, per_type, skip_legacy):
+        phones = list(Patient.objects.filter(mrn__startswith='BENCH').values_list('contact_number', flat=True)[:per_type])
+        cases = {
+            'name prefix': [rng.choice(FIRST_NAMES)[:rng.randint(3, 5)] for _ in range(per_type)],
+            'name substring': [rng.choice(LAST_NAMES)[1:5] for _ in range(per_type)],
+            'phone suffix': [search_index.digits_only(phone)[-rng.randint(4, 6):] for phone in phones],
+            'mrn prefix': [f"BENCH{rng.randrange(10**4):04d}" for _ in range(per_type)],
+            'no match': [''.join(rng.choice('qxzjvw') for _ in range(5)) for _ in range(per_type)],
+        }
+        for label, queries in cases.items():
+            index_ms = [self.time(lambda q=q: search_index.search(q, limit=10)) for q in queries]
+            line = f'{label:15} index p50 {statistics.median(index_ms):8.2f} ms  p95 {self.p95(index_ms):8.2f} ms'
+            if not skip_legacy:
+                legacy_ms = [self.time(lambda q=q: list(self.legacy(q))) for q in queries]
+                line += f'  | icontains p50 {statistics.median(legacy_ms):8.2f} ms  p95 {self.p95(legacy_ms):8.2f} ms'
+            self.stdout.write(line)
+
+    @staticmethod
+    def legacy(query):
+        return Patient.objects.filter(
+            Q(mrn__icontains=query) |
+            Q(first_name__icontains=query) |
+            Q(last_name__icontains=query) |
+            Q(contact_number__icontains=query)
+        ).values_list('uid', flat=True)[:10]
+
+    @staticmethod
+    def time(fn):
+        started = time.perf_counter()
+        fn()
+        return (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    def p95(values):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from his import early_warning
+from his.models import Ward
+
+
+class Command(BaseCommand):
+    help = 'Score active inpatients with NEWS2 and notify staff of medium and high risk patients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ward', type=int, help='Only score visits on this ward id')
+        parser.add_argument('--dry-run', action='store_true', help='Print the worklist without notifying')
+
+    def handle(self, *args, **options):
+        ward = Ward.objects.get(pk=options['ward']) if options['ward'] else None
+        entries = early_warning.worklist(ward=ward)
+        scored = [entry for entry in entries if entry['news2']]
+        for entry in scored:
+            news2 = entry['news2']
+            if news2['risk'] != early_warning.LOW:
+                self.stdout.write(
+                    f"{entry['visit'].visit_id}: NEWS2 {news2['score']} ({news2['risk']})"
+                    + (' stale' if news2['stale'] else '')
+                )
+        if options['dry_run']:
+            self.stdout.write(f'{len(scored)} of {len(entries)} active inpatients scored (dry run)')
+            return
+        sent = early_warning.escalate(entries)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(scored)} of {len(entries)} active inpatients scored, {len(sent)} notifications sent'
+        ))
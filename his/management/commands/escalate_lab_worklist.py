@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from his import lab_worklist
+
+
+class Command(BaseCommand):
+    help = 'Raise the priority of lab worklist items that have waited too long (run every few minutes)'
+
+    def handle(self, *args, **options):
+        raised = lab_worklist.escalate_aged()
+        for queue in lab_worklist.summary():
+            self.stdout.write(f"{queue['queue']}: {queue['waiting']} waiting")
+        self.stdout.write(self.style.SUCCESS(f'Raised {raised} item(s)'))
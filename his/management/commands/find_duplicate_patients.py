@@ -0,0 +1,50 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from his import duplicates
+from his.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Report clusters of likely duplicate patients using the blocking-key index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild-keys', action='store_true', help='Rebuild every match key first')
+        parser.add_argument('--threshold', type=float, default=duplicates.DUPLICATE_THRESHOLD)
+        parser.add_argument('--max-block-size', type=int, default=duplicates.MAX_BLOCK_SIZE)
+        parser.add_argument('--csv', help='Write cluster members to this CSV file')
+
+    def handle(self, *args, **options):
+        if options['rebuild_keys']:
+            patients, keys = duplicates.rebuild()
+            self.stdout.write(f'Indexed {patients} patients ({keys} match keys)')
+
+        clusters = duplicates.find_clusters(
+            threshold=options['threshold'], max_block_size=options['max_block_size']
+        )
+        ids = [patient_id for cluster in clusters for patient_id in cluster]
+        patients = Patient.objects.only('uid', 'mrn', 'first_name', 'last_name', 'dob', 'age', 'contact_number').in_bulk(ids)
+
+        rows = []
+        for number, cluster in enumerate(clusters, start=1):
+            members = sorted((patients[patient_id] for patient_id in cluster if patient_id in patients), key=lambda p: p.mrn)
+            for patient in members:
+                rows.append([
+                    number, patient.mrn, f"{patient.first_name} {patient.last_name}".strip(),
+                    patient.dob or '', patient.age if patient.age is not None else '', patient.contact_number,
+                ])
+            if not options['csv']:
+                self.stdout.write(f"Cluster {number}: " + ', '.join(
+                    f"{patient.mrn} ({patient.first_name} {patient.last_name})".replace(' )', ')') for patient in members
+                ))
+
+        if options['csv']:
+            with open(options['csv'], 'w', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['cluster', 'mrn', 'name', 'dob', 'age', 'contact_number'])
+                writer.writerows(rows)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {len(clusters)} clusters covering {len(rows)} patients'
+        ))
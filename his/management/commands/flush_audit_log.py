@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from his import audit
+
+
+class Command(BaseCommand):
+    help = 'Replay audit entries left in spill files by stopped or crashed workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--include-live', action='store_true',
+            help='Also replay segments of running workers (safe: entries are de-duplicated by event_id)',
+        )
+        parser.add_argument(
+            '--dead-letters', action='store_true',
+            help='Also retry entries moved to dead-letter files after repeated failures',
+        )
+
+    def handle(self, *args, **options):
+        replayed = audit.recover(include_live=options['include_live'])
+        self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} audit entries'))
+        if options['dead_letters']:
+            written, failing = audit.replay_dead_letters()
+            self.stdout.write(self.style.SUCCESS(
+                f'Wrote {written} dead-letter audit entries, {failing} still failing'
+            ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from his import lab_import
+from his.models import User
+
+
+class Command(BaseCommand):
+    help = 'Import an analyzer result file (CSV or ASTM records) as lab results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Result file to import')
+        parser.add_argument('--format', choices=['csv', 'astm'], help='File format (detected from the content by default)')
+        parser.add_argument('--user', help='Username to record as the reporter')
+
+    def handle(self, *args, **options):
+        reporter = None
+        if options['user']:
+            reporter = User.objects.filter(username=options['user']).first()
+            if reporter is None:
+                raise CommandError(f"Unknown user {options['user']!r}")
+        with open(options['path'], 'rb') as handle:
+            body = handle.read()
+        try:
+            results = lab_import.parse_payload(body, file_format=options['format'])
+        except lab_import.PayloadError as exc:
+            raise CommandError(str(exc))
+
+        created, skipped, errors = lab_import.import_results(results, reported_by=reporter)
+        for error in errors:
+            self.stdout.write(self.style.WARNING(
+                f"Result {error['index']} (order {error['order_id']}, {error['test_code']}): {error['errors']}"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {created} result(s), skipped {skipped} already imported, rejected {len(errors)}'
+        ))
@@ -0,0 +1,110 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from his.models import Patient, Role, User, Visit, Vitals
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Post synthetic monitor readings to the vitals bulk endpoint and report throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=50000, help='Total readings to send')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Readings per request')
+        parser.add_argument('--visits', type=int, default=200, help='Synthetic beds / visits')
+        parser.add_argument('--ndjson', action='store_true', help='Send NDJSON instead of a JSON array')
+        parser.add_argument('--invalid-rate', type=float, default=0.01, help='Fraction of readings made invalid')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows instead of rolling back')
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        try:
+            # The test client runs the full request stack in this process and
+            # this transaction, so everything can be rolled back afterwards.
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*']):
+                visit_ids = self.seed(options['visits'])
+                self.run(rng, visit_ids, options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Synthetic rows rolled back')
+
+    def seed(self, count):
+        self.user = User.objects.create_user(username=f'loadtest-{time.time_ns()}', role=Role.NURSE)
+        patients = Patient.objects.bulk_create([
+            Patient(mrn=f'LOAD{time.time_ns()}{i:05d}', first_name='Load', last_name=f'Test{i}')
+            for i in range(count)
+        ])
+        visits = Visit.objects.bulk_create([
+            Visit(patient=patient, visit_id=f'LOADV{time.time_ns()}{i:05d}', visit_type='ipd')
+            for i, patient in enumerate(patients)
+        ])
+        return [visit.visit_id for visit in visits]
+
+    def reading(self, rng, visit_ids, recorded_at, invalid_rate):
+        reading = {
+            'visit_id': rng.choice(visit_ids),
+            'recorded_at': recorded_at.isoformat(),
+            'pulse': rng.randint(55, 130),
+            'respiratory_rate': rng.randint(10, 28),
+            'systolic_bp': rng.randint(85, 170),
+            'diastolic_bp': rng.randint(50, 100),
+            'oxygen_saturation': round(rng.uniform(88, 100), 1),
+            'temperature': round(rng.uniform(35.5, 39.5), 1),
+        }
+        if rng.random() < invalid_rate:
+            reading['pulse'] = 900
+        return reading
+
+    def run(self, rng, visit_ids, options):
+        client = Client()
+        client.force_login(self.user)
+        url = reverse('vitals-bulk')
+        content_type = 'application/x-ndjson' if options['ndjson'] else 'application/json'
+        start_at = timezone.now() - timedelta(minutes=options['readings'])
+        before = Vitals.objects.count()
+
+        latencies, created, rejected = [], 0, 0
+        started = time.perf_counter()
+        for offset in range(0, options['readings'], options['batch_size']):
+            batch = [
+                self.reading(rng, visit_ids, start_at + timedelta(minutes=offset + i), options['invalid_rate'])
+                for i in range(min(options['batch_size'], options['readings'] - offset))
+            ]
+            if options['ndjson']:
+                body = '\n'.join(json.dumps(reading) for reading in batch)
+            else:
+                body = json.dumps(batch)
+            sent = time.perf_counter()
+            response = client.post(url, data=body, content_type=content_type)
+            latencies.append((time.perf_counter() - sent) * 1000)
+            if response.status_code not in (201, 207):
+                self.stderr.write(f'Batch at {offset} failed: {response.status_code} {response.content[:200]!r}')
+                continue
+            result = response.json()
+            created += result['created']
+            rejected += result['rejected']
+        elapsed = time.perf_counter() - started
+
+        stored = Vitals.objects.count() - before
+        self.stdout.write(
+            f'{created + rejected} readings in {elapsed:.2f}s = {(created + rejected) / elapsed:,.0f} readings/s '
+            f'({created} stored, {rejected} rejected, {stored} rows written)'
+        )
+        self.stdout.write(
+            f'per request ({options["batch_size"]} readings): p50 {statistics.median(latencies):.1f} ms, '
+            f'max {max(latencies):.1f} ms'
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from his import search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the patient search index from the Patient table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        patients, tokens = search_index.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {patients} patients ({tokens} tokens)'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from his import beds
+
+
+class Command(BaseCommand):
+    help = 'Recount occupied beds per ward from the beds table (repairs drift from bulk edits and raw SQL)'
+
+    def handle(self, *args, **options):
+        changed = beds.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Reconciled bed occupancy: {changed} ward(s) corrected'))
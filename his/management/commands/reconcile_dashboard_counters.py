@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from his import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute materialized dashboard counters from the source tables (run periodically, e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=45,
+                            help='How many days of daily/monthly buckets to recompute')
+
+    def handle(self, *args, **options):
+        changed = counters.reconcile(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Reconciled dashboard counters: {changed} row(s) corrected'))
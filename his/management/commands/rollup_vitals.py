@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from his import vitals_series
+from his.models import Vitals
+
+
+class Command(BaseCommand):
+    help = 'Build hourly VitalsRollup rows used by the vitals series API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Rebuild from this ISO date or datetime instead of resuming')
+        parser.add_argument(
+            '--recompute-hours', type=int, default=24,
+            help='When resuming, also rebuild this many hours before the last rollup to absorb late readings',
+        )
+        parser.add_argument(
+            '--delay-hours', type=int, default=2,
+            help='Leave the most recent hours to raw reads (they may still be receiving readings)',
+        )
+
+    def handle(self, *args, **options):
+        end = vitals_series.rollup_cutoff(options['delay_hours'])
+        if options['since']:
+            start = parse_datetime(options['since'])
+            if start is None:
+                raise CommandError(f"Invalid --since value {options['since']!r}")
+            if timezone.is_naive(start):
+                start = timezone.make_aware(start)
+        else:
+            watermark = vitals_series.rollup_watermark()
+            if watermark:
+                start = watermark - timedelta(hours=options['recompute_hours'])
+            else:
+                start = Vitals.objects.order_by('recorded_at').values_list('recorded_at', flat=True).first()
+        if start is None or start >= end:
+            self.stdout.write('Nothing to roll up')
+            return
+
+        # One day per pass keeps each aggregate and delete small
+        written = 0
+        cursor = start
+        while cursor < end:
+            chunk_end = min(cursor + timedelta(days=1), end)
+            written += vitals_series.rollup(cursor, chunk_end)
+            cursor = chunk_end
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} hourly rollups from {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}'))
@@ -10,6 +10,7 @@ from his.models import (
     LabTest, RadiologyStudy, PharmacyStock, Supplier, InsuranceProvider,
     LeaveType, SystemConfiguration, Role
 )
+from his.sequences import generate_mrn, generate_visit_id
 
 User = get_user_model()
 
@@ -297,7 +298,7 @@ class Command(BaseCommand):
         created_patients = []
         for i, patient_data in enumerate(demo_patients):
             patient = Patient.objects.create(
-                mrn=f"{timezone.now().strftime('%y%m%d')}{i+1:04d}",
+                mrn=generate_mrn(),
                 **patient_data,
                 address=f"Demo Address {i+1}, Demo City",
                 created_by=User.objects.get(username='admin')
@@ -309,7 +310,7 @@ class Command(BaseCommand):
         for patient in created_patients[:3]:  # Create visits for first 3 patients
             visit = Visit.objects.create(
                 patient=patient,
-                visit_id=f"V{timezone.now().strftime('%y%m%d')}{patient.mrn[-4:]}",
+                visit_id=generate_visit_id(),
                 visit_type=random.choice(['opd', 'ipd']),
                 department=Department.objects.get(name='Internal Medicine'),
                 attending_doctor=User.objects.filter(role=Role.DOCTOR).first(),
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from his import stock_ledger
+
+
+class Command(BaseCommand):
+    help = 'Snapshot pharmacy stock balances from the ledger (run periodically, e.g. nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Also report batches whose stored quantity differs from the ledger')
+
+    def handle(self, *args, **options):
+        written = stock_ledger.take_snapshots()
+        self.stdout.write(self.style.SUCCESS(f'Snapshotted {written} stock batch(es)'))
+        if options['verify']:
+            drift = stock_ledger.verify()
+            for stock_id, stored, ledger in drift:
+                self.stdout.write(self.style.WARNING(f'Stock {stock_id}: stored {stored}, ledger {ledger}'))
+            self.stdout.write(f'{len(drift)} batch(es) differ from the ledger')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from his import stock_alerts
+
+
+class Command(BaseCommand):
+    help = 'Age pharmacy stock expiry buckets and notify pharmacists of new low-stock and expiry alerts (run at least daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Age the buckets and list new alerts without notifying')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            moved = stock_alerts.age_buckets()
+            alerts, _ = stock_alerts.pending_alerts()
+            for condition, batches in alerts.items():
+                self.stdout.write(stock_alerts.TITLES[condition].format(count=len(batches)))
+            self.stdout.write(f'{moved} batch(es) moved to a nearer expiry bucket (dry run)')
+            return
+        moved, sent = stock_alerts.sweep()
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} batch(es) moved to a nearer expiry bucket, {len(sent)} notifications sent'
+        ))
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:00
+
+import re
+
+from django.db import migrations, models
+
+# (model, field, pattern splitting a number into its sequence key and running number)
+NUMBERED_FIELDS = [
+    ('Patient', 'mrn', r'(MRN\d{4})(\d{4,})'),
+    ('Visit', 'visit_id', r'(V\d{6})(\d{4,})'),
+    ('Invoice', 'invoice_number', r'(INV\d{6})(\d{4,})'),
+    # Exactly five digits: older payment numbers were PAY plus a %y%m%d%H%M%S stamp
+    ('Payment', 'payment_number', r'(PAY\d{6})(\d{5})'),
+]
+
+
+def seed_counters(apps, schema_editor):
+    """
+    Start every sequence key after the highest number already issued, so the
+    allocator cannot hand out a number an existing row holds. MRN years also
+    take the old MRNCounter value, which may be ahead of the patients left.
+    """
+    MRNCounter = apps.get_model('his', 'MRNCounter')
+    SequenceCounter = apps.get_model('his', 'SequenceCounter')
+    last_values = {f"MRN{counter.year}": counter.last_seq for counter in MRNCounter.objects.all()}
+    for model_name, field, pattern in NUMBERED_FIELDS:
+        pattern = re.compile(pattern)
+        numbers = apps.get_model('his', model_name).objects.values_list(field, flat=True)
+        for number in numbers.iterator():
+            match = pattern.fullmatch(number or '')
+            if match:
+                key, value = match.group(1), int(match.group(2))
+                last_values[key] = max(last_values.get(key, 0), value)
+    SequenceCounter.objects.bulk_create([
+        SequenceCounter(key=key, last_value=last_value) for key, last_value in last_values.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenceCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='MRNCounter',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0003_dashboard_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=255)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='his.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'patient'], name='his_search_term_idx')],
+                'unique_together': {('patient', 'term')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0004_patient_search_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientMatchKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_keys', to='his.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'patient'], name='his_match_key_idx')],
+                'unique_together': {('patient', 'key')},
+            },
+        ),
+    ]
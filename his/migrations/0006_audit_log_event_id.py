@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0005_patient_match_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='event_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
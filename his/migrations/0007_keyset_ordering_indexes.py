@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0006_audit_log_event_id'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='his_invoice_created_598e5c_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='visit',
+            name='his_visit_admitte_adf589_idx',
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp', 'id'], name='his_auditlog_timestamp_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['created_at', 'id'], name='his_invoice_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labresult',
+            index=models.Index(fields=['reported_at', 'id'], name='his_labresult_reported_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['admitted_at', 'id'], name='his_visit_admitted_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vitals',
+            index=models.Index(fields=['recorded_at', 'id'], name='his_vitals_recorded_id_idx'),
+        ),
+    ]
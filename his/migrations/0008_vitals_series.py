@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0007_keyset_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VitalsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('stats', models.JSONField(default=dict)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='vitals',
+            index=models.Index(fields=['visit', 'recorded_at'], name='his_vitals_visit_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='vitalsrollup',
+            name='visit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vitals_rollups', to='his.visit'),
+        ),
+        migrations.AddIndex(
+            model_name='vitalsrollup',
+            index=models.Index(fields=['bucket_start'], name='his_vitals_rollup_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vitalsrollup',
+            unique_together={('visit', 'bucket_start')},
+        ),
+    ]
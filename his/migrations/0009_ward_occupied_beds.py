@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:27
+
+from django.db import migrations, models
+
+
+def count_occupied_beds(apps, schema_editor):
+    Ward = apps.get_model('his', 'Ward')
+    Bed = apps.get_model('his', 'Bed')
+    counts = {}
+    for ward_id in Bed.objects.filter(is_occupied=True).values_list('ward_id', flat=True):
+        counts[ward_id] = counts.get(ward_id, 0) + 1
+    for ward_id, occupied in counts.items():
+        Ward.objects.filter(pk=ward_id).update(occupied_beds=occupied)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0008_vitals_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ward',
+            name='occupied_beds',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_occupied_beds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_current_visits(apps, schema_editor):
+    Bed = apps.get_model('his', 'Bed')
+    Visit = apps.get_model('his', 'Visit')
+    occupants = {}
+    # Latest admission wins where legacy data double-booked a bed
+    for visit_id, bed_id in Visit.objects.filter(
+        status='active', bed__isnull=False, bed__is_occupied=True
+    ).order_by('admitted_at', 'id').values_list('id', 'bed_id'):
+        occupants[bed_id] = visit_id
+    for bed_id, visit_id in occupants.items():
+        Bed.objects.filter(pk=bed_id).update(current_visit_id=visit_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0009_ward_occupied_beds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bed',
+            name='current_visit',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='current_bed', to='his.visit'),
+        ),
+        migrations.RunPython(link_current_visits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0010_bed_current_visit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('dispense', 'Dispense'), ('return', 'Return'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('notes', models.CharField(blank=True, max_length=255)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+                ('dispense', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='his.medicationdispense')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='movements', to='his.pharmacystock')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stock', 'created_at'], name='his_stock_movement_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def record_opening_balances(apps, schema_editor):
+    # Existing quantities predate the ledger; one adjustment per batch makes
+    # the ledger sum equal the stored quantity
+    PharmacyStock = apps.get_model('his', 'PharmacyStock')
+    StockMovement = apps.get_model('his', 'StockMovement')
+    recorded = dict(
+        StockMovement.objects.values('stock_id').annotate(total=Sum('quantity')).values_list('stock_id', 'total')
+    )
+    now = timezone.now()
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            stock_id=stock_id, kind='adjustment', quantity=quantity - recorded.get(stock_id, 0),
+            created_at=now, notes='Opening balance',
+        )
+        for stock_id, quantity in PharmacyStock.objects.values_list('pk', 'quantity')
+        if quantity != recorded.get(stock_id, 0)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0011_stock_movement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockmovement',
+            name='procurement_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='his.procurementitem'),
+        ),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='his.pharmacystock')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stock', '-as_of'], name='his_stock_snapshot_idx')],
+                'unique_together': {('stock', 'as_of')},
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
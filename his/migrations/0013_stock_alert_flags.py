@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:39
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def set_stock_flags(apps, schema_editor):
+    PharmacyStock = apps.get_model('his', 'PharmacyStock')
+    PharmacyStock.objects.filter(quantity__lte=F('minimum_stock_level')).update(low_stock=True)
+    today = timezone.localdate()
+    dated = PharmacyStock.objects.filter(expiry_date__isnull=False)
+    dated.update(expiry_bucket='later')
+    dated.filter(expiry_date__lt=today + timedelta(days=90)).update(expiry_bucket='90d')
+    dated.filter(expiry_date__lt=today + timedelta(days=30)).update(expiry_bucket='30d')
+    dated.filter(expiry_date__lt=today).update(expiry_bucket='expired')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0012_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pharmacystock',
+            name='alerted_expiry_bucket',
+            field=models.CharField(blank=True, editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='pharmacystock',
+            name='alerted_low_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='pharmacystock',
+            name='expiry_bucket',
+            field=models.CharField(choices=[('expired', 'Expired'), ('30d', 'Expires within 30 days'), ('90d', 'Expires within 90 days'), ('later', 'Expires later'), ('none', 'No expiry date')], default='none', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='pharmacystock',
+            name='low_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['low_stock', 'medication_name'], name='his_stock_low_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['expiry_bucket', 'expiry_date'], name='his_stock_expiry_idx'),
+        ),
+        migrations.RunPython(set_stock_flags, migrations.RunPython.noop),
+    ]
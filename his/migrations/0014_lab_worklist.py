@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def queue_collected_items(apps, schema_editor):
+    LabOrderItem = apps.get_model('his', 'LabOrderItem')
+    ranks = {'routine': 0, 'urgent': 1, 'stat': 2}
+    items = LabOrderItem.objects.filter(
+        status='ordered', lab_order__status__in=['sample_collected', 'in_progress'],
+    ).select_related('lab_order', 'lab_test__department')
+    for item in items.iterator():
+        test = item.lab_test
+        item.status = 'queued'
+        item.queue = test.sample_type or (test.department.name if test.department else '') or 'general'
+        item.priority_rank = ranks.get(item.lab_order.priority, 0)
+        item.queued_at = item.lab_order.sample_collected_at or item.lab_order.created_at
+        item.save(update_fields=['status', 'queue', 'priority_rank', 'queued_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0013_stock_alert_flags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='laborderitem',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='laborderitem',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_lab_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='laborderitem',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='laborderitem',
+            name='priority_rank',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='laborderitem',
+            name='queue',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='laborderitem',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='laborderitem',
+            index=models.Index(fields=['queue', 'status', '-priority_rank', 'queued_at'], name='his_lab_worklist_idx'),
+        ),
+        migrations.RunPython(queue_collected_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('his', '0014_lab_worklist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabTatRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('priority', models.CharField(max_length=20)),
+                ('results', models.PositiveIntegerField(default=0)),
+                ('stats', models.JSONField(default=dict)),
+                ('lab_test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tat_rollups', to='his.labtest')),
+            ],
+            options={
+                'unique_together': {('day', 'lab_test', 'priority')},
+            },
+        ),
+    ]
@@ -102,13 +102,15 @@ class Ward(models.Model):
     department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True)
     nurse_in_charge = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='managed_wards')
     is_active = models.BooleanField(default=True)
+    # Occupied beds on this ward, maintained by his/beds.py
+    occupied_beds = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"{self.name} ({self.ward_type})"
 
     @property
     def available_beds(self):
-        return self.total_beds - self.beds.filter(is_occupied=True).count()
+        return self.total_beds - self.occupied_beds
 
 class Bed(models.Model):
     bed_number = models.CharField(max_length=20)
@@ -117,6 +119,10 @@ class Bed(models.Model):
     is_maintenance = models.BooleanField(default=False)
     bed_type = models.CharField(max_length=50, blank=True)
     daily_rate = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Visit occupying the bed, set and cleared by his/beds.py
+    current_visit = models.OneToOneField(
+        'Visit', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='current_bed'
+    )
 
     class Meta:
         unique_together = ['ward', 'bed_number']
@@ -133,24 +139,44 @@ class AuditLog(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     details = models.JSONField(null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
+    # Set by the buffered writer (his/audit.py) so replaying its spill file never duplicates rows
+    event_id = models.UUIDField(unique=True, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['timestamp', 'id'], name='his_auditlog_timestamp_id_idx')]
 
     def __str__(self):
         actor = self.actor.username if self.actor else 'System'
         return f"{self.timestamp} - {actor} - {self.action}"
 
-# Patient
-class MRNCounter(models.Model):
+# Document number sequences
+class SequenceCounter(models.Model):
     """
-    Keeps track of the last MRN sequence number for each year.
-    Used to generate unique, sequential MRNs like MRN20250001.
+    High-water mark for one document number sequence, e.g. 'MRN2025' or 'INV250916'.
+    Workers reserve blocks of numbers from here (see his/sequences.py), so
+    last_value is the highest number handed to any worker, not the last one used.
     """
-    year = models.IntegerField(unique=True)
-    last_seq = models.IntegerField(default=0)
+    key = models.CharField(max_length=32, unique=True)
+    last_value = models.BigIntegerField(default=0)
 
     def __str__(self):
-        return f"{self.year} - {self.last_seq}"
+        return f"{self.key} - {self.last_value}"
+
+# Materialized dashboard figures
+class DashboardCounter(models.Model):
+    """
+    One pre-computed dashboard figure, e.g. 'visits.active' or 'payments.revenue:2025-09-16'.
+    Maintained incrementally from model signals and rebuilt by the
+    reconcile_dashboard_counters command (see his/counters.py).
+    """
+    key = models.CharField(max_length=64, unique=True)
+    value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    def __str__(self):
+        return f"{self.key} = {self.value}"
 
+# Patient
 class Patient(models.Model):
     GENDER_CHOICES = [
         ('M', 'Male'),
@@ -191,6 +217,31 @@ class Patient(models.Model):
     def __str__(self):
         return f"{self.mrn} - {self.first_name} {self.last_name or ''}".strip()
 
+class PatientSearchToken(models.Model):
+    """
+    Search index entry for a patient (see his/search_index.py).
+    term is prefixed by its kind: 'w:' whole word, 'r:' reversed phone digits, 'g:' trigram.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='search_tokens')
+    term = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ['patient', 'term']
+        indexes = [models.Index(fields=['term', 'patient'], name='his_search_term_idx')]
+
+
+class PatientMatchKey(models.Model):
+    """
+    Blocking key for duplicate-patient detection (see his/duplicates.py).
+    Patients sharing a key are compared in detail; others never are.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='match_keys')
+    key = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ['patient', 'key']
+        indexes = [models.Index(fields=['key', 'patient'], name='his_match_key_idx')]
+
 
 # Appointment Management
 class Appointment(models.Model):
@@ -249,7 +300,10 @@ class Visit(models.Model):
     follow_up_date = models.DateTimeField(null=True, blank=True)
 
     class Meta:
-        indexes = [models.Index(fields=['visit_id']), models.Index(fields=['admitted_at'])]
+        indexes = [
+            models.Index(fields=['visit_id']),
+            models.Index(fields=['admitted_at', 'id'], name='his_visit_admitted_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.visit_id} ({self.patient.mrn})"
@@ -270,9 +324,32 @@ class Vitals(models.Model):
     notes = models.TextField(blank=True)
     recorded_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['recorded_at', 'id'], name='his_vitals_recorded_id_idx'),
+            models.Index(fields=['visit', 'recorded_at'], name='his_vitals_visit_time_idx'),
+        ]
+
     def __str__(self):
         return f"Vitals for {self.visit.patient.mrn} - {self.recorded_at.strftime('%Y-%m-%d %H:%M')}"
 
+class VitalsRollup(models.Model):
+    """
+    Hourly summary of one visit's vitals, built by the rollup_vitals command
+    (see his/vitals_series.py). stats maps each metric to [min, max, sum, count].
+    """
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='vitals_rollups')
+    bucket_start = models.DateTimeField()
+    readings = models.PositiveIntegerField(default=0)
+    stats = models.JSONField(default=dict)
+
+    class Meta:
+        unique_together = ['visit', 'bucket_start']
+        indexes = [models.Index(fields=['bucket_start'], name='his_vitals_rollup_bucket_idx')]
+
+    def __str__(self):
+        return f"{self.visit_id} @ {self.bucket_start:%Y-%m-%d %H:00} ({self.readings})"
+
 # Medical record (EMR)
 class MedicalRecord(models.Model):
     RECORD_TYPES = [
@@ -372,6 +449,16 @@ class Supplier(models.Model):
         return self.name
 
 class PharmacyStock(models.Model):
+    EXPIRY_BUCKETS = [
+        ('expired', 'Expired'),
+        ('30d', 'Expires within 30 days'),
+        ('90d', 'Expires within 90 days'),
+        ('later', 'Expires later'),
+        ('none', 'No expiry date'),
+    ]
+    # (bucket, days until expiry below which a batch falls in it), most urgent first
+    EXPIRY_WINDOWS = [('expired', 0), ('30d', 30), ('90d', 90)]
+
     medication_name = models.CharField(max_length=255)
     generic_name = models.CharField(max_length=255, blank=True)
     manufacturer = models.CharField(max_length=255, blank=True)
@@ -382,9 +469,41 @@ class PharmacyStock(models.Model):
     selling_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     minimum_stock_level = models.DecimalField(max_digits=12, decimal_places=2, default=10)
     last_updated = models.DateTimeField(auto_now=True)
+    # Kept in step on every write (save(), his/stock_ledger.py); expiry buckets
+    # age with the calendar and are moved on by his/stock_alerts.py
+    low_stock = models.BooleanField(default=False, editable=False)
+    expiry_bucket = models.CharField(max_length=10, choices=EXPIRY_BUCKETS, default='none', editable=False)
+    # State pharmacists were last alerted about by the stock alert sweep
+    alerted_low_stock = models.BooleanField(default=False, editable=False)
+    alerted_expiry_bucket = models.CharField(max_length=10, blank=True, editable=False)
 
     class Meta:
         unique_together = ('medication_name', 'batch_number')
+        indexes = [
+            models.Index(fields=['low_stock', 'medication_name'], name='his_stock_low_idx'),
+            models.Index(fields=['expiry_bucket', 'expiry_date'], name='his_stock_expiry_idx'),
+        ]
+
+    @classmethod
+    def expiry_bucket_for(cls, expiry_date, today=None):
+        if expiry_date is None:
+            return 'none'
+        days_left = (expiry_date - (today or timezone.localdate())).days
+        for bucket, days in cls.EXPIRY_WINDOWS:
+            if days_left < days:
+                return bucket
+        return 'later'
+
+    def refresh_flags(self, today=None):
+        """Recompute low_stock and expiry_bucket from the row's own values."""
+        self.low_stock = self.quantity is not None and self.quantity <= self.minimum_stock_level
+        self.expiry_bucket = self.expiry_bucket_for(self.expiry_date, today)
+
+    def save(self, *args, **kwargs):
+        self.refresh_flags()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'low_stock', 'expiry_bucket'}
+        super().save(*args, **kwargs)
 
     @property
     def is_low_stock(self):
@@ -394,6 +513,58 @@ class PharmacyStock(models.Model):
     def is_expired(self):
         return self.expiry_date and self.expiry_date < timezone.now().date()
 
+class StockMovement(models.Model):
+    """
+    One change to a stock batch's quantity; dispenses are negative. The ledger
+    is append-only: rows are written by his/stock_ledger.py and never changed.
+    """
+    KIND_CHOICES = [
+        ('receipt', 'Receipt'),
+        ('dispense', 'Dispense'),
+        ('return', 'Return'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    stock = models.ForeignKey(PharmacyStock, on_delete=models.PROTECT, related_name='movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.DecimalField(max_digits=12, decimal_places=2)
+    dispense = models.ForeignKey(MedicationDispense, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    procurement_item = models.ForeignKey('ProcurementItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    notes = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock', 'created_at'], name='his_stock_movement_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity} of {self.stock}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock movements are append-only; record a correcting movement instead")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Stock movements are append-only; record a correcting movement instead")
+
+class StockSnapshot(models.Model):
+    """Balance of a stock batch at as_of: the sum of its movements up to then."""
+    stock = models.ForeignKey(PharmacyStock, on_delete=models.CASCADE, related_name='snapshots')
+    as_of = models.DateTimeField()
+    quantity = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        unique_together = ['stock', 'as_of']
+        indexes = [
+            models.Index(fields=['stock', '-as_of'], name='his_stock_snapshot_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.stock} at {self.as_of}: {self.quantity}"
+
 class Procurement(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -459,6 +630,18 @@ class LabOrderItem(models.Model):
     lab_order = models.ForeignKey(LabOrder, on_delete=models.CASCADE)
     lab_test = models.ForeignKey(LabTest, on_delete=models.CASCADE)
     status = models.CharField(max_length=32, default='ordered')
+    # Bench worklist state, written by his/lab_worklist.py
+    queue = models.CharField(max_length=100, blank=True, editable=False)
+    priority_rank = models.PositiveSmallIntegerField(default=0, editable=False)
+    queued_at = models.DateTimeField(null=True, blank=True, editable=False)
+    claimed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='claimed_lab_items')
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    completed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status', '-priority_rank', 'queued_at'], name='his_lab_worklist_idx'),
+        ]
 
 class LabResult(models.Model):
     lab_order_item = models.ForeignKey(LabOrderItem, on_delete=models.CASCADE, null=True, blank=True)
@@ -470,6 +653,28 @@ class LabResult(models.Model):
     reported_at = models.DateTimeField(default=timezone.now)
     verified_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['reported_at', 'id'], name='his_labresult_reported_id_idx')]
+
+class LabTatRollup(models.Model):
+    """
+    Turnaround-time percentiles of one test and priority over the results
+    reported on one day, built by the rollup_lab_tat command (see
+    his/lab_tat.py). stats maps each stage to {count, p50, p90, p99, max}
+    in minutes.
+    """
+    day = models.DateField()
+    lab_test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='tat_rollups')
+    priority = models.CharField(max_length=20)
+    results = models.PositiveIntegerField(default=0)
+    stats = models.JSONField(default=dict)
+
+    class Meta:
+        unique_together = ['day', 'lab_test', 'priority']
+
+    def __str__(self):
+        return f"{self.lab_test_id} {self.priority} @ {self.day} ({self.results})"
+
 # Radiology
 class RadiologyStudy(models.Model):
     name = models.CharField(max_length=255)
@@ -574,7 +779,10 @@ class Invoice(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='invoices_created')
 
     class Meta:
-        indexes = [models.Index(fields=['invoice_number']), models.Index(fields=['created_at'])]
+        indexes = [
+            models.Index(fields=['invoice_number']),
+            models.Index(fields=['created_at', 'id'], name='his_invoice_created_id_idx'),
+        ]
 
     @property
     def balance_amount(self):
@@ -0,0 +1,120 @@
+# his/notifications.py
+"""
+Notification fan-out to open browser tabs.
+
+Every signed-in tab holds a WebSocket (his/consumers.py) subscribed to its
+user's group. Creating a Notification pushes it, with the new unread count,
+to that group once the transaction commits; marking one read pushes the
+updated count. Rows written with bulk_create() skip post_save, so create
+many notifications through create_notifications(), which pushes them itself.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_save, pre_save
+
+from . import bulk
+from .models import Notification
+
+RECENT_LIMIT = 10
+
+
+def group_name(user_id):
+    return f"notifications.user.{user_id}"
+
+
+def serialize(notification):
+    return {
+        'id': notification.id,
+        'title': notification.title,
+        'message': notification.message,
+        'priority': notification.priority,
+        'created_at': notification.created_at.isoformat(),
+        'action_url': notification.action_url,
+    }
+
+
+def unread(user_id):
+    return Notification.objects.filter(recipient_id=user_id, is_read=False)
+
+
+def unread_counts(user_ids):
+    user_ids = set(user_ids)
+    counts = dict(
+        Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+        .values('recipient_id').annotate(total=Count('id')).values_list('recipient_id', 'total')
+    )
+    return {user_id: counts.get(user_id, 0) for user_id in user_ids}
+
+
+def snapshot(user_id):
+    """Unread count and most recent unread notifications, as sent to a tab when it connects."""
+    return {
+        'type': 'snapshot',
+        'unread_count': unread(user_id).count(),
+        'notifications': [serialize(n) for n in unread(user_id).order_by('-created_at')[:RECENT_LIMIT]],
+    }
+
+
+def _send(user_id, event):
+    layer = get_channel_layer()
+    if layer is not None:
+        async_to_sync(layer.group_send)(group_name(user_id), event)
+
+
+def push(notifications):
+    """Send new notifications and the recipients' unread counts to their groups."""
+    notifications = list(notifications)
+    if not notifications:
+        return
+    counts = unread_counts(n.recipient_id for n in notifications)
+    for notification in notifications:
+        _send(notification.recipient_id, {
+            'type': 'notification.created',
+            'notification': serialize(notification),
+            'unread_count': counts[notification.recipient_id],
+        })
+
+
+def push_counts(user_ids):
+    for user_id, count in unread_counts(user_ids).items():
+        _send(user_id, {'type': 'notification.count', 'unread_count': count})
+
+
+def bulk_notify(notifications):
+    """Insert unsaved Notification objects in one query and push them, ids included, on commit."""
+    rows = bulk.create(Notification, notifications, key=['recipient_id', 'action_url', 'title'])
+    if rows:
+        transaction.on_commit(lambda: push(rows))
+    return rows
+
+
+def create_notifications(recipients, title, message, priority='medium', action_url=''):
+    """Create one notification per recipient in a single insert and push them on commit."""
+    return bulk_notify([
+        Notification(
+            recipient_id=getattr(recipient, 'pk', recipient), title=title, message=message,
+            priority=priority, action_url=action_url,
+        )
+        for recipient in recipients
+    ])
+
+
+def _remember_read_state(sender, instance, raw=False, **kwargs):
+    instance._was_read = None
+    if not raw and not instance._state.adding and instance.pk is not None:
+        instance._was_read = Notification.objects.filter(pk=instance.pk).values_list('is_read', flat=True).first()
+
+
+def _on_notification_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        transaction.on_commit(lambda: push([instance]))
+    elif getattr(instance, '_was_read', None) != instance.is_read:
+        transaction.on_commit(lambda: push_counts([instance.recipient_id]))
+
+
+pre_save.connect(_remember_read_state, sender=Notification, dispatch_uid='notifications_pre_save')
+post_save.connect(_on_notification_saved, sender=Notification, dispatch_uid='notifications_post_save')
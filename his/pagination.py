@@ -0,0 +1,220 @@
+# his/pagination.py
+"""
+Pagination for list endpoints.
+
+KeysetPagination pages on the values of the ordering fields instead of an
+OFFSET: the cursor holds the ordering values of the last (or first) row
+shown, and the next page is "rows after those values" in index order. Any
+page costs the same as the first one, no COUNT(*) is run, and rows inserted
+while a client walks the list are neither skipped nor repeated. The
+ordering always ends with the primary key so rows with equal timestamps
+have a stable order.
+
+Keyset responses are {"next": url|null, "previous": url|null, "results":
+[...]}: unlike the page-number responses there is no "count". A cursor that
+does not decode, or that was made for another ordering, answers 400.
+
+Clients that still send ?page=N get the old page-number responses from
+CustomPagination, with their "count" and their COUNT and OFFSET costs.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date, datetime, time
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CustomPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _with_tiebreaker(ordering, model):
+    ordering = list(ordering)
+    pk_names = {'pk', model._meta.pk.name}
+    if not any(name.lstrip('-') in pk_names for name in ordering):
+        ordering.append('-pk' if ordering and ordering[-1].startswith('-') else 'pk')
+    return ordering
+
+
+def _field_name(name, model):
+    name = name.lstrip('-')
+    return model._meta.pk.name if name == 'pk' else name
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)  # UUID, Decimal
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({'v': [_encode_value(value) for value in values], 'b': int(backwards)})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering, model):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = payload['v']
+        if len(values) != len(ordering):
+            raise InvalidCursor(cursor)
+        values = [
+            model._meta.get_field(_field_name(name, model)).to_python(value)
+            for name, value in zip(ordering, values)
+        ]
+        return values, bool(payload.get('b'))
+    except (binascii.Error, ValueError, KeyError, TypeError, AttributeError, ValidationError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def _beyond(ordering, values, model, backwards):
+    """Q for rows strictly after `values` in `ordering` (before them when backwards)."""
+    condition = Q()
+    for index, name in enumerate(ordering):
+        descending = name.startswith('-')
+        lookup = 'lt' if descending != backwards else 'gt'
+        equal = {_field_name(ordering[i], model): values[i] for i in range(index)}
+        condition |= Q(**equal, **{f"{_field_name(name, model)}__{lookup}": values[index]})
+    return condition
+
+
+def _reverse(ordering):
+    return [name[1:] if name.startswith('-') else f"-{name}" for name in ordering]
+
+
+def keyset_page(queryset, ordering, cursor, page_size):
+    """
+    One page of `queryset` in `ordering` starting at `cursor` (None for the
+    first page). Returns (rows, next_cursor, previous_cursor); raises
+    InvalidCursor for a cursor that does not decode.
+    """
+    model = queryset.model
+    ordering = _with_tiebreaker(ordering, model)
+    backwards = False
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values, backwards = decode_cursor(cursor, ordering, model)
+        queryset = queryset.filter(_beyond(ordering, values, model, backwards))
+        if backwards:
+            queryset = queryset.order_by(*_reverse(ordering))
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    def position(row):
+        return [getattr(row, _field_name(name, model)) for name in ordering]
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(position(rows[-1]))
+        if (has_more and backwards) or (cursor and not backwards):
+            previous_cursor = encode_cursor(position(rows[0]), backwards=True)
+    return rows, next_cursor, previous_cursor
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the view's `keyset_ordering` (default: its
+    queryset ordering), always tie-broken on the primary key.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    legacy_pagination_class = CustomPagination
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset, view):
+        ordering = getattr(view, 'keyset_ordering', None) or queryset.query.order_by or queryset.model._meta.ordering
+        return list(ordering) or ['-pk']
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.legacy = None
+        if 'page' in request.query_params:
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        try:
+            rows, self.next_cursor, self.previous_cursor = keyset_page(
+                queryset, self.get_ordering(queryset, view),
+                request.query_params.get(self.cursor_query_param), self.get_page_size(request),
+            )
+        except InvalidCursor:
+            raise ParseError('Invalid cursor')
+        return rows
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self._link(self.next_cursor)),
+            ('previous', self._link(self.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetListMixin:
+    """
+    Keyset pagination for template ListViews. Adds next_cursor and
+    previous_cursor to the context; pages are requested with ?cursor=.
+    """
+    keyset_ordering = None
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.keyset_ordering or queryset.query.order_by or ['-pk']
+        try:
+            rows, self.next_cursor, self.previous_cursor = keyset_page(
+                queryset, ordering, self.request.GET.get('cursor'), page_size,
+            )
+        except InvalidCursor:
+            raise BadRequest('Invalid cursor')
+        return None, None, rows, bool(self.next_cursor or self.previous_cursor)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['next_cursor'] = getattr(self, 'next_cursor', None)
+        context['previous_cursor'] = getattr(self, 'previous_cursor', None)
+        return context
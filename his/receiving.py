@@ -0,0 +1,93 @@
+# his/receiving.py
+"""
+Receiving procurement deliveries into pharmacy stock.
+
+receive() takes the delivered lines of a Procurement (or, by default, every
+line as ordered), writes their received quantities, batch numbers and
+expiry dates in bulk, books whatever has not been booked yet
+into PharmacyStock through the stock ledger, and recomputes the order total
+from the received lines with a database aggregate. Everything commits
+together, and receiving the same delivery twice books it once.
+"""
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+
+from . import stock_ledger
+from .models import Procurement, ProcurementItem
+
+ZERO = Decimal('0')
+
+
+class ReceivingError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors  # {item id or 'lines': [messages]}
+        super().__init__(errors)
+
+
+def _apply_lines(items, lines):
+    """
+    Copy delivered values from `lines` onto `items` (by id). Returns
+    (changed items, errors).
+    """
+    errors, changed = {}, {}
+    by_id = {item.pk: item for item in items}
+    for line in lines:
+        item = by_id.get(line.get('id')) if isinstance(line, dict) else None
+        if item is None:
+            errors.setdefault('lines', []).append(f"Unknown procurement item {line!r}")
+            continue
+        try:
+            if line.get('received_quantity') not in (None, ''):
+                item.received_quantity = Decimal(str(line['received_quantity']))
+            if line.get('batch_number'):
+                item.batch_number = str(line['batch_number'])
+            if line.get('expiry_date'):
+                item.expiry_date = date.fromisoformat(str(line['expiry_date']))
+        except (InvalidOperation, ValueError):
+            errors.setdefault(item.pk, []).append('Invalid received_quantity or expiry_date')
+        changed[item.pk] = item
+    return list(changed.values()), errors
+
+
+def receive(procurement, received_by=None, lines=None):
+    """
+    Receive a delivery. `lines` is a list of {"id", "received_quantity",
+    "batch_number", "expiry_date"}; without it every line is received as
+    ordered. Raises ReceivingError for invalid lines. Returns the receipt
+    movements written.
+    """
+    with transaction.atomic():
+        # Concurrent receipts of the same order queue here
+        procurement = Procurement.objects.select_for_update().get(pk=procurement.pk)
+        if lines is None:
+            procurement.items.filter(received_quantity=0).update(received_quantity=F('ordered_quantity'))
+        items = list(procurement.items.all())
+        changed, errors = _apply_lines(items, lines) if lines else ([], {})
+        for item in items:
+            if item.received_quantity and not item.batch_number:
+                errors.setdefault(item.pk, []).append('A batch number is required to receive stock')
+            if item.received_quantity < 0:
+                errors.setdefault(item.pk, []).append('received_quantity cannot be negative')
+        if errors:
+            raise ReceivingError(errors)
+
+        if changed:
+            ProcurementItem.objects.bulk_update(
+                changed, ['received_quantity', 'batch_number', 'expiry_date'], batch_size=500,
+            )
+        movements = stock_ledger.receive_items(
+            items, received_by=received_by, notes=f"Procurement {procurement.order_number}",
+        )
+
+        total = procurement.items.aggregate(total=Sum(ExpressionWrapper(
+            F('received_quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2),
+        )))['total'] or ZERO
+        procurement.total_amount = total
+        procurement.status = 'received'
+        procurement.received_date = procurement.received_date or timezone.localdate()
+        procurement.save(update_fields=['total_amount', 'status', 'received_date'])
+    return movements
@@ -0,0 +1,295 @@
+# his/reference_ranges.py
+"""
+Abnormal and critical flags from LabTest.normal_range.
+
+normal_range is free text, so compile_range() parses it into numeric bands
+once per distinct text and caches the result. Segments are separated by
+";", new lines, or a comma before a word. Each segment is a range, optionally
+preceded by a "qualifier:" that limits it to a sex and/or an age group:
+
+    70-110                  3.5 - 5.0            0.6 to 1.2
+    <200    <=5.7    >40    up to 10             above 60
+    M: 13-17; F: 12-15      Adult: 70-110; Child (0-17y): 60-100
+    Critical: <40 or >400
+
+A segment starting with "critical" or "panic" gives the critical limits
+instead of the normal range. For each result, the most specific band that
+fits the patient's sex and age at the time of the report is used. A result
+is abnormal when its numeric value falls outside that band, and critical
+when it falls outside the critical band. Values that are not numeric, and
+tests whose range cannot be read, keep the flag they were given.
+
+Single results are flagged as they are saved (pre_save). The bulk import
+in his/lab_import.py calls flag() on its unsaved results before
+bulk_create. The backfill_lab_flags command calls backfill() to re-flag
+historical results a chunk at a time. Critical results notify the ordering
+and attending doctors in the same pass.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+from types import SimpleNamespace
+
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.urls import reverse
+from django.utils import timezone
+
+from . import notifications
+from .models import LabOrderItem, LabResult, Notification
+
+Band = namedtuple('Band', 'low high low_open high_open sex min_age max_age')
+Reference = namedtuple('Reference', 'normal critical')
+# Everything flag() needs to know about a result's item, from one query
+Context = namedtuple('Context', 'normal_range test_name unit gender dob age ordered_by attending mrn first_name last_name')
+CONTEXT_FIELDS = [
+    'lab_test__normal_range', 'lab_test__name', 'lab_test__unit',
+    'lab_order__visit__patient__gender', 'lab_order__visit__patient__dob', 'lab_order__visit__patient__age',
+    'lab_order__ordered_by_id', 'lab_order__visit__attending_doctor_id',
+    'lab_order__visit__patient__mrn', 'lab_order__visit__patient__first_name', 'lab_order__visit__patient__last_name',
+]
+BACKFILL_CHUNK = 2000
+
+NUMBER = r'[-+]?\d+(?:\.\d+)?'
+BETWEEN = re.compile(rf'({NUMBER})\s*(?:-|–|to)\s*({NUMBER})')
+COMPARISON = re.compile(rf'(<=|>=|≤|≥|<|>|up to|below|under|above|over)\s*({NUMBER})')
+VALUE = re.compile(rf'\s*(?:<=|>=|≤|≥|<|>)?\s*({NUMBER})\s*(?:[a-zµμ%/][^\d]*)?', re.IGNORECASE)
+AGE = re.compile(r'(\d+)\s*(?:-|–|to)\s*(\d+)\s*(?:y|yr|yrs|year|years)?\b|(<|>=?|≥)\s*(\d+)\s*(?:y|yr|yrs|year|years)\b')
+THOUSANDS = re.compile(r'(?<=\d),(?=\d{3}(?!\d))')
+SEGMENTS = re.compile(r'[;\n]|,\s*(?=[a-z])')
+SEXES = {'m': 'M', 'male': 'M', 'males': 'M', 'men': 'M', 'f': 'F', 'female': 'F', 'females': 'F', 'women': 'F'}
+AGE_GROUPS = {'adult': (18, None), 'adults': (18, None), 'child': (None, 18), 'children': (None, 18),
+              'paediatric': (None, 18), 'pediatric': (None, 18)}
+UPPER = {'<': True, '≤': False, '<=': False, 'up to': False, 'below': True, 'under': True}
+LOWER = {'>': True, '≥': False, '>=': False, 'above': True, 'over': True}
+CRITICAL_WORDS = ('critical', 'panic')
+
+
+def _qualifiers(text):
+    """(sex, min_age, max_age) of a segment's qualifier; max_age is exclusive."""
+    words = re.findall(r'[a-z]+', text)
+    sex = next((SEXES[word] for word in words if word in SEXES), None)
+    min_age, max_age = next((AGE_GROUPS[word] for word in words if word in AGE_GROUPS), (None, None))
+    match = AGE.search(text)
+    if match and match.group(1):
+        min_age, max_age = int(match.group(1)), int(match.group(2)) + 1
+    elif match:
+        if match.group(3) == '<':
+            min_age, max_age = None, int(match.group(4))
+        else:
+            min_age, max_age = int(match.group(4)) + (match.group(3) == '>'), None
+    return sex, min_age, max_age
+
+
+def _band(text, qualifiers, critical=False):
+    match = BETWEEN.search(text)
+    if match:
+        low, high = sorted((float(match.group(1)), float(match.group(2))))
+        return Band(low, high, False, False, *qualifiers)
+    low = high = None
+    low_open = high_open = False
+    for word, number in COMPARISON.findall(text):
+        if critical:
+            # "<40" is critical below 40: the band of safe values starts there
+            if word in UPPER:
+                low, low_open = float(number), not UPPER[word]
+            else:
+                high, high_open = float(number), not LOWER[word]
+        elif word in UPPER:
+            high, high_open = float(number), UPPER[word]
+        else:
+            low, low_open = float(number), LOWER[word]
+    if low is None and high is None:
+        return None
+    return Band(low, high, low_open, high_open, *qualifiers)
+
+
+@lru_cache(maxsize=1024)
+def compile_range(text):
+    """Reference bands of a normal_range text; cached, so each distinct text is parsed once."""
+    normal, critical = [], []
+    for segment in SEGMENTS.split(THOUSANDS.sub('', (text or '').lower())):
+        segment = segment.strip()
+        if not segment:
+            continue
+        is_critical = segment.startswith(CRITICAL_WORDS)
+        qualifier, _, rest = segment.rpartition(':')
+        if not qualifier and not is_critical:
+            # "M 13-17": whatever precedes the first number qualifies it
+            start = re.search(r'[<>≤≥\d+-]|up to|below|under|above|over', segment)
+            qualifier, rest = (segment[:start.start()], segment[start.start():]) if start else ('', segment)
+        band = _band(rest, _qualifiers(qualifier), is_critical)
+        if band is not None:
+            (critical if is_critical else normal).append(band)
+    return Reference(tuple(normal), tuple(critical))
+
+
+def numeric(value):
+    """Float value of a result such as "5.4", "<0.1" or "140 mmol/L"; None when it is not a number."""
+    match = VALUE.fullmatch(THOUSANDS.sub('', str(value or '')))
+    return float(match.group(1)) if match else None
+
+
+def age_at(dob, age, when):
+    """Age in whole years at `when`, from the date of birth if known, else the recorded age."""
+    if dob is None:
+        return age
+    day = timezone.localdate(when)
+    return day.year - dob.year - ((day.month, day.day) < (dob.month, dob.day))
+
+
+def select(bands, sex, age):
+    """The most specific band that applies to a patient of `sex` and `age`, or None."""
+    best, best_score = None, -1
+    for band in bands:
+        if band.sex and band.sex != sex:
+            continue
+        if band.min_age is not None or band.max_age is not None:
+            if age is None or (band.min_age is not None and age < band.min_age) \
+                    or (band.max_age is not None and age >= band.max_age):
+                continue
+        score = (band.sex is not None) + (band.min_age is not None or band.max_age is not None)
+        if score > best_score:
+            best, best_score = band, score
+    return best
+
+
+def outside(band, value):
+    if band.low is not None and (value < band.low or (band.low_open and value == band.low)):
+        return True
+    return band.high is not None and (value > band.high or (band.high_open and value == band.high))
+
+
+def classify(normal_range, value, sex=None, age=None):
+    """(abnormal, critical) of a raw result value; abnormal is None when no range applies."""
+    value = numeric(value)
+    if value is None:
+        return None, False
+    reference = compile_range(normal_range)
+    normal, critical = select(reference.normal, sex, age), select(reference.critical, sex, age)
+    is_critical = critical is not None and outside(critical, value)
+    if normal is None:
+        return (True if is_critical else None), is_critical
+    return outside(normal, value) or is_critical, is_critical
+
+
+def contexts(item_ids):
+    """{lab order item id: Context} with one joined query."""
+    return {
+        row[0]: Context(*row[1:])
+        for row in LabOrderItem.objects.filter(pk__in=set(item_ids)).values_list('pk', *CONTEXT_FIELDS)
+    }
+
+
+def flag(results):
+    """
+    Set is_abnormal on LabResult objects (saved or not) from their tests'
+    reference ranges, with one query for the lot. Returns the critical
+    results as [(result, Context)].
+    """
+    known = contexts(result.lab_order_item_id for result in results if result.lab_order_item_id)
+    critical = []
+    for result in results:
+        context = known.get(result.lab_order_item_id)
+        if context is None or not context.normal_range:
+            continue
+        abnormal, is_critical = classify(
+            context.normal_range, result.result_value, context.gender,
+            age_at(context.dob, context.age, result.reported_at),
+        )
+        if abnormal is not None:
+            result.is_abnormal = abnormal
+        if is_critical:
+            critical.append((result, context))
+    return critical
+
+
+def result_url(result_id):
+    return reverse('labresult-detail', args=[result_id])
+
+
+def notify_critical(critical):
+    """One urgent Notification per critical result to its ordering and attending doctors."""
+    rows = []
+    for result, context in critical:
+        unit = f' {context.unit}' if context.unit else ''
+        patient = f'{context.first_name} {context.last_name}'.strip()
+        if context.mrn:
+            patient += f' ({context.mrn})'
+        for recipient_id in {context.ordered_by, context.attending} - {None}:
+            rows.append(Notification(
+                recipient_id=recipient_id, title=f'Critical {context.test_name} result',
+                message=f'{patient}: {context.test_name} {result.result_value}{unit} '
+                        f'(reference {context.normal_range}).',
+                priority='urgent', action_url=result_url(result.pk),
+            ))
+    return notifications.bulk_notify(rows)
+
+
+def backfill(chunk_size=BACKFILL_CHUNK, notify_within=None, now=None):
+    """
+    Re-flag every result with a numeric value against the current reference
+    ranges, a chunk of results per query and one UPDATE per flag value per
+    chunk. Critical results reported within `notify_within` (a timedelta)
+    that have not been notified yet are notified. Returns (results changed,
+    notifications sent).
+    """
+    notify_after = (now or timezone.now()) - notify_within if notify_within else None
+    fields = ['pk', 'result_value', 'is_abnormal', 'reported_at'] + [
+        f'lab_order_item__{field}' for field in CONTEXT_FIELDS
+    ]
+    changed, sent, last = 0, 0, 0
+    while True:
+        rows = list(
+            LabResult.objects.filter(pk__gt=last, lab_order_item__isnull=False)
+            .exclude(lab_order_item__lab_test__normal_range='').exclude(result_value='')
+            .order_by('pk').values_list(*fields)[:chunk_size]
+        )
+        if not rows:
+            return changed, sent
+        last = rows[-1][0]
+        flips, critical = {True: [], False: []}, []
+        for pk, value, is_abnormal, reported_at, *context in rows:
+            context = Context(*context)
+            abnormal, is_critical = classify(
+                context.normal_range, value, context.gender, age_at(context.dob, context.age, reported_at),
+            )
+            if abnormal is not None and abnormal != is_abnormal:
+                flips[abnormal].append(pk)
+            if is_critical and notify_after and reported_at >= notify_after:
+                critical.append((SimpleNamespace(pk=pk, result_value=value), context))
+        with transaction.atomic():
+            for abnormal, result_ids in flips.items():
+                if result_ids:
+                    changed += LabResult.objects.filter(pk__in=result_ids).update(is_abnormal=abnormal)
+            if critical:
+                notified = set(Notification.objects.filter(
+                    action_url__in=[result_url(result.pk) for result, _ in critical],
+                ).values_list('action_url', flat=True))
+                sent += len(notify_critical([
+                    (result, context) for result, context in critical if result_url(result.pk) not in notified
+                ]))
+
+
+def _flag_on_save(sender, instance, raw=False, **kwargs):
+    instance._critical = None
+    if raw or not instance.lab_order_item_id:
+        return
+    critical = flag([instance])
+    if critical and (instance._state.adding or instance.result_value != _saved_value(instance)):
+        instance._critical = critical
+
+
+def _saved_value(instance):
+    return LabResult.objects.filter(pk=instance.pk).values_list('result_value', flat=True).first()
+
+
+def _notify_on_save(sender, instance, raw=False, **kwargs):
+    critical = getattr(instance, '_critical', None)
+    if critical and not raw:
+        # The Notification needs the result's pk, which a new row only has now
+        notify_critical(critical)
+
+
+pre_save.connect(_flag_on_save, sender=LabResult, dispatch_uid='reference_ranges_flag')
+post_save.connect(_notify_on_save, sender=LabResult, dispatch_uid='reference_ranges_notify')
@@ -0,0 +1,148 @@
+# his/scheduling.py
+"""
+Doctor availability built on sorted interval lists.
+
+For every doctor and day the working window comes from the doctor's Staff
+shift (DEFAULT_SHIFT when no shift is recorded; a shift ending before it
+starts runs past midnight). Approved leave removes whole days, and every
+appointment that is not cancelled or a no-show removes
+[appointment_date, appointment_date + duration_minutes). Free time is the
+window minus the merged busy intervals, computed with a single sweep, and
+slots are cut from the free intervals.
+
+A query for any number of doctors and days costs four database queries:
+doctors, staff shifts, leave and appointments.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Appointment, LeaveRequest, Role, Staff, User
+
+DEFAULT_SHIFT = (time(9, 0), time(17, 0))
+DEFAULT_SLOT_MINUTES = 30
+MAX_DAYS = 14
+INACTIVE_APPOINTMENT_STATUSES = ['cancelled', 'no_show']
+# Appointments starting this long before the range can still overlap it
+MAX_APPOINTMENT_LENGTH = timedelta(days=1)
+
+
+def merge(intervals):
+    """Sort (start, end) intervals and merge the overlapping or touching ones."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract(free, busy):
+    """Remove merged, sorted `busy` intervals from sorted `free` intervals in one sweep."""
+    result = []
+    index = 0
+    for start, end in free:
+        while index < len(busy) and busy[index][1] <= start:
+            index += 1
+        cursor = start
+        probe = index
+        while probe < len(busy) and busy[probe][0] < end:
+            busy_start, busy_end = busy[probe]
+            if busy_start > cursor:
+                result.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            if busy_end > end:
+                break
+            probe += 1
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+def slots(free, window_start, length):
+    """Start times of `length`-long slots, aligned to `window_start`, that fit inside a free interval."""
+    starts = []
+    for start, end in free:
+        offset = (start - window_start) % length
+        current = start if not offset else start + (length - offset)
+        while current + length <= end:
+            starts.append(current)
+            current += length
+    return starts
+
+
+def _shift_window(day, shift, tz):
+    shift_start, shift_end = shift
+    start = timezone.make_aware(datetime.combine(day, shift_start), tz)
+    end = timezone.make_aware(datetime.combine(day, shift_end), tz)
+    if end <= start:
+        end += timedelta(days=1)
+    return start, end
+
+
+def doctors_for(department_id=None, doctor_ids=None):
+    doctors = User.objects.filter(role=Role.DOCTOR, is_active=True)
+    if department_id:
+        doctors = doctors.filter(staff_profile__department_id=department_id)
+    if doctor_ids:
+        doctors = doctors.filter(id__in=doctor_ids)
+    return list(doctors.order_by('first_name', 'last_name', 'id'))
+
+
+def availability(doctors, start_date, days=1, slot_minutes=DEFAULT_SLOT_MINUTES, now=None):
+    """
+    Free slots per doctor and day, as {doctor_id: {date: [aware datetimes]}}.
+    Slots starting before `now` are never offered.
+    """
+    tz = timezone.get_current_timezone()
+    now = now or timezone.now()
+    length = timedelta(minutes=slot_minutes)
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    doctor_ids = [doctor.id for doctor in doctors]
+
+    shifts = {
+        user_id: (shift_start, shift_end)
+        for user_id, shift_start, shift_end in Staff.objects.filter(
+            user_id__in=doctor_ids, active=True, shift_start__isnull=False, shift_end__isnull=False,
+        ).values_list('user_id', 'shift_start', 'shift_end')
+    }
+
+    on_leave = defaultdict(set)
+    for user_id, leave_start, leave_end in LeaveRequest.objects.filter(
+        staff__user_id__in=doctor_ids, status='approved',
+        start_date__lte=dates[-1], end_date__gte=dates[0],
+    ).values_list('staff__user_id', 'start_date', 'end_date'):
+        for day in dates:
+            if leave_start <= day <= leave_end:
+                on_leave[user_id].add(day)
+
+    # Overnight shifts reach into the day after the last one
+    range_start = timezone.make_aware(datetime.combine(dates[0], time.min), tz)
+    range_end = timezone.make_aware(datetime.combine(dates[-1] + timedelta(days=2), time.min), tz)
+    busy = defaultdict(list)
+    for doctor_id, starts_at, minutes in Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        appointment_date__gte=range_start - MAX_APPOINTMENT_LENGTH,
+        appointment_date__lt=range_end,
+    ).exclude(status__in=INACTIVE_APPOINTMENT_STATUSES).values_list(
+        'doctor_id', 'appointment_date', 'duration_minutes'
+    ):
+        busy[doctor_id].append((starts_at, starts_at + timedelta(minutes=minutes or slot_minutes)))
+
+    result = {}
+    for doctor_id in doctor_ids:
+        taken = merge(busy[doctor_id])
+        shift = shifts.get(doctor_id, DEFAULT_SHIFT)
+        per_day = {}
+        for day in dates:
+            if day in on_leave[doctor_id]:
+                per_day[day] = []
+                continue
+            window_start, window_end = _shift_window(day, shift, tz)
+            free = subtract([(max(window_start, now), window_end)] if window_end > now else [], taken)
+            per_day[day] = slots(free, window_start, length)
+        result[doctor_id] = per_day
+    return result
@@ -0,0 +1,246 @@
+# his/search_index.py
+"""
+Patient search index.
+
+Each patient gets a set of PatientSearchToken rows built from MRN, name and
+contact number:
+
+* 'w:<word>'   every name word, the full name, the MRN and the phone digits,
+               so prefix searches are a single index range scan;
+* 'r:<digits>' the phone digits reversed, so "last N digits" searches are a
+               prefix range scan as well;
+* 'g:<abc>'    trigrams of the same values, for substring searches, which
+               need every trigram of the query and a final check against the
+               real values.
+
+Tokens are rebuilt on Patient save; rows written with bulk_create() or
+update() need the rebuild_patient_search_index command.
+"""
+import re
+
+from django.db import transaction
+from django.db.models import Count, Q, Value
+from django.db.models.functions import Concat, Lower, Replace
+from django.db.models.signals import post_save
+
+from .models import Patient, PatientSearchToken
+
+MIN_QUERY_LENGTH = 3
+INDEXED_FIELDS = {'mrn', 'first_name', 'last_name', 'contact_number'}
+TERM_MAX_LENGTH = 255
+# Upper bound on the posting list read for the rarest trigram of a substring query
+SUBSTRING_CANDIDATES = 2000
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    return _NON_ALNUM.sub(' ', (text or '').lower()).strip()
+
+
+def digits_only(text):
+    return re.sub(r'\D', '', text or '')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _searchable_values(mrn, first_name, last_name, contact_number):
+    name = normalize(f"{first_name} {last_name}")
+    return name, normalize(mrn).replace(' ', ''), digits_only(contact_number)
+
+
+def terms_for(mrn, first_name, last_name, contact_number):
+    name, mrn, phone = _searchable_values(mrn, first_name, last_name, contact_number)
+    terms = set()
+    for word in name.split() + [name, mrn, phone]:
+        if word:
+            terms.add(f"w:{word}")
+    if phone:
+        terms.add(f"r:{phone[::-1]}")
+    for value in (name, mrn, phone):
+        terms.update(f"g:{gram}" for gram in trigrams(value))
+    return {term[:TERM_MAX_LENGTH] for term in terms}
+
+
+def _tokens_for(patient):
+    terms = terms_for(patient.mrn, patient.first_name, patient.last_name, patient.contact_number)
+    return [PatientSearchToken(patient_id=patient.pk, term=term) for term in terms]
+
+
+def index_patients(patients):
+    """Replace the tokens of the given Patient instances (one delete and one bulk insert)."""
+    patients = list(patients)
+    tokens = [token for patient in patients for token in _tokens_for(patient)]
+    with transaction.atomic():
+        PatientSearchToken.objects.filter(patient_id__in=[patient.pk for patient in patients]).delete()
+        PatientSearchToken.objects.bulk_create(tokens, batch_size=5000)
+    return len(tokens)
+
+
+def rebuild(chunk_size=2000):
+    """Rebuild the whole index; returns (patients, tokens) written."""
+    PatientSearchToken.objects.all().delete()
+    patients = tokens = 0
+    queryset = Patient.objects.only('uid', *INDEXED_FIELDS).order_by('pk')
+    chunk = []
+    for patient in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(patient)
+        if len(chunk) == chunk_size:
+            tokens += index_patients(chunk)
+            patients += len(chunk)
+            chunk = []
+    if chunk:
+        tokens += index_patients(chunk)
+        patients += len(chunk)
+    return patients, tokens
+
+
+def _prefix(prefix):
+    """
+    Filter for terms starting with `prefix` as a plain range, which every
+    backend answers from the term index (LIKE 'x%' does not, on SQLite or
+    on PostgreSQL without a pattern_ops index).
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {'term__gte': prefix, 'term__lt': upper}
+
+
+def _head(queryset, size):
+    """The first `size` rows of `queryset`, or all of them when `size` is None."""
+    return queryset if size is None else queryset[:size]
+
+
+def _substring_candidates(grams, wanted):
+    """
+    Patients having every trigram. Starts from the rarest trigram so the
+    common ones are only probed, and reads a short slice of its posting list
+    first: a common substring yields enough matches from that alone. With
+    `wanted` None the whole posting list is read.
+    """
+    tokens = PatientSearchToken.objects.values_list('patient_id', flat=True)
+    sizes = {gram: tokens.filter(term=gram)[:SUBSTRING_CANDIDATES].count() for gram in grams}
+    rarest = min(sizes, key=sizes.get)
+    others = grams - {rarest}
+    matches = []
+    for size in (wanted * 4, SUBSTRING_CANDIDATES) if wanted is not None else (None,):
+        candidates = list(_head(tokens.filter(term=rarest), size))
+        if not others:
+            matches = candidates
+        else:
+            matches = list(
+                PatientSearchToken.objects.filter(term__in=others, patient_id__in=candidates)
+                .values('patient_id').annotate(hits=Count('id')).filter(hits=len(others))
+                .values_list('patient_id', flat=True)
+            )
+        if size is None or len(matches) >= wanted or len(candidates) < size:
+            break
+    return matches
+
+
+def search(query, limit=10):
+    """
+    Patient primary keys matching `query`, best matches first: word prefix
+    matches (name, MRN, phone), then phone-suffix matches, then substring
+    matches. Returns at most `limit` ids, or every match when `limit` is
+    None; listings that order and paginate the match set use matching().
+    """
+    text = normalize(query)
+    if len(text.replace(' ', '')) < MIN_QUERY_LENGTH:
+        return []
+
+    found = []
+    seen = set()
+
+    def collect(ids):
+        for patient_id in ids:
+            if patient_id not in seen:
+                seen.add(patient_id)
+                found.append(patient_id)
+
+    # Phone numbers and MRNs are indexed without separators
+    compact = text.replace(' ', '')
+    probe = compact if compact.isdigit() else text
+    tokens = PatientSearchToken.objects.values_list('patient_id', flat=True)
+
+    # Prefix of a name word, the full name, the MRN or the phone number
+    def wants_more():
+        return limit is None or len(found) < limit
+
+    def scaled(factor):
+        return None if limit is None else limit * factor
+
+    collect(_head(tokens.filter(**_prefix(f"w:{probe}")), scaled(3)))
+
+    # Last digits of the phone number
+    if compact.isdigit() and wants_more():
+        collect(_head(tokens.filter(**_prefix(f"r:{compact[::-1]}")), scaled(3)))
+
+    # Substring anywhere: every trigram must be present, then check the real values
+    if wants_more():
+        grams = {f"g:{gram}" for gram in trigrams(probe)}
+        candidates = _head([
+            patient_id for patient_id in _substring_candidates(grams, scaled(2)) if patient_id not in seen
+        ], scaled(5))
+        rows = Patient.objects.filter(pk__in=candidates).values_list(
+            'pk', 'mrn', 'first_name', 'last_name', 'contact_number'
+        )
+        values = {row[0]: _searchable_values(*row[1:]) for row in rows}
+        collect(
+            patient_id for patient_id in candidates
+            if patient_id in values and _contains(values[patient_id], text, compact)
+        )
+
+    return _head(found, limit)
+
+
+def matching(query):
+    """
+    Every patient search() would find, as a queryset of primary keys for use
+    as a subquery (Patient.objects.filter(pk__in=matching(q))), so the whole
+    match set is ordered and paginated by the database instead of being read
+    into Python. The substring check against the real values runs in SQL.
+    """
+    text = normalize(query)
+    compact = text.replace(' ', '')
+    if len(compact) < MIN_QUERY_LENGTH:
+        return Patient.objects.none().values('pk')
+
+    probe = compact if compact.isdigit() else text
+    tokens = PatientSearchToken.objects.values('patient_id')
+    found = Q(pk__in=tokens.filter(**_prefix(f"w:{probe}")))
+    if compact.isdigit():
+        found |= Q(pk__in=tokens.filter(**_prefix(f"r:{compact[::-1]}")))
+
+    grams = {f"g:{gram}" for gram in trigrams(probe)}
+    having_all = (
+        tokens.filter(term__in=grams).annotate(hits=Count('id')).filter(hits=len(grams))
+        .values('patient_id')
+    )
+    phone = 'contact_number'
+    for separator in (' ', '-', '+', '(', ')'):
+        phone = Replace(phone, Value(separator), Value(''))
+    substring = Patient.objects.filter(pk__in=having_all).annotate(
+        search_name=Concat(Lower('first_name'), Value(' '), Lower('last_name')),
+        search_phone=phone,
+    ).filter(
+        Q(search_name__contains=text) | Q(mrn__icontains=compact) | Q(search_phone__contains=compact)
+    ).values('pk')
+    return Patient.objects.filter(found | Q(pk__in=substring)).values('pk')
+
+
+def _contains(values, text, compact):
+    name, mrn, phone = values
+    return text in name or compact in mrn or compact in phone
+
+
+def _reindex_patient(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not INDEXED_FIELDS & set(update_fields):
+        return
+    index_patients([instance])
+
+
+post_save.connect(_reindex_patient, sender=Patient, dispatch_uid='search_index_reindex_patient')
@@ -0,0 +1,122 @@
+# his/sequences.py
+"""
+Document number allocator for MRNs, visit IDs, invoice and payment numbers.
+
+Every document type draws from a SequenceCounter row keyed by its prefix
+(MRN2025, V250916, INV250916, PAY250916). Instead of locking that row for
+every number, each worker process reserves a block of numbers in one short
+transaction and hands them out from memory until the block runs dry.
+
+Numbers are never handed out twice. They are not gap-free: the unused tail
+of a block is lost when a worker restarts, and numbers drawn inside a
+transaction that later rolls back are not reused. Set a block size of 1
+for a document type that must be gap-free, at the cost of a row lock per
+number.
+"""
+import threading
+from collections import deque
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SequenceCounter
+
+
+# kind -> (prefix format, zero padding of the running number)
+SEQUENCE_FORMATS = {
+    'mrn': ('MRN{date:%Y}', 4),
+    'visit': ('V{date:%y%m%d}', 4),
+    'invoice': ('INV{date:%y%m%d}', 4),
+    'payment': ('PAY{date:%y%m%d}', 5),
+}
+
+DEFAULT_BLOCK_SIZE = 20
+
+
+class SequenceAllocator:
+    """Hands out sequence numbers from per-process blocks reserved in the database."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}  # key -> deque of [next_value, last_value] ranges
+
+    def block_size(self, kind):
+        sizes = getattr(settings, 'HIS_SEQUENCE_BLOCK_SIZES', {})
+        return max(1, int(sizes.get(kind, DEFAULT_BLOCK_SIZE)))
+
+    def next_value(self, key, block_size=DEFAULT_BLOCK_SIZE):
+        with self._lock:
+            value = self._take(key)
+        if value is not None:
+            return value
+
+        # Reserve outside the in-process lock so other keys keep flowing
+        # while this worker waits on the counter row.
+        start, end = self._reserve(key, block_size)
+        if end > start:
+            # Only keep the rest of the block once the reservation is
+            # committed; if an enclosing transaction rolls back, the counter
+            # rolls back with it and the numbers must not be reused.
+            transaction.on_commit(partial(self._install, key, start + 1, end))
+        return start
+
+    def _take(self, key):
+        ranges = self._blocks.get(key)
+        while ranges:
+            block = ranges[0]
+            if block[0] <= block[1]:
+                value = block[0]
+                block[0] += 1
+                return value
+            ranges.popleft()
+        return None
+
+    def _install(self, key, start, end):
+        with self._lock:
+            self._blocks.setdefault(key, deque()).append([start, end])
+
+    def _reserve(self, key, block_size):
+        with transaction.atomic():
+            counter, created = SequenceCounter.objects.select_for_update().get_or_create(key=key)
+            start = counter.last_value + 1
+            counter.last_value += block_size
+            counter.save(update_fields=['last_value'])
+        return start, counter.last_value
+
+    def reset(self):
+        """Drop all cached blocks (their remaining numbers are skipped)."""
+        with self._lock:
+            self._blocks.clear()
+
+
+allocator = SequenceAllocator()
+
+
+def next_number(kind, when=None):
+    """Return the next formatted document number for a kind in SEQUENCE_FORMATS."""
+    prefix_format, width = SEQUENCE_FORMATS[kind]
+    prefix = prefix_format.format(date=timezone.localtime(when or timezone.now()))
+    value = allocator.next_value(prefix, allocator.block_size(kind))
+    return f"{prefix}{value:0{width}d}"
+
+
+def generate_mrn():
+    """Generate unique MRN"""
+    return next_number('mrn')
+
+
+def generate_visit_id():
+    """Generate unique visit ID"""
+    return next_number('visit')
+
+
+def generate_invoice_number():
+    """Generate unique invoice number"""
+    return next_number('invoice')
+
+
+def generate_payment_number():
+    """Generate unique payment number"""
+    return next_number('payment')
@@ -1,12 +1,13 @@
 # his/serializers.py
 from rest_framework import serializers
+from django.db.models import Count, Prefetch, Q
 from .models import (
     User, Staff, AuditLog, Patient, Visit, MedicalRecord, Department,
     Prescription, PrescriptionItem, MedicationDispense, PharmacyStock, Procurement, ProcurementItem,
     LabOrder, LabOrderItem, LabResult, LabTest, RadiologyOrder, RadiologyReport, RadiologyStudy,
     Invoice, InvoiceItem, Payment, InsuranceClaim, InsuranceProvider, Ward, Bed,
     Appointment, Surgery, OperationTheatre, Vitals, Service, TreatmentPackage,
-    LeaveRequest, LeaveType, SystemConfiguration, Notification, FollowUp, EmergencyContact
+    LeaveRequest, LeaveType, SystemConfiguration, Notification, FollowUp, EmergencyContact, StockMovement
 )
 
 # User Serializer
@@ -81,12 +82,21 @@ class PatientSerializer(serializers.ModelSerializer):
                   'emergency_contacts', 'active_visits_count']
         read_only_fields = ['uid', 'created_at', 'created_by']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Annotate and prefetch everything this serializer reads, so a page costs a fixed number of queries."""
+        return queryset.annotate(
+            active_visit_total=Count('visits', filter=Q(visits__status='active'))
+        ).prefetch_related('emergency_contacts')
+    
     def get_age_display(self, obj):
         if obj.age:
             return f"{obj.age} years"
         return None
     
     def get_active_visits_count(self, obj):
+        if hasattr(obj, 'active_visit_total'):
+            return obj.active_visit_total
         return obj.visits.filter(status='active').count()
 
 # Ward Serializer
@@ -96,7 +106,7 @@ class WardSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Ward
-        fields = ['id', 'name', 'ward_type', 'total_beds', 'available_beds', 
+        fields = ['id', 'name', 'ward_type', 'total_beds', 'occupied_beds', 'available_beds', 
                   'department', 'nurse_in_charge', 'nurse_name', 'is_active']
     
     def get_nurse_name(self, obj):
@@ -110,18 +120,22 @@ class BedSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bed
         fields = ['id', 'bed_number', 'ward', 'ward_name', 'is_occupied', 
-                  'is_maintenance', 'bed_type', 'daily_rate', 'patient_name']
+                  'is_maintenance', 'bed_type', 'daily_rate', 'current_visit', 'patient_name']
+        read_only_fields = ['is_occupied', 'current_visit']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join the ward and the occupant's patient, so a bed list is a single query."""
+        return queryset.select_related('ward', 'current_visit__patient')
     
     def get_ward_name(self, obj):
         return obj.ward.name if obj.ward else None
     
     def get_patient_name(self, obj):
-        if obj.is_occupied:
-            # Assuming Visit model has ForeignKey to Bed with related_name='visits'
-            active_visit = obj.visits.filter(status='active').first() if hasattr(obj, 'visits') else None
-            if active_visit:
-                patient = active_visit.patient
-                return f"{patient.first_name} {patient.last_name}"
+        # current_visit is maintained by his/beds.py; select it with setup_eager_loading()
+        if obj.is_occupied and obj.current_visit_id:
+            patient = obj.current_visit.patient
+            return f"{patient.first_name} {patient.last_name}"
         return None
 
 # Appointment Serializer
@@ -181,6 +195,45 @@ class VisitSerializer(serializers.ModelSerializer):
             return duration.days
         return None
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load doctor, department, bed/ward and the fully annotated patient up front."""
+        return queryset.select_related('attending_doctor', 'department', 'bed__ward').prefetch_related(
+            Prefetch('patient', queryset=PatientSerializer.setup_eager_loading(Patient.objects.all()))
+        )
+
+# Flat Visit Serializer for list/board views (no nested patient)
+class VisitListSerializer(VisitSerializer):
+    patient_mrn = serializers.CharField(source='patient.mrn', read_only=True)
+    patient_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Visit
+        fields = ['id', 'patient', 'patient_mrn', 'patient_name', 'visit_id', 'visit_type',
+                  'admitted_at', 'discharged_at', 'department', 'department_name',
+                  'attending_doctor', 'doctor_name', 'bed', 'bed_info', 'reason',
+                  'status', 'follow_up_date', 'duration']
+        read_only_fields = fields
+
+    # Only the columns the fields above actually read
+    LOAD_FIELDS = [
+        'id', 'patient', 'visit_id', 'visit_type', 'admitted_at', 'discharged_at',
+        'department', 'attending_doctor', 'bed', 'reason', 'status', 'follow_up_date',
+        'patient__mrn', 'patient__first_name', 'patient__last_name',
+        'department__name',
+        'attending_doctor__first_name', 'attending_doctor__last_name',
+        'bed__bed_number', 'bed__ward__name',
+    ]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset.select_related(
+            'patient', 'attending_doctor', 'department', 'bed__ward'
+        ).only(*cls.LOAD_FIELDS)
+
+    def get_patient_name(self, obj):
+        return f"{obj.patient.first_name} {obj.patient.last_name}".strip()
+
 # Vitals Serializer
 class VitalsSerializer(serializers.ModelSerializer):
     recorded_by_name = serializers.SerializerMethodField()
@@ -275,19 +328,38 @@ class MedicationDispenseSerializer(serializers.ModelSerializer):
 class PharmacyStockSerializer(serializers.ModelSerializer):
     stock_status = serializers.SerializerMethodField()
     expiry_status = serializers.SerializerMethodField()
+    # The stored bucket lags until the daily sweep ages it; report it as of today
+    expiry_bucket = serializers.SerializerMethodField()
     
     class Meta:
         model = PharmacyStock
         fields = ['id', 'medication_name', 'generic_name', 'manufacturer', 
                   'batch_number', 'expiry_date', 'quantity', 'unit_price', 
                   'selling_price', 'minimum_stock_level', 'last_updated',
-                  'stock_status', 'expiry_status']
-    
+                  'stock_status', 'expiry_status', 'expiry_bucket']
+
+    # Read from the flag stored on write rather than recomputed per row
     def get_stock_status(self, obj):
-        return 'low' if obj.is_low_stock else 'normal'
+        return 'low' if obj.low_stock else 'normal'
     
     def get_expiry_status(self, obj):
-        return 'expired' if obj.is_expired else 'valid'
+        return 'expired' if self.get_expiry_bucket(obj) == 'expired' else 'valid'
+
+    def get_expiry_bucket(self, obj):
+        return PharmacyStock.expiry_bucket_for(obj.expiry_date)
+
+# StockMovement Serializer
+class StockMovementSerializer(serializers.ModelSerializer):
+    created_by_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'stock', 'kind', 'quantity', 'dispense', 'procurement_item',
+                  'created_by', 'created_by_name', 'created_at', 'notes']
+        read_only_fields = fields
+
+    def get_created_by_name(self, obj):
+        return obj.created_by.get_full_name() if obj.created_by else None
 
 # ProcurementItem Serializer
 class ProcurementItemSerializer(serializers.ModelSerializer):
@@ -364,6 +436,22 @@ class LabOrderSerializer(serializers.ModelSerializer):
     def get_sample_collected_by_name(self, obj):
         return obj.sample_collected_by.get_full_name() if obj.sample_collected_by else None
 
+# Lab worklist item Serializer
+class LabWorklistItemSerializer(serializers.ModelSerializer):
+    test_name = serializers.CharField(source='lab_test.name', read_only=True)
+    priority = serializers.CharField(source='lab_order.priority', read_only=True)
+    patient_info = serializers.SerializerMethodField()
+
+    class Meta:
+        model = LabOrderItem
+        fields = ['id', 'lab_order', 'lab_test', 'test_name', 'queue', 'priority', 'priority_rank',
+                  'status', 'queued_at', 'claimed_by', 'claimed_at', 'completed_at', 'patient_info']
+        read_only_fields = fields
+
+    def get_patient_info(self, obj):
+        patient = obj.lab_order.visit.patient
+        return f"{patient.mrn} - {patient.first_name} {patient.last_name}"
+
 # LabResult Serializer
 class LabResultSerializer(serializers.ModelSerializer):
     test_name = serializers.SerializerMethodField()
@@ -377,6 +465,13 @@ class LabResultSerializer(serializers.ModelSerializer):
                   'result_text', 'is_abnormal', 'reported_by', 'reported_by_name',
                   'verified_by', 'verified_by_name', 'reported_at', 'verified_at']
         read_only_fields = ['id', 'reported_at', 'reported_by']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Join the test, patient and users, so a page of results is a single query."""
+        return queryset.select_related(
+            'lab_order_item__lab_test', 'lab_order_item__lab_order__visit__patient', 'reported_by', 'verified_by',
+        )
     
     def get_test_name(self, obj):
         return obj.lab_order_item.lab_test.name if obj.lab_order_item and obj.lab_order_item.lab_test else None
@@ -21,4 +21,89 @@ document.addEventListener('DOMContentLoaded', () => {
             localStorage.setItem('theme', 'light');
         }
     });
-});
\ No newline at end of file
+});
+
+// --- Notifications: pushed over a WebSocket (his/consumers.py), no polling ---
+document.addEventListener('DOMContentLoaded', () => {
+    const badge = document.getElementById('notification-count');
+    if (!badge || !('WebSocket' in window)) {
+        return;  // not signed in, or no socket support
+    }
+    const container = document.getElementById('notifications-container');
+    const maxShown = 10;
+    let retryDelay = 1000;
+
+    function setCount(count) {
+        badge.textContent = count;
+        badge.hidden = count === 0;
+    }
+
+    function render(notification) {
+        const item = document.createElement('div');
+        item.className = `notification-item priority-${notification.priority}`;
+        item.dataset.id = notification.id;
+
+        const title = document.createElement(notification.action_url ? 'a' : 'strong');
+        title.textContent = notification.title;
+        if (notification.action_url) {
+            title.href = notification.action_url;
+        }
+        const message = document.createElement('p');
+        message.textContent = notification.message;
+        const time = document.createElement('small');
+        time.textContent = new Date(notification.created_at).toLocaleString();
+
+        item.append(title, message, time);
+        return item;
+    }
+
+    function show(notifications, prepend) {
+        if (!container) {
+            return;
+        }
+        if (!prepend) {
+            container.replaceChildren();
+        }
+        notifications.forEach((notification) => {
+            const item = render(notification);
+            prepend ? container.prepend(item) : container.append(item);
+        });
+        while (container.children.length > maxShown) {
+            container.lastElementChild.remove();
+        }
+    }
+
+    function connect() {
+        const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const socket = new WebSocket(`${scheme}://${window.location.host}/ws/notifications/`);
+
+        socket.addEventListener('open', () => {
+            retryDelay = 1000;
+        });
+        socket.addEventListener('message', (event) => {
+            const data = JSON.parse(event.data);
+            if (data.type === 'snapshot') {
+                show(data.notifications, false);
+            } else if (data.type === 'notification') {
+                show([data.notification], true);
+            }
+            setCount(data.unread_count);
+        });
+        socket.addEventListener('close', () => {
+            // Reconnect with backoff; the snapshot on reconnect fills any gap
+            setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        });
+
+        if (container) {
+            container.onclick = (event) => {
+                const item = event.target.closest('.notification-item');
+                if (item && socket.readyState === WebSocket.OPEN) {
+                    socket.send(JSON.stringify({action: 'mark_read', id: Number(item.dataset.id)}));
+                }
+            };
+        }
+    }
+
+    connect();
+});
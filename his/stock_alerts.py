@@ -0,0 +1,135 @@
+# his/stock_alerts.py
+"""
+Expiry ageing and pharmacist alerts for pharmacy stock.
+
+Every PharmacyStock row stores a low_stock flag and an expiry bucket
+(expired, within 30 days, within 90 days, later, none) that are set
+whenever the row is written, so the low-stock and expiry lists read
+indexed columns. Buckets also age with the calendar; age_buckets() moves
+batches on with one UPDATE per bucket boundary. Lists that must be right
+even when the sweep is late filter with in_bucket(), which checks the
+expiry date against today within the stored buckets.
+
+sweep() runs from the sweep_stock_alerts command, at least daily. It ages
+the buckets and then sends each pharmacist one summary Notification per
+condition that gained batches since the last sweep: newly low on stock,
+newly expired, or newly inside 30 or 90 days of expiry. The
+alerted_* columns record what was last reported, so a batch is reported
+once per change of state and not on every run.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from . import notifications
+from .models import Notification, PharmacyStock, Role, User
+
+ALERT_BUCKETS = [bucket for bucket, _ in PharmacyStock.EXPIRY_WINDOWS]  # most urgent first
+SEVERITY = {bucket: rank for rank, bucket in enumerate(reversed(ALERT_BUCKETS), start=1)}
+PRIORITY = {'low_stock': 'medium', 'expired': 'high', '30d': 'medium', '90d': 'low'}
+TITLES = {
+    'low_stock': '{count} batch(es) below minimum stock level',
+    'expired': '{count} batch(es) expired',
+    '30d': '{count} batch(es) expire within 30 days',
+    '90d': '{count} batch(es) expire within 90 days',
+}
+LISTED = 10
+
+
+def age_buckets(today=None):
+    """
+    Move batches whose expiry date has come within a nearer bucket. Buckets
+    only ever get nearer with time, so each UPDATE reads the (expiry_bucket,
+    expiry_date) index for just the rows that change. Returns the number of
+    batches moved.
+    """
+    today = today or timezone.localdate()
+    moved = 0
+    for index, (bucket, days) in enumerate(PharmacyStock.EXPIRY_WINDOWS):
+        later = [name for name, _ in PharmacyStock.EXPIRY_WINDOWS[index + 1:]] + ['later']
+        moved += PharmacyStock.objects.filter(
+            expiry_bucket__in=later, expiry_date__lt=today + timedelta(days=days),
+        ).update(expiry_bucket=bucket)
+    return moved
+
+
+def in_bucket(bucket, today=None):
+    """
+    Filter for the batches whose expiry date falls in `bucket` (one of
+    ALERT_BUCKETS) today, whether or not age_buckets() has moved them there
+    yet. A stored bucket can only lag behind, so this looks in `bucket` and
+    the later ones, through the (expiry_bucket, expiry_date) index.
+    """
+    today = today or timezone.localdate()
+    names = ALERT_BUCKETS + ['later']
+    windows = dict(PharmacyStock.EXPIRY_WINDOWS)
+    index = names.index(bucket)
+    condition = Q(expiry_bucket__in=names[index:], expiry_date__lt=today + timedelta(days=windows[bucket]))
+    if index:
+        condition &= Q(expiry_date__gte=today + timedelta(days=windows[names[index - 1]]))
+    return condition
+
+
+def pending_alerts():
+    """
+    {condition: [batch rows]} of batches that entered a condition since the
+    last sweep, and {(low_stock, expiry_bucket): [ids]} of every row whose
+    alerted_* columns no longer match its state.
+    """
+    fields = ('pk', 'medication_name', 'batch_number', 'expiry_date', 'quantity',
+              'low_stock', 'expiry_bucket', 'alerted_low_stock', 'alerted_expiry_bucket')
+    changed = PharmacyStock.objects.filter(
+        ~Q(low_stock=F('alerted_low_stock')) | ~Q(expiry_bucket=F('alerted_expiry_bucket'))
+    )
+    alerts = {'low_stock': []}
+    alerts.update({bucket: [] for bucket in ALERT_BUCKETS})
+    stale = {}
+    for row in changed.order_by('expiry_date', 'medication_name').values(*fields):
+        stale.setdefault((row['low_stock'], row['expiry_bucket']), []).append(row['pk'])
+        if row['low_stock'] and not row['alerted_low_stock']:
+            alerts['low_stock'].append(row)
+        if SEVERITY.get(row['expiry_bucket'], 0) > SEVERITY.get(row['alerted_expiry_bucket'], 0):
+            alerts[row['expiry_bucket']].append(row)
+    return {condition: rows for condition, rows in alerts.items() if rows}, stale
+
+
+def _describe(row):
+    text = f"{row['medication_name']} (batch {row['batch_number']}"
+    if row['expiry_date']:
+        text += f", expires {row['expiry_date']:%Y-%m-%d}"
+    return text + f", {row['quantity']} on hand)"
+
+
+def _action_url(condition):
+    if condition == 'low_stock':
+        return reverse('pharmacystock-low-stock')
+    return f"{reverse('pharmacystock-expired')}?bucket={condition}"
+
+
+def sweep(today=None):
+    """Age expiry buckets and notify pharmacists of new alerts. Returns (batches moved, notifications)."""
+    moved = age_buckets(today)
+    with transaction.atomic():
+        alerts, stale = pending_alerts()
+        # Record the state as read, so a change made meanwhile is reported next time
+        for (low_stock, expiry_bucket), stock_ids in stale.items():
+            PharmacyStock.objects.filter(pk__in=stock_ids).update(
+                alerted_low_stock=low_stock, alerted_expiry_bucket=expiry_bucket,
+            )
+        pharmacists = list(
+            User.objects.filter(role=Role.PHARMACIST, is_active=True).values_list('pk', flat=True)
+        )
+        rows = []
+        for condition, batches in alerts.items():
+            message = '; '.join(_describe(row) for row in batches[:LISTED])
+            if len(batches) > LISTED:
+                message += f'; and {len(batches) - LISTED} more'
+            for recipient_id in pharmacists:
+                rows.append(Notification(
+                    recipient_id=recipient_id, title=TITLES[condition].format(count=len(batches)),
+                    message=message + '.', priority=PRIORITY[condition], action_url=_action_url(condition),
+                ))
+        return moved, notifications.bulk_notify(rows)
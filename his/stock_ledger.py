@@ -0,0 +1,251 @@
+# his/stock_ledger.py
+"""
+Append-only pharmacy stock ledger.
+
+Every change to a batch's quantity is a StockMovement row: receipts from
+procurement, dispenses (his/dispensing.py), returns and manual adjustments.
+PharmacyStock.quantity is the running balance, changed only together with
+a movement and only by a relative UPDATE (quantity = quantity + the sum of
+the new movements) that runs last in the transaction. No code path overwrites a balance it read
+earlier, and dispensing no longer holds SELECT ... FOR UPDATE locks on the
+busiest batches while it allocates: a batch row is locked only from that
+final UPDATE to commit.
+
+StockSnapshot rows written by the snapshot_stock_balances command fix each
+batch's balance at a point in time. balance_at() starts from the latest
+snapshot before the requested moment and adds only the movements after it,
+instead of replaying the whole ledger; verify() compares the ledger with
+the stored balances.
+
+Each write also keeps the batch's stored low_stock flag in step (only rows
+that cross their minimum stock level are rewritten), so low-stock lists and
+counts read an indexed column.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.db import transaction
+from django.db.models import DateTimeField, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import bulk, counters
+from .models import MedicationDispense, PharmacyStock, StockMovement, StockSnapshot
+
+ZERO = Decimal('0')
+BEFORE_LEDGER = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+SNAPSHOT_LAG = timedelta(minutes=5)
+STAMP_PRECISION = timedelta(milliseconds=1)
+
+
+class NegativeBalance(ValueError):
+    pass
+
+
+def _low_stock_state(stock_id, low_stock):
+    return SimpleNamespace(pk=stock_id, low_stock=low_stock)
+
+
+def apply_movements(movements):
+    """
+    Add just-written movements to their batches' stored balances in one
+    relative UPDATE, refusing (NegativeBalance) if any batch would go below
+    zero. Call inside the transaction that wrote the movements, after them,
+    so the batch rows stay locked only from here to commit.
+    """
+    movements = [movement for movement in movements if movement.quantity]
+    if not movements:
+        return
+    stock_ids = {movement.stock_id for movement in movements}
+    moved = StockMovement.objects.filter(
+        stock=OuterRef('pk'), pk__in=[movement.pk for movement in movements],
+    ).order_by().values('stock')
+    amount = DecimalField(max_digits=12, decimal_places=2)
+    added = Subquery(moved.annotate(total=Sum('quantity')).values('total'), output_field=amount)
+    taken = Subquery(moved.annotate(total=Sum(F('quantity') * -1)).values('total'), output_field=amount)
+    updated = PharmacyStock.objects.filter(pk__in=stock_ids, quantity__gte=taken).update(
+        quantity=F('quantity') + added, last_updated=timezone.now(),
+    )
+    deltas = {}
+    for movement in movements:
+        deltas[movement.stock_id] = deltas.get(movement.stock_id, ZERO) + movement.quantity
+    if updated != len(stock_ids):
+        raise NegativeBalance("Not enough stock on hand in batch(es) " + ', '.join(
+            str(pk) for pk, quantity in PharmacyStock.objects.filter(pk__in=stock_ids).values_list('pk', 'quantity')
+            if quantity < -deltas[pk]
+        ))
+    # Only batches crossing their minimum stock level have their flag rewritten
+    flips = {True: [], False: []}
+    for pk, quantity, minimum, low_stock in PharmacyStock.objects.filter(pk__in=stock_ids).values_list(
+        'pk', 'quantity', 'minimum_stock_level', 'low_stock',
+    ):
+        if (quantity <= minimum) != low_stock:
+            flips[not low_stock].append(pk)
+    for low_stock, flipped in flips.items():
+        if flipped:
+            PharmacyStock.objects.filter(pk__in=flipped).update(low_stock=low_stock)
+    # The UPDATEs send no signals; keep the low-stock dashboard counter in step
+    counters.record_bulk(PharmacyStock, [
+        (_low_stock_state(pk, not low_stock), _low_stock_state(pk, low_stock))
+        for low_stock, flipped in flips.items() for pk in flipped
+    ])
+
+
+def post(stock, kind, quantity, created_by=None, notes='', dispense=None, procurement_item=None):
+    """Append one movement and apply it to the batch balance. Returns the movement."""
+    quantity = Decimal(str(quantity))
+    with transaction.atomic():
+        movement = StockMovement.objects.create(
+            stock_id=getattr(stock, 'pk', stock), kind=kind, quantity=quantity, created_by=created_by,
+            notes=notes, dispense=dispense, procurement_item=procurement_item,
+        )
+        apply_movements([movement])
+    return movement
+
+
+def adjust(stock, quantity, created_by=None, notes=''):
+    """Stock-take correction or write-off (negative)."""
+    return post(stock, 'adjustment', quantity, created_by=created_by, notes=notes)
+
+
+def return_dispense(dispense, quantity=None, created_by=None, notes=''):
+    """
+    Put (part of) a dispense back into the batch it was taken from. The
+    default is whatever of the dispense has not been returned yet. Refuses
+    (ValueError) a quantity that is not positive or that would bring the
+    returns above the quantity dispensed.
+    """
+    with transaction.atomic():
+        # Serialises returns of the same dispense, so their total is checked against committed rows
+        dispense = MedicationDispense.objects.select_for_update().get(pk=dispense.pk)
+        movements = dispense.stock_movements
+        taken = movements.filter(kind='dispense').values_list('stock_id', flat=True).first()
+        if taken is None:
+            raise ValueError(f"Dispense {dispense.pk} has no stock movement to return to")
+        returned = movements.filter(kind='return').aggregate(total=Sum('quantity'))['total'] or ZERO
+        remaining = dispense.quantity_dispensed - returned
+        quantity = remaining if quantity is None else Decimal(str(quantity))
+        if quantity <= 0:
+            raise ValueError(
+                f"Dispense {dispense.pk} has nothing left to return" if remaining <= 0
+                else "Return quantity must be positive"
+            )
+        if quantity > remaining:
+            raise ValueError(f"Only {remaining} of dispense {dispense.pk} can still be returned")
+        return post(taken, 'return', quantity, created_by=created_by, notes=notes, dispense=dispense)
+
+
+def receive_items(items, received_by=None, notes=''):
+    """
+    Book the received quantity of each ProcurementItem not yet booked into
+    its batch, creating missing PharmacyStock rows (matched on
+    medication_name + batch_number). A fixed number of queries however many
+    items there are. Returns the receipt movements.
+    """
+    items = [item for item in items if item.received_quantity]
+    if not items:
+        return []
+    with transaction.atomic():
+        booked = dict(
+            StockMovement.objects.filter(procurement_item__in=items, kind='receipt')
+            .values('procurement_item').annotate(total=Sum('quantity')).values_list('procurement_item', 'total')
+        )
+        due = [(item, item.received_quantity - booked.get(item.pk, ZERO)) for item in items]
+        due = [(item, quantity) for item, quantity in due if quantity]
+        if not due:
+            return []
+        keys = {(item.medication_name, item.batch_number) for item, _ in due}
+
+        def existing():
+            return {
+                (stock.medication_name, stock.batch_number): stock
+                for stock in PharmacyStock.objects.filter(
+                    medication_name__in={name for name, _ in keys}, batch_number__in={batch for _, batch in keys},
+                ).only('pk', 'medication_name', 'batch_number', 'last_updated')
+                if (stock.medication_name, stock.batch_number) in keys
+            }
+
+        stocks = existing()
+        missing = {}
+        for item, _ in due:
+            key = (item.medication_name, item.batch_number)
+            if key not in stocks and key not in missing:
+                missing[key] = PharmacyStock(
+                    medication_name=item.medication_name, batch_number=item.batch_number,
+                    expiry_date=item.expiry_date, unit_price=item.unit_price, quantity=ZERO,
+                )
+                missing[key].refresh_flags()
+        if missing:
+            # A concurrent receipt may create the same batch; keep whichever row won
+            PharmacyStock.objects.bulk_create(missing.values(), ignore_conflicts=True)
+            stocks = existing()
+            # Rows dropped by ignore_conflicts are counted by whoever inserted the winner. Ours
+            # carry the last_updated (auto_now) stamped on our objects, to the millisecond
+            # some backends keep.
+            counters.record_bulk(PharmacyStock, [
+                (None, stock) for key, stock in missing.items()
+                if key in stocks and abs(stocks[key].last_updated - stock.last_updated) < STAMP_PRECISION
+            ])
+
+        now = timezone.now()
+        # apply_movements() filters on the movements' pks
+        movements = bulk.create(StockMovement, [
+            StockMovement(
+                stock=stocks[(item.medication_name, item.batch_number)], kind='receipt', quantity=quantity,
+                procurement_item=item, created_by=received_by, created_at=now, notes=notes,
+            )
+            for item, quantity in due
+        ], key=['procurement_item_id'])
+        apply_movements(movements)
+    return movements
+
+
+# Balances ----------------------------------------------------------------------
+
+def balance_at(moment, stocks=None):
+    """
+    {stock id: balance} at `moment`: the latest snapshot at or before it plus
+    the movements after that snapshot, for all batches in one query.
+    """
+    stocks = PharmacyStock.objects.all() if stocks is None else stocks
+    latest = StockSnapshot.objects.filter(stock=OuterRef('pk'), as_of__lte=moment).order_by('-as_of')
+    since_snapshot = (
+        StockMovement.objects.filter(stock=OuterRef('pk'), created_at__lte=moment)
+        .filter(created_at__gt=Coalesce(OuterRef('snapshot_at'), Value(BEFORE_LEDGER), output_field=DateTimeField()))
+        .order_by().values('stock').annotate(total=Sum('quantity')).values('total')
+    )
+    rows = (
+        stocks.annotate(
+            snapshot_at=Subquery(latest.values('as_of')[:1]),
+            snapshot_quantity=Subquery(latest.values('quantity')[:1]),
+        )
+        .annotate(moved=Subquery(since_snapshot, output_field=DecimalField()))
+        .values_list('pk', 'snapshot_quantity', 'moved')
+    )
+    return {pk: (snapshot or ZERO) + (moved or ZERO) for pk, snapshot, moved in rows}
+
+
+def take_snapshots(as_of=None):
+    """
+    Snapshot every batch's balance at `as_of`; returns the number written.
+    The default lags a few minutes behind now so movements stamped before
+    as_of by transactions still in flight are committed before it is fixed.
+    """
+    as_of = as_of or timezone.now() - SNAPSHOT_LAG
+    balances = balance_at(as_of)
+    StockSnapshot.objects.bulk_create(
+        [StockSnapshot(stock_id=pk, as_of=as_of, quantity=quantity) for pk, quantity in balances.items()],
+        ignore_conflicts=True,
+    )
+    return len(balances)
+
+
+def verify():
+    """Batches whose stored quantity differs from the ledger: [(stock id, stored, ledger)]."""
+    ledger = balance_at(timezone.now())
+    return [
+        (pk, quantity, ledger.get(pk, ZERO))
+        for pk, quantity in PharmacyStock.objects.values_list('pk', 'quantity')
+        if quantity != ledger.get(pk, ZERO)
+    ]
@@ -0,0 +1,21 @@
+# his/test_runner.py
+"""
+Test runner for the project (TEST_RUNNER in settings).
+
+Tests write audit entries immediately, with no background writer thread or
+spill files, whatever HIS_AUDIT_ASYNC the environment sets; tests of the
+writer itself turn it back on with override_settings.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class HISTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_settings = override_settings(HIS_AUDIT_ASYNC=False)
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        super().teardown_test_environment(**kwargs)
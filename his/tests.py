@@ -1,3 +1,1604 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import partial
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import (
+    audit, beds, counters, dashboard_cache, duplicates, early_warning, lab_tat, lab_trends, lab_worklist,
+    notifications, receiving, reference_ranges, scheduling, search_index, sequences, stock_alerts, stock_ledger,
+    vitals_ingest, vitals_series,
+)
+from .models import (
+    Appointment, AuditLog, Bed, DashboardCounter, Department, EmergencyContact, Invoice, LabOrder, LabOrderItem,
+    LabResult, LabTatRollup, LabTest, MedicationDispense, Notification, Patient, Payment, PharmacyStock,
+    Prescription, PrescriptionItem, Procurement, ProcurementItem, Role, SequenceCounter, StockMovement,
+    StockSnapshot, User, Visit, Vitals, VitalsRollup, Ward,
+)
+from .pagination import encode_cursor, keyset_page
+from .routing import websocket_urlpatterns
+from .views import PatientsListView
+
+
+class PatientListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reception', password='x', role=Role.RECEPTIONIST)
+        for i in range(40):
+            patient = Patient.objects.create(mrn=f"MRNTEST{i:04d}", first_name=f"Patient{i}")
+            EmergencyContact.objects.create(patient=patient, name='Kin', relationship='Spouse', phone='9000000000')
+            Visit.objects.create(patient=patient, visit_id=f"VTEST{i:04d}a", status='active')
+            Visit.objects.create(patient=patient, visit_id=f"VTEST{i:04d}b", status='discharged')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_patients(self, page_size):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('patient-list'), {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return response, len(ctx.captured_queries)
+
+    def test_page_query_count_is_independent_of_page_size(self):
+        _, small = self.list_patients(5)
+        _, large = self.list_patients(40)
+        self.assertEqual(small, large)
+
+    def test_annotated_counts_match_related_rows(self):
+        response, _ = self.list_patients(10)
+        for row in response.data['results']:
+            self.assertEqual(row['active_visits_count'], 1)
+            self.assertEqual(len(row['emergency_contacts']), 1)
+
+
+class VisitListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='visits', password='x', role=Role.RECEPTIONIST)
+        doctor = User.objects.create_user(username='visits-doctor', password='x', role=Role.DOCTOR,
+                                          first_name='Vera', last_name='Rao')
+        department = Department.objects.create(name='Medicine')
+        ward = Ward.objects.create(name='Ward A', ward_type='general', total_beds=40)
+        for i in range(40):
+            patient = Patient.objects.create(mrn=f"MRNVIS{i:04d}", first_name=f"Visitor{i}")
+            EmergencyContact.objects.create(patient=patient, name='Kin', relationship='Spouse', phone='9000000000')
+            Visit.objects.create(
+                patient=patient, visit_id=f"VVIS{i:04d}", status='active', attending_doctor=doctor,
+                department=department, bed=Bed.objects.create(ward=ward, bed_number=str(i)),
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_visits(self, page_size, queries, **params):
+        # Keyset pages run no count query
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse('visit-list'), {'page_size': page_size, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return response.data['results']
+
+    def test_flat_list_is_one_query(self):
+        for page_size in (5, 40):
+            rows = self.list_visits(page_size, 1)
+        self.assertEqual(rows[0]['doctor_name'], 'Vera Rao')
+        self.assertEqual(rows[0]['department_name'], 'Medicine')
+        self.assertTrue(rows[0]['bed_info'].startswith('Ward A - '))
+        self.assertNotIn('patient_details', rows[0])
+
+    def test_flat_list_loads_only_the_serialized_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.list_visits(5, 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('discharge_summary', sql)
+        self.assertNotIn('"his_patient"."address"', sql)
+
+    def test_expanded_patient_query_count_is_independent_of_page_size(self):
+        for page_size in (5, 40):
+            rows = self.list_visits(page_size, 3, expand='patient')
+        self.assertEqual(rows[0]['patient_details']['active_visits_count'], 1)
+        self.assertEqual(len(rows[0]['patient_details']['emergency_contacts']), 1)
+
+
+class SequenceAllocatorTests(TestCase):
+    def setUp(self):
+        self.allocator = sequences.SequenceAllocator()
+
+    def draw(self, allocator, count, block_size=5):
+        """`count` numbers, each drawn in a transaction of its own that commits."""
+        numbers = []
+        for _ in range(count):
+            with self.captureOnCommitCallbacks(execute=True):
+                numbers.append(allocator.next_value('T', block_size))
+        return numbers
+
+    def test_numbers_come_from_memory_until_the_block_runs_dry(self):
+        self.assertEqual(self.draw(self.allocator, 1), [1])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.draw(self.allocator, 4), [2, 3, 4, 5])
+        self.assertEqual(self.draw(self.allocator, 1), [6])
+        self.assertEqual(SequenceCounter.objects.get(key='T').last_value, 10)
+
+    def test_workers_get_disjoint_blocks(self):
+        other = sequences.SequenceAllocator()
+        mine, theirs = [], []
+        for _ in range(4):
+            mine += self.draw(self.allocator, 3)
+            theirs += self.draw(other, 3)
+        self.assertEqual(mine, [1, 2, 3, 4, 5, 11, 12, 13, 14, 15, 21, 22])
+        self.assertEqual(theirs, [6, 7, 8, 9, 10, 16, 17, 18, 19, 20, 26, 27])
+
+    def test_a_rolled_back_reservation_is_not_kept(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.assertEqual(self.allocator.next_value('T', 5), 1)
+                transaction.set_rollback(True)
+        self.assertFalse(SequenceCounter.objects.filter(key='T').exists())
+        # Had the rest of the block been kept, 2 would now be handed out a second time
+        self.assertEqual(self.draw(sequences.SequenceAllocator(), 1), [1])
+        self.assertEqual(self.draw(self.allocator, 1), [6])
+
+    @override_settings(HIS_SEQUENCE_BLOCK_SIZES={'invoice': 1})
+    def test_formatted_numbers_and_block_size_setting(self):
+        when = timezone.make_aware(datetime(2025, 9, 16, 10, 0))
+        with mock.patch.object(sequences, 'allocator', self.allocator):
+            self.assertEqual(sequences.next_number('mrn', when), 'MRN20250001')
+            self.assertEqual(sequences.next_number('payment', when), 'PAY25091600001')
+            self.assertEqual(
+                [sequences.next_number('invoice', when) for _ in range(2)], ['INV2509160001', 'INV2509160002'],
+            )
+        self.assertEqual(SequenceCounter.objects.get(key='INV250916').last_value, 2)
+        self.assertEqual(SequenceCounter.objects.get(key='MRN2025').last_value, sequences.DEFAULT_BLOCK_SIZE)
+
+
+# Migrates the schema back and forth, so it cannot run inside a test transaction
+class SequenceCounterMigrationTests(TransactionTestCase):
+    before = [('his', '0001_initial')]
+    after = [('his', '0002_sequence_counter')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.executor.loader.build_graph()
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_counters_start_after_the_highest_existing_numbers(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        model = partial(apps.get_model, 'his')
+        model('MRNCounter').objects.create(year=2025, last_seq=7)
+        patients = [
+            model('Patient').objects.create(mrn=mrn, first_name='Old')
+            for mrn in ('MRN20250003', 'MRN20240012', 'MRN20240009', '2509160001')
+        ]
+        for number in ('V2509160004', 'V2509160011', 'V2509170002'):
+            model('Visit').objects.create(patient=patients[0], visit_id=number)
+        invoice = model('Invoice').objects.create(patient=patients[0], invoice_number='INV2509160008')
+        for number in ('PAY25091600003', 'PAY250916101530', None):
+            model('Payment').objects.create(invoice=invoice, amount=1, payment_number=number)
+
+        self.executor.migrate(self.after)
+        self.assertEqual(dict(SequenceCounter.objects.values_list('key', 'last_value')), {
+            'MRN2025': 7, 'MRN2024': 12, 'V250916': 11, 'V250917': 2, 'INV250916': 8, 'PAY250916': 3,
+        })
+
+
+class PatientSearchListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='records', password='x', role=Role.RECEPTIONIST)
+        start = timezone.now() - timedelta(days=1)
+        patients = Patient.objects.bulk_create([
+            Patient(mrn=f"MRNSRCH{i:04d}", first_name='Lakshmi', last_name=f"Iyer{i}",
+                    created_at=start + timedelta(seconds=i))
+            for i in range(520)
+        ])
+        search_index.index_patients(patients)
+        cls.newest = patients[-1]
+
+    def test_search_without_limit_returns_every_match(self):
+        self.assertEqual(len(search_index.search('lakshmi', limit=10)), 10)
+        self.assertEqual(len(search_index.search('lakshmi', limit=None)), 520)
+        self.assertEqual(len(search_index.search('akshm', limit=None)), 520)
+
+    def test_matching_finds_the_same_patients_as_search(self):
+        extra = [
+            Patient.objects.create(mrn='MRNSRCHX1', first_name='Nandana', last_name='Rao', contact_number='98765 43210'),
+            Patient.objects.create(mrn='MRNSRCHX2', first_name='Anand', last_name='Rao', contact_number='+91-99001-12345'),
+        ]
+        for query in ('lakshmi', 'akshm', 'iyer51', 'anand', 'nanda', '6543', '99001', '2345', 'srchx'):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    set(Patient.objects.filter(pk__in=search_index.matching(query)).values_list('pk', flat=True)),
+                    set(search_index.search(query, limit=None)),
+                )
+        # "Nandana" holds every trigram of "anand" but not the substring
+        self.assertEqual(list(search_index.matching('anand').values_list('pk', flat=True)), [extra[1].pk])
+        self.assertFalse(search_index.matching('ak').exists())
+
+    def test_list_orders_and_paginates_the_full_match_set(self):
+        # patient/list.html is not part of this tree, so drive the view's queryset and paginator directly
+        request = RequestFactory().get(reverse('patients-list'), {'search': 'lakshmi'})
+        request.user = self.user
+        view = PatientsListView()
+        view.setup(request)
+        # One count and one page query, with the match set as a subquery rather than a list of ids
+        with self.assertNumQueries(2):
+            paginator, page, patients, _ = view.paginate_queryset(view.get_queryset(), view.paginate_by)
+            patients = list(patients)
+        self.assertEqual(paginator.count, 520)
+        self.assertEqual(patients[0].pk, self.newest.pk)
+
+
+class BulkNotifyTests(TestCase):
+    def test_pushes_carry_ids_when_the_backend_returns_none(self):
+        users = [User.objects.create_user(username=f'bulk-{i}', password='x', role=Role.NURSE) for i in range(2)]
+        Notification.objects.create(recipient=users[0], title='Ward round', message='Earlier one')
+        no_ids = mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False,
+        )
+        with no_ids, mock.patch.object(notifications, '_send') as send, self.captureOnCommitCallbacks(execute=True):
+            rows = notifications.create_notifications(users, 'Ward round', 'Starts at 10')
+        # The older row with the same title is not mistaken for the new one
+        self.assertEqual(
+            {row.pk for row in rows}, set(Notification.objects.filter(message='Starts at 10').values_list('pk', flat=True)),
+        )
+        pushed = {event['notification']['id']: event['unread_count'] for (_, event), _ in send.call_args_list}
+        self.assertEqual(pushed, {rows[0].pk: 2, rows[1].pk: 1})
+
+
+# Transactions commit here, so pushes sent on commit reach the socket
+class NotificationSocketTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ward-doctor', password='x', role=Role.DOCTOR)
+        Notification.objects.create(recipient=self.user, title='Earlier', message='Already waiting')
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/notifications/')
+        communicator.scope['user'] = user
+        return communicator
+
+    def notify(self):
+        return Notification.objects.create(recipient=self.user, title='Critical result', message='Glucose 30')
+
+    async def test_anonymous_connections_are_refused(self):
+        connected, _ = await self.communicator(AnonymousUser()).connect()
+        self.assertFalse(connected)
+
+    async def test_snapshot_then_pushes_for_new_and_read_notifications(self):
+        communicator = self.communicator(self.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['unread_count']), ('snapshot', 1))
+        self.assertEqual([row['title'] for row in snapshot['notifications']], ['Earlier'])
+
+        notification = await database_sync_to_async(self.notify)()
+        pushed = await communicator.receive_json_from()
+        self.assertEqual(pushed['type'], 'notification')
+        self.assertEqual((pushed['notification']['id'], pushed['unread_count']), (notification.id, 2))
+
+        await communicator.send_json_to({'action': 'mark_read', 'id': notification.id})
+        count = await communicator.receive_json_from()
+        self.assertEqual(count, {'type': 'count', 'unread_count': 1})
+        await communicator.disconnect()
+
+
+class DischargeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='nurse', password='x', role=Role.NURSE)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ward = Ward.objects.create(name='General', ward_type='general', total_beds=2)
+        self.bed = Bed.objects.create(ward=self.ward, bed_number='1')
+        patient = Patient.objects.create(mrn='MRNDIS0001', first_name='Ann')
+        self.visit = Visit.objects.create(patient=patient, visit_id='VDIS0001', status='active')
+        beds.assign(self.visit, self.bed)
+
+    def discharge(self):
+        return self.client.post(reverse('visit-discharge', args=[self.visit.pk]), {}, format='json')
+
+    def test_discharge_frees_the_bed_and_clears_the_visit(self):
+        self.assertEqual(self.discharge().status_code, 200)
+        self.visit.refresh_from_db()
+        self.bed.refresh_from_db()
+        self.ward.refresh_from_db()
+        self.assertEqual(self.visit.status, 'discharged')
+        self.assertIsNone(self.visit.bed_id)
+        self.assertFalse(self.bed.is_occupied)
+        self.assertEqual(self.ward.occupied_beds, 0)
+
+    def test_an_occupied_bed_cannot_be_assigned_twice(self):
+        patient = Patient.objects.create(mrn='MRNDIS0002', first_name='Ben')
+        other = Visit.objects.create(patient=patient, visit_id='VDIS0002', status='active')
+        spare = Bed.objects.create(ward=self.ward, bed_number='2')
+        beds.assign(other, spare)
+        # Read while the bed was still free, as a second nurse's form would be
+        stale_bed = Bed(pk=self.bed.pk, ward=self.ward, is_occupied=False)
+        with self.assertRaises(beds.BedUnavailable):
+            beds.assign(other, stale_bed)
+        # The failed claim leaves the visit in the bed it had
+        spare.refresh_from_db()
+        self.bed.refresh_from_db()
+        self.ward.refresh_from_db()
+        self.assertEqual((spare.current_visit, self.bed.current_visit), (other, self.visit))
+        self.assertEqual(Visit.objects.get(pk=other.pk).bed, spare)
+        self.assertEqual(self.ward.occupied_beds, 2)
+        Bed.objects.filter(pk=spare.pk).update(is_occupied=False, current_visit=None, is_maintenance=True)
+        with self.assertRaises(beds.BedUnavailable):
+            beds.assign(Visit.objects.create(patient=patient, visit_id='VDIS0003', status='active'), spare)
+
+    def test_assign_moves_the_visit_from_the_bed_it_really_holds(self):
+        spare = Bed.objects.create(ward=self.ward, bed_number='2')
+        # Loaded before the first assignment, as a second nurse's form would be
+        stale = Visit.objects.get(pk=self.visit.pk)
+        stale.bed_id = None
+        beds.assign(stale, spare)
+        self.bed.refresh_from_db()
+        spare.refresh_from_db()
+        self.ward.refresh_from_db()
+        self.assertFalse(self.bed.is_occupied)
+        self.assertEqual(spare.current_visit_id, self.visit.pk)
+        self.assertEqual(Visit.objects.get(pk=self.visit.pk).bed_id, spare.pk)
+        self.assertEqual(self.ward.occupied_beds, 1)
+
+    def test_a_discharged_visit_cannot_take_a_bed(self):
+        stale = Visit.objects.get(pk=self.visit.pk)
+        self.assertEqual(self.discharge().status_code, 200)
+        with self.assertRaises(beds.VisitNotActive):
+            beds.assign(stale, self.bed)
+        self.bed.refresh_from_db()
+        self.ward.refresh_from_db()
+        self.assertFalse(self.bed.is_occupied)
+        self.assertEqual(self.ward.occupied_beds, 0)
+        self.assertIsNone(Visit.objects.get(pk=self.visit.pk).bed_id)
+
+    def test_repeated_discharge_is_rejected(self):
+        self.discharge()
+        self.assertEqual(self.discharge().status_code, 400)
+        self.ward.refresh_from_db()
+        self.assertEqual(self.ward.occupied_beds, 0)
+
+    def test_wards_are_read_only_for_staff(self):
+        self.assertEqual(self.client.get(reverse('ward-list')).status_code, 200)
+        response = self.client.patch(reverse('ward-detail', args=[self.ward.pk]), {'total_beds': 0}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.delete(reverse('ward-detail', args=[self.ward.pk])).status_code, 403)
+
+    def test_stale_discharge_leaves_a_reassigned_bed_alone(self):
+        stale = Visit.objects.get(pk=self.visit.pk)
+        self.assertEqual(self.discharge().status_code, 200)
+        other = Visit.objects.create(patient=self.visit.patient, visit_id='VDIS0002', status='active')
+        beds.assign(other, self.bed)
+
+        self.assertEqual(self.discharge().status_code, 400)
+        beds.release(stale)  # a stale copy still pointing at the bed
+
+        self.bed.refresh_from_db()
+        self.ward.refresh_from_db()
+        self.assertTrue(self.bed.is_occupied)
+        self.assertEqual(self.bed.current_visit_id, other.pk)
+        self.assertEqual(self.ward.occupied_beds, 1)
+
+    def test_beds_are_read_only(self):
+        self.assertEqual(self.client.get(reverse('bed-list')).status_code, 200)
+        self.assertEqual(self.client.delete(reverse('bed-detail', args=[self.bed.pk])).status_code, 405)
+        response = self.client.patch(reverse('bed-detail', args=[self.bed.pk]), {'is_occupied': False}, format='json')
+        self.assertEqual(response.status_code, 405)
+
+
+class AuditTestSettingsTests(TestCase):
+    def test_the_test_runner_writes_entries_immediately(self):
+        # Whatever HIS_AUDIT_ASYNC the environment sets
+        audit.record('settings.check', object_id='1')
+        self.assertTrue(AuditLog.objects.filter(action='settings.check').exists())
+
+
+class AuditWriterTests(TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spill_dir, ignore_errors=True)
+        overrides = override_settings(HIS_AUDIT_ASYNC=True, HIS_AUDIT_SPILL_DIR=self.spill_dir, HIS_AUDIT_MAX_ATTEMPTS=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # A writer of our own, flushed by hand instead of by the background thread
+        self.writer = audit.AuditWriter()
+        for target, replacement in [(audit, {'writer': self.writer}), (self.writer, {'_ensure_started': lambda: None})]:
+            patcher = mock.patch.multiple(target, **replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_details_are_normalised_before_buffering(self):
+        audit.record('EXPORT', details={'day': date(2025, 1, 2), 'total': Decimal('1.50')})
+        self.assertEqual(self.writer._buffer[0]['details'], {'day': '2025-01-02', 'total': '1.50'})
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(AuditLog.objects.get().details, {'day': '2025-01-02', 'total': '1.50'})
+
+    def test_failing_entry_is_dead_lettered_without_blocking_the_rest(self):
+        insert = audit._insert
+
+        def refuse_poison(entries):
+            if any(entry['action'] == 'POISON' for entry in entries):
+                raise IntegrityError('poison')
+            insert(entries)
+
+        with mock.patch.object(audit, '_insert', refuse_poison):
+            for action in ['FIRST', 'POISON', 'LAST']:
+                audit.record(action)
+            self.assertEqual(self.writer.flush(), 2)
+            self.assertEqual(len(self.writer._buffer), 1)
+            audit.record('NEXT')
+            with self.assertLogs('his.audit', 'ERROR'):
+                self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(self.writer._buffer, [])
+        self.assertEqual(sorted(AuditLog.objects.values_list('action', flat=True)), ['FIRST', 'LAST', 'NEXT'])
+        self.assertEqual(list(Path(self.spill_dir).glob('audit-*.jsonl')), [])
+
+        self.assertEqual(audit.replay_dead_letters(), (1, 0))
+        self.assertTrue(AuditLog.objects.filter(action='POISON').exists())
+
+
+class LabFixtureMixin:
+    def setUp(self):
+        self.lab_user = User.objects.create_user(username='labtech', password='x', role=Role.LAB)
+        self.doctor = User.objects.create_user(username='orderer', password='x', role=Role.DOCTOR)
+        self.patient = Patient.objects.create(mrn='MRNLAB0001', first_name='Ann', last_name='Lee', gender='F')
+        self.lab_visit = Visit.objects.create(patient=self.patient, visit_id='VLAB0001', status='active')
+        self.glucose = LabTest.objects.create(
+            name='Glucose', code='GLU', normal_range='70-110; Critical: <40 or >400', unit='mg/dL', price=1,
+        )
+        self.order = LabOrder.objects.create(visit=self.lab_visit, ordered_by=self.doctor)
+        self.item = LabOrderItem.objects.create(lab_order=self.order, lab_test=self.glucose)
+        self.client = APIClient()
+        self.client.force_authenticate(self.lab_user)
+
+
+class LabImportTests(LabFixtureMixin, TestCase):
+    def post_csv(self, value, **params):
+        body = f"order_id,test_code,result_value\n{self.order.pk},GLU,{value}\n"
+        url = reverse('labresult-import-results')
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, body, content_type='text/plain')
+
+    def test_file_format_override(self):
+        response = self.post_csv('90', file_format='csv')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['created'], 1)
+
+    def test_retransmitted_file_is_skipped(self):
+        counters.read({'reported': ('lab_results.reported', timezone.localdate())})
+        self.assertEqual(self.post_csv('90').status_code, 201)
+        response = self.post_csv('90')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['created'], response.data['skipped']), (0, 1))
+        self.assertEqual(LabResult.objects.count(), 1)
+        reported = counters.read({'reported': ('lab_results.reported', timezone.localdate())})['reported']
+        self.assertEqual(reported, 1)
+
+    def test_different_value_for_a_reported_item_is_rejected(self):
+        self.post_csv('90')
+        response = self.post_csv('95')
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertEqual(list(LabResult.objects.values_list('result_value', flat=True)), ['90'])
+
+    def test_unknown_test_is_reported_by_index(self):
+        body = f"order_id,test_code,result_value\n{self.order.pk},GLU,90\n{self.order.pk},XXX,1\n"
+        response = self.client.post(reverse('labresult-import-results'), body, content_type='text/csv')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+
+    def test_critical_alert_links_the_result_when_the_backend_returns_no_ids(self):
+        no_ids = mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False,
+        )
+        with no_ids:
+            response = self.post_csv('30')
+        self.assertEqual(response.status_code, 201, response.data)
+        result = LabResult.objects.get()
+        alert = Notification.objects.get(recipient=self.doctor)
+        self.assertEqual(alert.action_url, reverse('labresult-detail', args=[result.pk]))
+
+    def test_astm_records(self):
+        body = f"H|\\^&|||Analyzer\nO|1|{self.order.pk}||^^^GLU\nR|1|^^^GLU|150|mg/dL||H||F||||20250916100100\nL|1|N\n"
+        response = self.client.post(reverse('labresult-import-results'), body, content_type='text/plain')
+        self.assertEqual(response.status_code, 201, response.data)
+        result = LabResult.objects.get()
+        self.assertTrue(result.is_abnormal)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'completed')
+
+
+class LabTatTests(LabFixtureMixin, TestCase):
+    def test_lab_test_filter_must_be_an_id(self):
+        url = reverse('laborder-tat')
+        self.assertEqual(self.client.get(url, {'lab_test': 'GLU'}).status_code, 400)
+        response = self.client.get(url, {'lab_test': self.glucose.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rows'], [])
+
+    def at(self, hour, minute=0, day=16):
+        return timezone.make_aware(datetime(2025, 9, day, hour, minute))
+
+    def result(self, ordered, collected, reported, verified=None, priority='routine'):
+        order = LabOrder.objects.create(visit=self.lab_visit, ordered_by=self.doctor, priority=priority)
+        LabOrder.objects.filter(pk=order.pk).update(created_at=ordered, sample_collected_at=collected)
+        item = LabOrderItem.objects.create(lab_order=order, lab_test=self.glucose)
+        return LabResult.objects.create(lab_order_item=item, result_value='90', reported_at=reported,
+                                        verified_at=verified)
+
+    def test_percentile_interpolates_between_closest_ranks(self):
+        cases = [
+            ([5], {0: 5, 50: 5, 99: 5}),
+            ([1, 2, 3], {0: 1, 50: 2, 90: 2.8, 100: 3}),
+            ([1, 2, 3, 4], {50: 2.5, 90: 3.7, 99: 3.97}),
+        ]
+        for values, expected in cases:
+            for p, value in expected.items():
+                with self.subTest(values=values, p=p):
+                    self.assertAlmostEqual(lab_tat.percentile(values, p), value)
+
+    def test_summarise_skips_missing_and_out_of_order_stages(self):
+        day = date(2025, 9, 16)
+        columns = {
+            'lab_test': [1, 1, 1],
+            'priority': ['routine'] * 3,
+            'ordered_at': [self.at(8), self.at(9), None],
+            'collected_at': [self.at(8, 30), self.at(8, 50), self.at(9)],
+            'reported_at': [self.at(10), self.at(10), self.at(10)],
+            'verified_at': [self.at(10, 30), None, self.at(9, 45)],
+        }
+        results, stats = lab_tat.summarise(columns)[(day, 1, 'routine')]
+        self.assertEqual(results, 3)
+        self.assertEqual(stats['order_to_collection'], {'count': 1, 'max': 30.0, 'p50': 30.0, 'p90': 30.0, 'p99': 30.0})
+        self.assertEqual(stats['collection_to_report']['count'], 3)
+        self.assertEqual(stats['collection_to_report']['p50'], 70.0)
+        self.assertEqual(stats['report_to_verify']['count'], 1)
+
+    def test_rollup_rebuilds_a_day_idempotently(self):
+        day = date(2025, 9, 16)
+        self.result(self.at(8), self.at(8, 20), self.at(9), self.at(9, 10))
+        self.result(self.at(8), self.at(8, 40), self.at(10), priority='stat')
+        self.result(self.at(8, day=17), self.at(8, 10, day=17), self.at(9, day=17))
+
+        def rows():
+            return sorted(LabTatRollup.objects.filter(day=day).values_list('priority', 'results', 'stats'))
+
+        self.assertEqual(lab_tat.rollup(day, day), 2)
+        first = rows()
+        self.assertEqual(lab_tat.rollup(day, day), 2)
+        self.assertEqual(rows(), first)
+        self.assertEqual([row[:2] for row in first], [('routine', 1), ('stat', 1)])
+        self.assertEqual(first[0][2]['order_to_collection']['p50'], 20.0)
+
+        # A late result replaces the day's rows; the next day is left alone
+        self.result(self.at(8), self.at(9), self.at(11))
+        self.assertEqual(lab_tat.rollup(day, day), 2)
+        self.assertEqual([row[:2] for row in rows()], [('routine', 2), ('stat', 1)])
+        self.assertFalse(LabTatRollup.objects.filter(day=date(2025, 9, 17)).exists())
+
+
+class LabTrendsTests(LabFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.urea = LabTest.objects.create(name='Urea', code='URE', unit='mg/dL', price=1)
+        # Written out of time order; series() reads them back in report order
+        for hour, value, abnormal in [(12, '<40', True), (8, '90', False), (10, 'hemolysed', False)]:
+            self.result(self.glucose, hour, value, abnormal)
+        self.result(self.urea, 9, '140 mg/dL', True)
+        other = Patient.objects.create(mrn='MRNLAB0002', first_name='Bob')
+        other_order = LabOrder.objects.create(
+            visit=Visit.objects.create(patient=other, visit_id='VLAB0002', status='active'), ordered_by=self.doctor,
+        )
+        other_item = LabOrderItem.objects.create(lab_order=other_order, lab_test=self.glucose)
+        LabResult.objects.create(lab_order_item=other_item, result_value='500', reported_at=self.at(9))
+
+    def at(self, hour):
+        return timezone.make_aware(datetime(2025, 9, 16, hour, 0))
+
+    def result(self, lab_test, hour, value, abnormal):
+        item = LabOrderItem.objects.create(lab_order=self.order, lab_test=lab_test)
+        return LabResult.objects.create(lab_order_item=item, result_value=value, is_abnormal=abnormal,
+                                        reported_at=self.at(hour))
+
+    def series(self, **kwargs):
+        return {test['code']: test for test in lab_trends.series(self.patient.pk, **kwargs)['series']}
+
+    def test_columns_stay_aligned_in_report_order(self):
+        glucose = self.series()['GLU']
+        self.assertEqual(glucose['timestamps'], [int(self.at(hour).timestamp()) for hour in (8, 10, 12)])
+        self.assertEqual(glucose['values'], [90.0, None, 40.0])
+        self.assertEqual(glucose['abnormal'], '001')
+        self.assertEqual(glucose['count'], 3)
+        self.assertEqual((self.series()['URE']['values'], self.series()['URE']['abnormal']), ([140.0], '1'))
+
+    def test_codes_filter_the_tests(self):
+        self.assertEqual(set(self.series()), {'GLU', 'URE'})
+        self.assertEqual(set(self.series(codes=['URE'])), {'URE'})
+        self.assertEqual(self.series(codes=['HBA1C']), {})
+
+    def test_range_is_half_open(self):
+        glucose = self.series(codes=['GLU'], start=self.at(10), end=self.at(12))['GLU']
+        self.assertEqual((glucose['values'], glucose['abnormal']), ([None], '0'))
+        self.assertEqual(self.series(start=self.at(12))['GLU']['values'], [40.0])
+        self.assertNotIn('GLU', self.series(end=self.at(8)))
+
+
+class LabWorklistTests(LabFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_tech = User.objects.create_user(username='labtech2', password='x', role=Role.LAB)
+        urea = LabTest.objects.create(name='Urea', code='URE', unit='mg/dL', price=1)
+        self.urea_item = LabOrderItem.objects.create(lab_order=self.order, lab_test=urea)
+        stat_order = LabOrder.objects.create(visit=self.lab_visit, ordered_by=self.doctor, priority='stat')
+        self.stat_item = LabOrderItem.objects.create(lab_order=stat_order, lab_test=self.glucose)
+        for order in (self.order, stat_order):
+            LabOrder.objects.filter(pk=order.pk).update(status='sample_collected')
+            lab_worklist.enqueue(order)
+
+    def claim(self, client=None):
+        return (client or self.client).post(reverse('laborder-claim'), {'queue': 'general'}, format='json')
+
+    def act(self, item, action, client=None):
+        return (client or self.client).post(reverse(f'laborder-{action}-item', args=[item.pk]))
+
+    def test_stat_first_and_each_item_claimed_once(self):
+        other = APIClient()
+        other.force_authenticate(self.other_tech)
+        claimed = [self.claim().data['id'], self.claim(other).data['id'], self.claim().data['id']]
+        self.assertEqual(claimed[0], self.stat_item.pk)
+        self.assertEqual(sorted(claimed), sorted([self.item.pk, self.urea_item.pk, self.stat_item.pk]))
+        self.assertEqual(self.claim().status_code, 204)
+        self.assertEqual(LabOrderItem.objects.filter(claimed_by=self.other_tech).count(), 1)
+
+    def test_claim_moves_on_when_its_candidate_was_taken(self):
+        # Another tech's UPDATE lands between this claim's read and its UPDATE
+        LabOrderItem.objects.filter(pk=self.stat_item.pk).update(status=lab_worklist.CLAIMED, claimed_by=self.other_tech)
+        stale = LabOrderItem.objects.filter(pk=self.stat_item.pk).order_by('pk')
+        waiting = lab_worklist.waiting
+        with mock.patch.object(lab_worklist, 'waiting', side_effect=[stale, waiting('general')]):
+            item = lab_worklist.claim('general', self.lab_user)
+        self.assertEqual(item.pk, self.item.pk)
+        self.assertEqual(LabOrderItem.objects.get(pk=self.stat_item.pk).claimed_by, self.other_tech)
+
+    def test_only_the_claimant_completes_or_releases(self):
+        other = APIClient()
+        other.force_authenticate(self.other_tech)
+        item = LabOrderItem.objects.get(pk=self.claim().data['id'])
+        for action in ('complete', 'release'):
+            with self.subTest(action=action):
+                self.assertEqual(self.act(item, action, other).status_code, 409)
+        self.assertEqual(LabOrderItem.objects.get(pk=item.pk).status, lab_worklist.CLAIMED)
+        self.assertEqual(self.act(item, 'release').data['status'], lab_worklist.QUEUED)
+        self.assertEqual(self.act(item, 'complete').status_code, 409)
+
+    def test_completing_the_last_item_completes_the_order(self):
+        self.claim()  # the STAT item
+        for _ in range(2):
+            item = LabOrderItem.objects.get(pk=self.claim().data['id'])
+            self.assertEqual(self.act(item, 'complete').status_code, 200)
+        self.assertEqual(LabOrder.objects.get(pk=self.order.pk).status, 'completed')
+
+    def ranks(self):
+        return dict(LabOrderItem.objects.filter(status=lab_worklist.QUEUED).values_list('pk', 'priority_rank'))
+
+    def test_aged_items_are_raised_just_past_2_and_6_hours(self):
+        now = timezone.now() + timedelta(days=1)
+        LabOrderItem.objects.filter(pk=self.item.pk).update(queued_at=now - timedelta(hours=2))
+        LabOrderItem.objects.filter(pk=self.urea_item.pk).update(queued_at=now - timedelta(hours=6))
+        LabOrderItem.objects.filter(pk=self.stat_item.pk).update(queued_at=now - timedelta(hours=7))
+        routine, urgent, stat = (lab_worklist.RANK[name] for name in ('routine', 'urgent', 'stat'))
+
+        # Exactly at a boundary is not past it
+        self.assertEqual(lab_worklist.escalate_aged(now), 1)
+        self.assertEqual(self.ranks(), {self.item.pk: routine, self.urea_item.pk: urgent, self.stat_item.pk: stat})
+        self.assertEqual(lab_worklist.escalate_aged(now + timedelta(seconds=1)), 2)
+        self.assertEqual(self.ranks(), {self.item.pk: urgent, self.urea_item.pk: stat, self.stat_item.pk: stat})
+        self.assertEqual(lab_worklist.escalate_aged(now + timedelta(seconds=1)), 0)
+
+    def test_raising_an_order_to_stat_reranks_its_queued_items(self):
+        earlier = LabOrder.objects.create(visit=self.lab_visit, ordered_by=self.doctor)
+        earlier_item = LabOrderItem.objects.create(lab_order=earlier, lab_test=self.glucose)
+        LabOrder.objects.filter(pk=earlier.pk).update(status='sample_collected')
+        lab_worklist.enqueue(earlier, now=timezone.now() - timedelta(hours=1))
+        claimed = lab_worklist.claim('general', self.lab_user)  # the STAT item
+        self.assertEqual(claimed.pk, self.stat_item.pk)
+        self.assertEqual(list(lab_worklist.waiting('general').values_list('pk', flat=True))[0], earlier_item.pk)
+
+        self.order.priority = 'stat'
+        self.order.save()
+        self.assertEqual(
+            list(lab_worklist.waiting('general').values_list('pk', flat=True)),
+            [self.item.pk, self.urea_item.pk, earlier_item.pk],
+        )
+        # Lowering a priority leaves ranks already raised alone
+        self.order.priority = 'routine'
+        self.order.save()
+        self.assertEqual(self.ranks()[self.item.pk], lab_worklist.RANK['stat'])
+
+
+class VitalsIngestTests(TestCase):
+    def setUp(self):
+        nurse = User.objects.create_user(username='monitor', password='x', role=Role.NURSE)
+        patient = Patient.objects.create(mrn='MRNVIT0001', first_name='Ann')
+        self.visit = Visit.objects.create(patient=patient, visit_id='VVIT0001', status='active')
+        self.client = APIClient()
+        self.client.force_authenticate(nurse)
+
+    def post(self, body, content_type='application/json'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('vitals-bulk'), body, content_type=content_type)
+
+    def test_invalid_readings_are_reported_without_blocking_valid_ones(self):
+        future = (timezone.now() + timedelta(hours=1)).isoformat()
+        readings = [
+            {'visit_id': 'VVIT0001', 'pulse': 88, 'oxygen_saturation': 97.5},
+            {'visit_id': 'VVIT0001', 'pulse': 900},
+            {'visit_id': 'NOPE', 'pulse': 70},
+            {'visit_id': 'VVIT0001', 'pulse': 70, 'recorded_at': future},
+            {'visit_id': 'VVIT0001'},
+            'pulse 70',
+        ]
+        response = self.post(readings, content_type='application/json')
+        self.assertEqual(response.status_code, 207, response.data)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3, 4, 5])
+        self.assertIn('pulse', response.data['errors'][0]['errors'])
+        vitals = Vitals.objects.get()
+        self.assertEqual((vitals.visit_id, vitals.pulse, vitals.oxygen_saturation), (self.visit.pk, 88, Decimal('97.50')))
+
+    def test_ndjson_lines_that_are_not_json_become_errors(self):
+        body = '{"visit_id": "VVIT0001", "pulse": 80}\n{not json\n'
+        response = self.post(body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 207, response.data)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+
+    def test_undecodable_body_is_rejected(self):
+        for body, content_type in [(b'\xff\xfe[]', 'application/json'), (b'\xff\n', 'application/x-ndjson')]:
+            with self.subTest(content_type=content_type):
+                response = self.post(body, content_type=content_type)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {'error': 'Body is not UTF-8 text'})
+        self.assertFalse(Vitals.objects.exists())
+
+
+class VitalsSeriesTests(TestCase):
+    def setUp(self):
+        patient = Patient.objects.create(mrn='MRNSER0001', first_name='Ann')
+        self.visit = Visit.objects.create(patient=patient, visit_id='VSER0001', status='active')
+        self.start = vitals_series._hour(timezone.now()) - timedelta(hours=48)
+        # Two readings in each of the first six hours
+        for hour in range(6):
+            for minute, pulse in [(10, 60 + hour), (40, 80 + hour)]:
+                self.record(hour, minute, pulse)
+
+    def record(self, hour, minute, pulse):
+        return Vitals.objects.create(
+            visit=self.visit, pulse=pulse, recorded_at=self.start + timedelta(hours=hour, minutes=minute),
+        )
+
+    def series(self, hours=6, bucket_seconds=3600):
+        return vitals_series.series(
+            self.visit.pk, self.start, self.start + timedelta(hours=hours), bucket_seconds, ['pulse'],
+        )
+
+    def rollup(self, first_hour, last_hour):
+        with self.captureOnCommitCallbacks(execute=True):
+            vitals_series.rollup(self.start + timedelta(hours=first_hour), self.start + timedelta(hours=last_hour))
+
+    def test_parse_bucket(self):
+        self.assertEqual([vitals_series.parse_bucket(value) for value in ['30s', '5m', '1H', '2d']], [30, 300, 3600, 172800])
+        for value in ['', '0h', '5x', 'h']:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                vitals_series.parse_bucket(value)
+
+    def test_raw_buckets(self):
+        data = self.series(hours=2, bucket_seconds=1800)
+        self.assertEqual(data['count'], [1, 1, 1, 1])
+        data = self.series(hours=2)
+        self.assertEqual(data['count'], [2, 2])
+        self.assertEqual(data['pulse'], {'min': [60.0, 61.0], 'max': [80.0, 81.0], 'avg': [70.0, 71.0]})
+
+    def test_rollups_give_the_same_series(self):
+        raw = self.series(bucket_seconds=7200)
+        self.rollup(0, 6)
+        self.assertEqual(VitalsRollup.objects.count(), 6)
+        with self.assertNumQueries(2):  # the watermark and the rollup rows; the range has no ragged edges
+            self.assertEqual(self.series(bucket_seconds=7200), raw)
+
+    def test_hours_without_a_rollup_row_are_read_raw(self):
+        raw = self.series()
+        # As after rollup_vitals --since skipped the first hours
+        self.rollup(3, 6)
+        self.assertEqual(self.series(), raw)
+
+    def test_backdated_readings_reach_the_rollups(self):
+        self.rollup(0, 6)
+        with self.captureOnCommitCallbacks(execute=True):
+            late = self.record(1, 50, 150)
+        self.assertEqual(self.series()['pulse']['max'][1], 150.0)
+        self.assertEqual(VitalsRollup.objects.get(bucket_start=self.start + timedelta(hours=1)).readings, 3)
+
+        reading = {'visit_id': 'VSER0001', 'pulse': 20, 'recorded_at': (self.start + timedelta(hours=2, minutes=5)).isoformat()}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(vitals_ingest.ingest([reading])[0], 1)
+        self.assertEqual(self.series()['pulse']['min'][2], 20.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            late.delete()
+        self.assertEqual(self.series()['pulse']['max'][1], 81.0)
+        self.assertEqual(VitalsRollup.objects.get(bucket_start=self.start + timedelta(hours=1)).readings, 2)
+
+
+class PharmacyFixtureMixin:
+    def setUp(self):
+        self.pharmacist = User.objects.create_user(username='pharmacist', password='x', role=Role.PHARMACIST)
+        patient = Patient.objects.create(mrn='MRNRX0001', first_name='Ann')
+        visit = Visit.objects.create(patient=patient, visit_id='VRX0001', status='active')
+        self.prescription = Prescription.objects.create(visit=visit)
+        self.item = PrescriptionItem.objects.create(
+            prescription=self.prescription, medication_name='Amoxicillin', dosage='500mg', frequency='TDS',
+            duration_days=5, quantity=Decimal('8'),
+        )
+        today = timezone.localdate()
+        self.soon = self.batch('A1', today + timedelta(days=10), 5)
+        self.later = self.batch('B1', today + timedelta(days=200), 10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.pharmacist)
+
+    def batch(self, number, expiry_date, quantity):
+        stock = PharmacyStock.objects.create(
+            medication_name='Amoxicillin', batch_number=number, expiry_date=expiry_date, quantity=0,
+        )
+        stock_ledger.adjust(stock, quantity, notes='opening balance')
+        return stock
+
+    def balances(self):
+        return dict(PharmacyStock.objects.values_list('batch_number', 'quantity'))
+
+
+class DispensingTests(PharmacyFixtureMixin, TestCase):
+    def dispense(self, **data):
+        return self.client.post(reverse('prescription-dispense-all', args=[self.prescription.pk]), data, format='json')
+
+    def test_earliest_expiry_is_dispensed_first(self):
+        response = self.dispense()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.balances(), {'A1': 0, 'B1': 7})
+        self.assertEqual(
+            sorted(MedicationDispense.objects.values_list('batch_number', 'quantity_dispensed')),
+            [('A1', 5), ('B1', 3)],
+        )
+        self.assertEqual(self.dispense().data['dispensed_items'], [])  # nothing left outstanding
+
+    def test_short_stock_needs_partial(self):
+        self.item.quantity = Decimal('20')
+        self.item.save()
+        self.assertEqual(self.dispense(partial='false').status_code, 409)
+        self.assertEqual(self.balances(), {'A1': 5, 'B1': 10})
+        response = self.dispense(partial='true', patient_counseled='false')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['shortages'][0]['available'], 15)
+        self.assertFalse(MedicationDispense.objects.filter(patient_counseled=True).exists())
+        self.assertEqual(self.dispense(partial='maybe').status_code, 400)
+
+    def test_movements_link_their_dispenses_when_the_backend_returns_no_ids(self):
+        no_ids = mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False,
+        )
+        with no_ids:
+            self.assertEqual(self.dispense().status_code, 200)
+        for dispense in MedicationDispense.objects.all():
+            movement = StockMovement.objects.get(dispense=dispense)
+            self.assertEqual(movement.quantity, -dispense.quantity_dispensed)
+            self.assertEqual(movement.stock.batch_number, dispense.batch_number)
+        self.assertEqual(self.balances(), {'A1': 0, 'B1': 7})
+
+    def test_returns_never_exceed_the_quantity_dispensed(self):
+        self.dispense()
+        dispense = MedicationDispense.objects.get(batch_number='B1')
+        url = reverse('medicationdispense-return-to-stock', args=[dispense.pk])
+        for quantity in ['0', '-1', '4', 'x']:
+            with self.subTest(quantity=quantity):
+                self.assertEqual(self.client.post(url, {'quantity': quantity}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'quantity': '2'}).status_code, 201)
+        self.assertEqual(self.client.post(url, {'quantity': '2'}).status_code, 400)
+        self.assertEqual(self.client.post(url).status_code, 201)  # the remaining 1
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.balances(), {'A1': 0, 'B1': 10})
+
+    def test_a_batch_never_goes_negative(self):
+        with self.assertRaises(stock_ledger.NegativeBalance):
+            stock_ledger.adjust(self.soon, -6)
+        self.assertEqual(self.balances()['A1'], 5)
+
+
+class StockLedgerTests(PharmacyFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() - timedelta(hours=3)
+        StockMovement.objects.update(created_at=self.start)
+        self.moved_at(stock_ledger.adjust(self.soon, -2), self.start + timedelta(hours=1))
+        self.moved_at(stock_ledger.adjust(self.later, 4), self.start + timedelta(hours=2))
+        self.moved_at(stock_ledger.adjust(self.soon, -1), self.start + timedelta(hours=2, minutes=30))
+
+    def moved_at(self, movement, moment):
+        StockMovement.objects.filter(pk=movement.pk).update(created_at=moment)
+
+    def running_sums(self, moment):
+        totals = {self.soon.pk: Decimal('0'), self.later.pk: Decimal('0')}
+        for stock_id, quantity in StockMovement.objects.filter(created_at__lte=moment).values_list('stock', 'quantity'):
+            totals[stock_id] += quantity
+        return totals
+
+    def test_balance_matches_the_running_sum_across_a_snapshot(self):
+        moments = [self.start + timedelta(minutes=minutes) for minutes in (-1, 0, 59, 60, 61, 120, 150, 179)]
+        for moment in moments:
+            self.assertEqual(stock_ledger.balance_at(moment), self.running_sums(moment))
+
+        # The boundary falls exactly on a movement, which the snapshot then includes
+        boundary = self.start + timedelta(hours=1)
+        self.assertEqual(stock_ledger.take_snapshots(as_of=boundary), 2)
+        self.assertEqual(
+            dict(StockSnapshot.objects.values_list('stock', 'quantity')), {self.soon.pk: 3, self.later.pk: 10},
+        )
+        for moment in moments:
+            with self.subTest(moment=moment):
+                self.assertEqual(stock_ledger.balance_at(moment), self.running_sums(moment))
+
+    def test_verify_reports_a_drifted_batch(self):
+        stock_ledger.take_snapshots(as_of=self.start + timedelta(hours=1))
+        self.assertEqual(stock_ledger.verify(), [])
+        # A write that bypassed the ledger
+        PharmacyStock.objects.filter(pk=self.soon.pk).update(quantity=Decimal('9'))
+        self.assertEqual(stock_ledger.verify(), [(self.soon.pk, Decimal('9'), Decimal('2'))])
+
+
+class StockExpiryTests(PharmacyFixtureMixin, TestCase):
+    def test_lists_follow_the_calendar_before_buckets_are_aged(self):
+        today = timezone.localdate()
+        # As if the daily sweep had not run since these dates came round
+        PharmacyStock.objects.filter(pk=self.soon.pk).update(expiry_date=today - timedelta(days=1))
+        PharmacyStock.objects.filter(pk=self.later.pk).update(expiry_date=today + timedelta(days=29))
+        self.assertEqual(self.balances(), {'A1': 5, 'B1': 10})
+        self.assertEqual(
+            dict(PharmacyStock.objects.values_list('batch_number', 'expiry_bucket')), {'A1': '30d', 'B1': 'later'},
+        )
+
+        expired = self.client.get(reverse('pharmacystock-expired')).data['results']
+        self.assertEqual([(row['batch_number'], row['expiry_status'], row['expiry_bucket']) for row in expired],
+                         [('A1', 'expired', 'expired')])
+        within_30 = self.client.get(reverse('pharmacystock-expired'), {'bucket': '30d'}).data['results']
+        self.assertEqual([row['batch_number'] for row in within_30], ['B1'])
+        self.assertEqual(self.client.get(reverse('pharmacystock-expired'), {'bucket': '90d'}).data['results'], [])
+
+        self.client.force_login(self.pharmacist)
+        context = self.client.get(reverse('pharmacy-dashboard')).context
+        self.assertEqual((context['expired_items'], context['expiring_30_days'], context['expiring_90_days']), (1, 1, 0))
+
+
+class StockAlertSweepTests(PharmacyFixtureMixin, TestCase):
+    def sweep(self, today=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            _, sent = stock_alerts.sweep(today)
+        return sorted(notification.title for notification in sent)
+
+    def test_each_change_of_state_is_reported_once(self):
+        today = timezone.localdate()
+        # Both batches are at or under the minimum level; A1 expires within 30 days
+        self.assertEqual(
+            self.sweep(today), ['1 batch(es) expire within 30 days', '2 batch(es) below minimum stock level'],
+        )
+        self.assertEqual(self.sweep(today), [])
+        self.assertEqual(Notification.objects.filter(recipient=self.pharmacist).count(), 2)
+
+        # A1 expires: only the new condition is reported, and only once
+        self.assertEqual(self.sweep(today + timedelta(days=11)), ['1 batch(es) expired'])
+        self.assertEqual(self.sweep(today + timedelta(days=11)), [])
+
+        # Restocked and then low again: a new low-stock alert
+        stock_ledger.adjust(self.later, 20)
+        self.assertEqual(self.sweep(today + timedelta(days=11)), [])
+        stock_ledger.adjust(self.later, -25)
+        self.assertEqual(self.sweep(today + timedelta(days=11)), ['1 batch(es) below minimum stock level'])
+        self.assertEqual(self.sweep(today + timedelta(days=11)), [])
+
+
+class ReceivingTests(TestCase):
+    def setUp(self):
+        self.procurement = Procurement.objects.create(order_number='PO-TEST-1')
+        ProcurementItem.objects.create(
+            procurement=self.procurement, medication_name='Paracetamol', ordered_quantity=Decimal('5'),
+            unit_price=Decimal('1'), batch_number='P1',
+        )
+
+    def low_stock_count(self):
+        return counters.read({'low': 'pharmacy.low_stock'})['low']
+
+    def test_receipts_are_booked_when_the_backend_returns_no_ids(self):
+        no_ids = mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False,
+        )
+        with no_ids:
+            movements = receiving.receive(self.procurement)
+        self.assertTrue(all(movement.pk for movement in movements))
+        stock = PharmacyStock.objects.get(batch_number='P1')
+        self.assertEqual(stock.quantity, 5)
+        self.assertEqual(StockMovement.objects.get(procurement_item__procurement=self.procurement).stock, stock)
+
+    def test_a_batch_created_concurrently_is_counted_once(self):
+        self.assertEqual(self.low_stock_count(), 0)
+        bulk_create = PharmacyStock.objects.bulk_create
+
+        def racing(objects, **kwargs):
+            # Another receipt inserts the same batch first; ours is dropped by ignore_conflicts
+            with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(minutes=1)):
+                PharmacyStock.objects.create(medication_name='Paracetamol', batch_number='P1', quantity=0)
+            return bulk_create(objects, **kwargs)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch.object(PharmacyStock.objects, 'bulk_create', side_effect=racing):
+                receiving.receive(self.procurement)
+        self.assertEqual(PharmacyStock.objects.get().quantity, 5)
+        self.assertEqual(self.low_stock_count(), 1)
+
+    def test_a_new_batch_is_counted(self):
+        self.low_stock_count()
+        with self.captureOnCommitCallbacks(execute=True):
+            receiving.receive(self.procurement)
+        self.assertEqual(self.low_stock_count(), 1)
+
+
+class ReferenceRangeTests(LabFixtureMixin, TestCase):
+    # (normal_range, value, sex, age, expected (abnormal, critical))
+    CASES = [
+        ('70-110', '90', None, None, (False, False)),
+        ('70-110', '70', None, None, (False, False)),
+        ('70-110', '110', None, None, (False, False)),
+        ('70-110', '110.1', None, None, (True, False)),
+        ('70-110', '69', None, None, (True, False)),
+        ('3.5 - 5.0 mmol/L', '5.0 mmol/L', None, None, (False, False)),
+        ('<200', '199', None, None, (False, False)),
+        ('<200', '200', None, None, (True, False)),
+        ('<=200', '200', None, None, (False, False)),
+        ('>40', '40', None, None, (True, False)),
+        ('>=40', '40', None, None, (False, False)),
+        ('up to 10', '10', None, None, (False, False)),
+        ('M: 13-17; F: 12-15', '12.5', 'F', 40, (False, False)),
+        ('M: 13-17; F: 12-15', '12.5', 'M', 40, (True, False)),
+        ('M: 13-17; F: 12-15', '12.5', '', 40, (None, False)),
+        ('M 13-17, F 12-15', '16', 'F', 40, (True, False)),
+        ('Adult: 70-110; Child (0-17y): 60-100', '65', None, 10, (False, False)),
+        ('Adult: 70-110; Child (0-17y): 60-100', '65', None, 30, (True, False)),
+        ('Adult: 70-110; Child (0-17y): 60-100', '65', None, 17, (False, False)),
+        ('Adult: 70-110; Child (0-17y): 60-100', '65', None, 18, (True, False)),
+        ('Adult: 70-110; Child (0-17y): 60-100', '65', None, None, (None, False)),
+        ('70-110; Critical: <40 or >400', '39', None, None, (True, True)),
+        ('70-110; Critical: <40 or >400', '40', None, None, (True, False)),
+        ('70-110; Critical: <40 or >400', '400', None, None, (True, False)),
+        ('70-110; Critical: <40 or >400', '401', None, None, (True, True)),
+        ('Critical: <40 or >400', '30', None, None, (True, True)),
+        ('Critical: <40 or >400', '100', None, None, (None, False)),
+        ('1,000-4,000', '4,500', None, None, (True, False)),
+        ('70-110', 'hemolysed', None, None, (None, False)),
+        ('70-110', '1/64', None, None, (None, False)),
+        ('70-110', '', None, None, (None, False)),
+        ('<0.5', '<0.1', None, None, (False, False)),
+        ('Negative', '5', None, None, (None, False)),
+        ('', '5', None, None, (None, False)),
+    ]
+
+    def test_classify(self):
+        for normal_range, value, sex, age, expected in self.CASES:
+            with self.subTest(normal_range=normal_range, value=value, sex=sex, age=age):
+                self.assertEqual(reference_ranges.classify(normal_range, value, sex, age), expected)
+
+    def test_numeric(self):
+        for value, expected in [('5.4', 5.4), ('<0.1', 0.1), ('140 mmol/L', 140.0), ('-2', -2.0),
+                                ('1,200', 1200.0), ('Positive', None), ('1/64', None), (None, None)]:
+            with self.subTest(value=value):
+                self.assertEqual(reference_ranges.numeric(value), expected)
+
+    def test_age_at_uses_date_of_birth_at_report_time(self):
+        reported = timezone.make_aware(datetime(2025, 6, 1, 12))
+        self.assertEqual(reference_ranges.age_at(date(2007, 6, 2), 99, reported), 17)
+        self.assertEqual(reference_ranges.age_at(date(2007, 6, 1), 99, reported), 18)
+        self.assertEqual(reference_ranges.age_at(None, 42, reported), 42)
+
+    def post_result(self, value, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('labresult-list'), {'lab_order_item': self.item.pk, 'result_value': value, **extra}, format='json',
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        return LabResult.objects.get(pk=response.data['id'])
+
+    def test_results_are_flagged_on_save(self):
+        self.assertFalse(self.post_result('90', is_abnormal=True).is_abnormal)
+        self.assertTrue(self.post_result('120').is_abnormal)
+        self.assertTrue(self.post_result('not done', is_abnormal=True).is_abnormal)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_critical_result_notifies_ordering_and_attending_doctors(self):
+        attending = User.objects.create_user(username='attending', password='x', role=Role.DOCTOR)
+        self.lab_visit.attending_doctor = attending
+        self.lab_visit.save()
+        result = self.post_result('30')
+        self.assertTrue(result.is_abnormal)
+        alerts = Notification.objects.order_by('recipient_id')
+        self.assertEqual([alert.recipient_id for alert in alerts], sorted([self.doctor.pk, attending.pk]))
+        self.assertEqual({alert.priority for alert in alerts}, {'urgent'})
+        self.assertEqual(alerts[0].action_url, reverse('labresult-detail', args=[result.pk]))
+
+        # Saving it again without a new value does not repeat the alert
+        result.verified_by = self.lab_user
+        result.save()
+        self.assertEqual(Notification.objects.count(), 2)
+
+
+class DuplicatePatientTests(TestCase):
+    def patient(self, mrn, first_name, last_name='', **fields):
+        return Patient.objects.create(mrn=mrn, first_name=first_name, last_name=last_name, **fields)
+
+    def test_soundex(self):
+        for word, code in [('Robert', 'R163'), ('Rupert', 'R163'), ('Tymczak', 'T522'), ('Ashcraft', 'A261'),
+                           ('Pfister', 'P236'), ('Lee', 'L000'), ("O'Hara", 'O600'), ('', '')]:
+            with self.subTest(word=word):
+                self.assertEqual(duplicates.soundex(word), code)
+
+    def test_blocking_keys(self):
+        registered = timezone.make_aware(datetime(2025, 9, 16, 10, 0))
+        keys = duplicates.match_keys('Anita', 'Sharma', dob=date(1990, 5, 1), contact_number='+91 98765 43210')
+        self.assertEqual(keys, {'n:A530-S650:995', 'p:A530:6543210'})
+        # Swapped names collide; years one apart share a window
+        self.assertEqual(duplicates.match_keys('Sharma', 'Anita', dob=date(1991, 1, 1)),
+                         {'n:A530-S650:995', 'n:A530-S650:996'})
+        self.assertEqual(duplicates.match_keys('Anita', 'Sharma', age=35, registered_at=registered),
+                         {'n:A530-S650:995'})
+        # Placeholder names get no name key, and short numbers no phone key
+        self.assertEqual(duplicates.match_keys('Emergency', 'Patient', dob=date(1990, 5, 1), contact_number='12345'),
+                         set())
+        self.assertEqual(duplicates.match_keys('Anita', 'Sharma', contact_number='98765 43210'),
+                         {'p:A530:6543210'})
+
+    def test_clusters_merge_matching_pairs_transitively(self):
+        by_name = self.patient('MRNDUP0001', 'Anita', 'Sharma', dob=date(1990, 5, 1))
+        by_both = self.patient('MRNDUP0002', 'Anita', 'Sharma', dob=date(1990, 5, 1), contact_number='9876543210')
+        # Shares only the phone key with by_both, and nothing with by_name
+        by_phone = self.patient('MRNDUP0003', 'Anitha', 'Sharma', contact_number='9876543210')
+        self.patient('MRNDUP0004', 'Anil', 'Sharma', dob=date(1990, 5, 1), contact_number='9876543210')
+        self.patient('MRNDUP0005', 'Emergency', 'Patient', dob=date(1990, 5, 1))
+        self.patient('MRNDUP0006', 'Emergency', 'Patient', dob=date(1990, 5, 1))
+
+        clusters = duplicates.find_clusters()
+        self.assertEqual([set(cluster) for cluster in clusters], [{by_name.pk, by_both.pk, by_phone.pk}])
+        # Small batches compare the same pairs
+        self.assertEqual([set(cluster) for cluster in duplicates.find_clusters(batch_size=1)],
+                         [{by_name.pk, by_both.pk, by_phone.pk}])
+
+
+class OPRegistrationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='frontdesk', password='x', role=Role.RECEPTIONIST)
+        self.client.force_login(self.user)
+        self.department = Department.objects.create(name='Medicine')
+        self.doctor = User.objects.create_user(username='physician', password='x', role=Role.DOCTOR)
+
+    def register(self, **fields):
+        data = {
+            'first_name': 'Ravi', 'last_name': 'Kumar', 'gender': 'M', 'contact_number': '9876543210',
+            'department': self.department.pk, 'doctor': self.doctor.pk, **fields,
+        }
+        return self.client.post(reverse('op-registration'), data)
+
+    def test_malformed_date_of_birth_is_rejected(self):
+        for dob in ['31/12/1990', '1990-02-30']:
+            with self.subTest(dob=dob):
+                response = self.register(dob=dob)
+                self.assertEqual(response.status_code, 400)
+                self.assertContains(response, 'YYYY-MM-DD', status_code=400)
+        self.assertEqual(self.register(age='forty').status_code, 400)
+        self.assertFalse(Patient.objects.exists())
+
+    def test_duplicate_warning_keeps_repeated_fields(self):
+        self.assertEqual(self.register(dob='1990-05-01').status_code, 302)
+        response = self.register(dob='1990-05-01', allergies=['Penicillin', 'Sulfa'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['possible_duplicates'])
+        submitted = response.context['submitted']
+        self.assertIn(('allergies', 'Penicillin'), submitted)
+        self.assertIn(('allergies', 'Sulfa'), submitted)
+        self.assertEqual(Patient.objects.count(), 1)
+
+
+class DoctorAvailabilityTests(TestCase):
+    def setUp(self):
+        self.doctor = User.objects.create_user(username='physician', password='x', role=Role.DOCTOR)
+
+    def availability(self, **params):
+        return self.client.get(reverse('doctor-availability'), params)
+
+    def test_non_numeric_ids_are_rejected(self):
+        for params in [{'doctor_id': 'abc'}, {'doctor_id': f'{self.doctor.pk},abc'}, {'department': 'cardio'}]:
+            with self.subTest(**params):
+                response = self.availability(date='2030-01-07', **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid parameters'})
+        response = self.availability(date='2030-01-07', doctor_id=str(self.doctor.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('available_slots', response.json())
+
+    @staticmethod
+    def at(hour, minute=0):
+        return timezone.make_aware(datetime(2030, 1, 7, hour, minute))
+
+    def test_merge_joins_overlapping_and_touching_intervals(self):
+        at = self.at
+        self.assertEqual(
+            scheduling.merge([(at(11), at(12)), (at(9), at(10)), (at(9, 30), at(10, 15)), (at(10, 15), at(10, 45)),
+                              (at(11, 15), at(11, 30)), (at(13), at(14))]),
+            [(at(9), at(10, 45)), (at(11), at(12)), (at(13), at(14))],
+        )
+        self.assertEqual(scheduling.merge([]), [])
+
+    def test_subtract_splits_and_trims_free_intervals(self):
+        at = self.at
+        free = [(at(9), at(12)), (at(13), at(17))]
+        busy = [(at(8), at(9, 30)), (at(10), at(10, 30)), (at(11, 30), at(13, 30)), (at(17), at(18))]
+        self.assertEqual(
+            scheduling.subtract(free, busy),
+            [(at(9, 30), at(10)), (at(10, 30), at(11, 30)), (at(13, 30), at(17))],
+        )
+        self.assertEqual(scheduling.subtract(free, []), free)
+        self.assertEqual(scheduling.subtract(free, [(at(8), at(18))]), [])
+
+    def test_slots_fill_the_day_to_its_edges_on_the_window_grid(self):
+        at, half_hour = self.at, timedelta(minutes=30)
+        self.assertEqual(
+            scheduling.slots([(at(9), at(10)), (at(16, 10), at(17))], at(9), half_hour),
+            [at(9), at(9, 30), at(16, 30)],
+        )
+        # A free interval shorter than a slot, or ending a minute early, offers nothing
+        self.assertEqual(scheduling.slots([(at(12), at(12, 20)), (at(12, 30), at(12, 59))], at(9), half_hour), [])
+
+    def test_availability_around_appointments_at_the_ends_of_the_shift(self):
+        patient = Patient.objects.create(mrn='MRNSCH0001', first_name='Sam')
+        for starts_at in (self.at(9), self.at(16, 30)):
+            Appointment.objects.create(doctor=self.doctor, patient=patient, appointment_date=starts_at)
+        free = scheduling.availability([self.doctor], date(2030, 1, 7), now=self.at(0))[self.doctor.pk]
+        slots = free[date(2030, 1, 7)]
+        self.assertEqual((slots[0], slots[-1], len(slots)), (self.at(9, 30), self.at(16), 14))
+
+
+class EarlyWarningTests(TestCase):
+    # NEWS2 bands at each edge: (parameter, value, sub-score). SpO2 is scale 1,
+    # and consciousness is not recorded in Vitals, so every patient scores as alert.
+    BAND_EDGES = [
+        ('respiratory_rate', 8, 3), ('respiratory_rate', 9, 1), ('respiratory_rate', 11, 1),
+        ('respiratory_rate', 12, 0), ('respiratory_rate', 20, 0), ('respiratory_rate', 21, 2),
+        ('respiratory_rate', 24, 2), ('respiratory_rate', 25, 3),
+        ('oxygen_saturation', 91, 3), ('oxygen_saturation', 92, 2), ('oxygen_saturation', 93, 2),
+        ('oxygen_saturation', 94, 1), ('oxygen_saturation', 95, 1), ('oxygen_saturation', 96, 0),
+        ('oxygen_saturation', Decimal('100.00'), 0),
+        ('systolic_bp', 90, 3), ('systolic_bp', 91, 2), ('systolic_bp', 100, 2), ('systolic_bp', 101, 1),
+        ('systolic_bp', 110, 1), ('systolic_bp', 111, 0), ('systolic_bp', 219, 0), ('systolic_bp', 220, 3),
+        ('pulse', 40, 3), ('pulse', 41, 1), ('pulse', 50, 1), ('pulse', 51, 0), ('pulse', 90, 0),
+        ('pulse', 91, 1), ('pulse', 110, 1), ('pulse', 111, 2), ('pulse', 130, 2), ('pulse', 131, 3),
+        ('temperature', Decimal('35.00'), 3), ('temperature', Decimal('35.10'), 1), ('temperature', Decimal('36.00'), 1),
+        ('temperature', Decimal('36.10'), 0), ('temperature', Decimal('38.00'), 0), ('temperature', Decimal('38.10'), 1),
+        ('temperature', Decimal('39.00'), 1), ('temperature', Decimal('39.10'), 2),
+    ]
+    NORMAL = {'respiratory_rate': 16, 'oxygen_saturation': 98, 'systolic_bp': 120, 'pulse': 70, 'temperature': 37}
+
+    def setUp(self):
+        self.doctor = User.objects.create_user(username='registrar', password='x', role=Role.DOCTOR)
+        self.nurse = User.objects.create_user(username='sister', password='x', role=Role.NURSE)
+        self.ward = Ward.objects.create(name='Medical', ward_type='general', total_beds=4, nurse_in_charge=self.nurse)
+        self.visits = 0
+
+    def admit(self, **readings):
+        self.visits += 1
+        patient = Patient.objects.create(mrn=f'MRNEWS{self.visits:04d}', first_name=f'P{self.visits}')
+        visit = Visit.objects.create(
+            patient=patient, visit_id=f'VEWS{self.visits:04d}', visit_type='ipd', attending_doctor=self.doctor,
+        )
+        beds.assign(visit, Bed.objects.create(ward=self.ward, bed_number=str(self.visits)))
+        if readings:
+            Vitals.objects.create(visit=visit, **{**self.NORMAL, **readings})
+        return visit
+
+    def test_band_edges(self):
+        for parameter, value, expected in self.BAND_EDGES:
+            with self.subTest(parameter=parameter, value=value):
+                self.assertEqual(early_warning.score_column(parameter, [value]), [expected])
+        self.assertEqual(early_warning.score_column('pulse', [None, 70]), [None, 0])
+
+    def test_risk_thresholds(self):
+        # (total, a parameter scored 3, risk)
+        for total, red_flag, expected in [
+            (0, False, 'low'), (4, False, 'low'), (3, True, 'low-medium'), (4, True, 'low-medium'),
+            (5, False, 'medium'), (6, True, 'medium'), (7, False, 'high'), (9, True, 'high'),
+        ]:
+            with self.subTest(total=total, red_flag=red_flag):
+                self.assertEqual(early_warning.risk(total, red_flag), expected)
+
+    def test_scores_sum_the_latest_reading(self):
+        visit = self.admit(pulse=131)
+        Vitals.objects.create(visit=visit, respiratory_rate=22, pulse=95, temperature=Decimal('38.5'),
+                              recorded_at=timezone.now() + timedelta(minutes=1))
+        news2 = early_warning.scores()[visit.pk]
+        self.assertEqual((news2['score'], news2['risk'], news2['red_flag']), (4, 'low', False))
+        self.assertEqual(sorted(news2['missing']), ['oxygen_saturation', 'systolic_bp'])
+
+        single = early_warning.scores(Visit.objects.filter(pk=self.admit(pulse=131).pk))
+        self.assertEqual([(row['score'], row['risk']) for row in single.values()], [(3, 'low-medium')])
+
+    def test_worklist_orders_by_acuity(self):
+        unscored = self.admit()
+        low = self.admit()
+        high = self.admit(respiratory_rate=25, pulse=131, oxygen_saturation=91)
+        red_flag = self.admit(systolic_bp=90)
+        medium = self.admit(respiratory_rate=21, pulse=111, temperature=Decimal('38.5'))
+        Vitals.objects.create(visit=low, **self.NORMAL)
+        order = [entry['visit'].pk for entry in early_warning.worklist(ward=self.ward)]
+        self.assertEqual(order, [high.pk, medium.pk, red_flag.pk, low.pk, unscored.pk])
+
+    def test_escalation_is_sent_once_per_reading(self):
+        high = self.admit(respiratory_rate=25, pulse=131, oxygen_saturation=91)
+        self.admit(systolic_bp=90)  # low-medium: not escalated
+        sent = early_warning.escalate(early_warning.worklist())
+        self.assertEqual(sorted(n.recipient_id for n in sent), sorted([self.doctor.pk, self.nurse.pk]))
+        self.assertEqual({n.priority for n in sent}, {'urgent'})
+        self.assertEqual(early_warning.escalate(early_warning.worklist()), [])
+        Vitals.objects.create(visit=high, respiratory_rate=25, pulse=131, oxygen_saturation=91,
+                              recorded_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(len(early_warning.escalate(early_warning.worklist())), 2)
+        self.assertEqual(Notification.objects.count(), 4)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(mrn='MRNCNT0001', first_name='Ann')
+        self.today = timezone.localdate()
+
+    def figures(self, **spec):
+        return counters.read(spec)
+
+    def write(self, action, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return action(*args, **kwargs)
+
+    def test_bucket_keys(self):
+        self.assertEqual(counters.COUNTERS_BY_NAME['patients.total'].key(), 'patients.total')
+        self.assertEqual(counters.COUNTERS_BY_NAME['visits.admitted'].key(date(2025, 9, 6)), 'visits.admitted:2025-09-06')
+        self.assertEqual(
+            counters.COUNTERS_BY_NAME['payments.revenue_monthly'].key(date(2025, 9, 6)), 'payments.revenue_monthly:2025-09',
+        )
+
+    def test_visit_create_transition_and_delete(self):
+        spec = {'active': 'visits.active', 'admitted': ('visits.admitted', self.today),
+                'discharged': ('visits.discharged', self.today)}
+        self.assertEqual(self.figures(**spec), {'active': 0, 'admitted': 0, 'discharged': 0})
+        visit = self.write(Visit.objects.create, patient=self.patient, visit_id='VCNT0001', status='active')
+        self.assertEqual(self.figures(**spec), {'active': 1, 'admitted': 1, 'discharged': 0})
+
+        visit.status, visit.discharged_at = 'discharged', timezone.now()
+        self.write(visit.save)
+        self.assertEqual(self.figures(**spec), {'active': 0, 'admitted': 1, 'discharged': 1})
+        # Saving fields no counter reads changes nothing
+        visit.reason = 'Review'
+        with mock.patch.object(counters, '_apply') as apply:
+            self.write(visit.save, update_fields=['reason'])
+        apply.assert_not_called()
+
+        self.write(visit.delete)
+        self.assertEqual(self.figures(**spec), {'active': 0, 'admitted': 0, 'discharged': 0})
+
+    def test_amounts_follow_status_and_value_changes(self):
+        spec = {'outstanding': 'invoices.outstanding', 'sent': 'invoices.sent'}
+        self.assertEqual(self.figures(**spec), {'outstanding': Decimal('0'), 'sent': 0})
+        invoice = self.write(Invoice.objects.create, patient=self.patient, invoice_number='INV-CNT-1',
+                             total_amount=Decimal('100.00'), status='sent')
+        self.assertEqual(self.figures(**spec), {'outstanding': Decimal('100.00'), 'sent': 1})
+        invoice.total_amount = Decimal('150.00')
+        self.write(invoice.save)
+        self.assertEqual(self.figures(**spec), {'outstanding': Decimal('150.00'), 'sent': 1})
+        invoice.status = 'paid'
+        self.write(invoice.save)
+        self.assertEqual(self.figures(**spec), {'outstanding': Decimal('0'), 'sent': 0})
+
+        month = {'month': ('payments.revenue_monthly', self.today), 'day': ('payments.revenue', self.today)}
+        self.figures(**month)
+        self.write(Payment.objects.create, invoice=invoice, amount=Decimal('40.00'))
+        self.write(Payment.objects.create, invoice=invoice, amount=Decimal('60.00'))
+        self.assertEqual(self.figures(**month), {'month': Decimal('100.00'), 'day': Decimal('100.00')})
+
+    def test_record_bulk_applies_bulk_written_rows(self):
+        self.assertEqual(self.figures(total='patients.total'), {'total': 1})
+        patients = Patient.objects.bulk_create(
+            [Patient(mrn=f'MRNCNTB{i:03d}', first_name='Bulk') for i in range(3)]
+        )
+        self.assertEqual(self.figures(total='patients.total'), {'total': 1})  # bulk_create sends no signals
+        self.write(counters.record_bulk, Patient, [(None, patient) for patient in patients])
+        self.assertEqual(self.figures(total='patients.total'), {'total': 4})
+        # A (before, after) pair moves a row between figures
+        visit = self.write(Visit.objects.create, patient=self.patient, visit_id='VCNT0002', status='active')
+        before = Visit(pk=visit.pk, status='active', admitted_at=visit.admitted_at)
+        Visit.objects.filter(pk=visit.pk).update(status='cancelled')
+        visit.status = 'cancelled'
+        self.write(counters.record_bulk, Visit, [(before, visit)])
+        self.assertEqual(self.figures(active='visits.active'), {'active': 0})
+
+    def test_reconcile_repairs_drift(self):
+        yesterday = self.today - timedelta(days=1)
+        self.figures(total='patients.total', registered=('patients.registered', self.today))
+        DashboardCounter.objects.filter(key='patients.total').update(value=99)
+        DashboardCounter.objects.create(key=f'patients.registered:{yesterday.isoformat()}', value=5)
+        Patient.objects.filter(pk=self.patient.pk).update(created_at=timezone.now())  # no signal either way
+
+        self.assertGreaterEqual(counters.reconcile(), 2)
+        self.assertEqual(
+            self.figures(total='patients.total', registered=('patients.registered', self.today),
+                         before=('patients.registered', yesterday)),
+            {'total': 1, 'registered': 1, 'before': 0},
+        )
+        self.assertEqual(counters.reconcile(), 0)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'dashboard-tests'}},
+    HIS_DASHBOARD_CACHE='default',
+)
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        dashboard_cache.get_cache().clear()
+        self.doctor = User.objects.create_user(username='dash-doctor', password='x', role=Role.DOCTOR)
+        self.other_doctor = User.objects.create_user(username='dash-doctor-2', password='x', role=Role.DOCTOR)
+        self.nurse = User.objects.create_user(username='dash-nurse', password='x', role=Role.NURSE)
+        self.patient = Patient.objects.create(mrn='MRNDASH0001', first_name='Dana')
+        self.ward = Ward.objects.create(name='Dash', ward_type='general', total_beds=1, nurse_in_charge=self.nurse)
+        self.bed = Bed.objects.create(ward=self.ward, bed_number='1')
+
+    def fill(self):
+        """Cache every fragment these tests can touch and return their keys by name."""
+        keys = {
+            'doctor': dashboard_cache.fragment_key('doctor', self.doctor.pk),
+            'other_doctor': dashboard_cache.fragment_key('doctor', self.other_doctor.pk),
+            'nurse': dashboard_cache.fragment_key('nurse', self.nurse.pk),
+            'nurses': dashboard_cache.fragment_key('nurse'),
+            'finance': dashboard_cache.fragment_key('finance'),
+        }
+        dashboard_cache.get_cache().set_many({key: {'cached': True} for key in keys.values()})
+        return keys
+
+    def dropped_by(self, action, *args, **kwargs):
+        keys = self.fill()
+        with self.captureOnCommitCallbacks(execute=True):
+            action(*args, **kwargs)
+        kept = dashboard_cache.get_cache().get_many(keys.values())
+        return {name for name, key in keys.items() if key not in kept}
+
+    def test_cached_fragment_computes_once(self):
+        compute = mock.Mock(return_value={'my_patients': 3})
+        self.assertEqual(dashboard_cache.cached_fragment('doctor', self.doctor.pk, compute), {'my_patients': 3})
+        self.assertEqual(dashboard_cache.cached_fragment('doctor', self.doctor.pk, compute), {'my_patients': 3})
+        compute.assert_called_once()
+        self.assertEqual(dashboard_cache.stats()['doctor'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_saves_invalidate_the_fragments_built_from_them(self):
+        appointment = Appointment(patient=self.patient, doctor=self.doctor, appointment_date=timezone.now())
+        self.assertEqual(self.dropped_by(appointment.save), {'doctor'})
+        # Moving the appointment drops the previous doctor's fragment as well
+        appointment.doctor = self.other_doctor
+        self.assertEqual(self.dropped_by(appointment.save), {'doctor', 'other_doctor'})
+        self.assertEqual(self.dropped_by(appointment.delete), {'other_doctor'})
+
+        visit = Visit(patient=self.patient, visit_id='VDASH0001', status='active', attending_doctor=self.doctor)
+        self.assertEqual(self.dropped_by(visit.save), {'doctor', 'nurses'})
+        visit.bed = self.bed
+        self.assertEqual(self.dropped_by(visit.save), {'doctor', 'nurse', 'nurses'})
+
+        vitals = Vitals(visit=visit, pulse=72, recorded_at=timezone.now())
+        self.assertEqual(self.dropped_by(vitals.save), {'nurses'})
+
+        self.ward.nurse_in_charge = None
+        self.assertEqual(self.dropped_by(self.ward.save), {'nurse'})
+
+        invoice = Invoice(patient=self.patient, invoice_number='INV-DASH-1', total_amount=Decimal('10.00'))
+        self.assertEqual(self.dropped_by(invoice.save), {'finance'})
+        payment = Payment(invoice=invoice, amount=Decimal('10.00'))
+        self.assertEqual(self.dropped_by(payment.save), {'finance'})
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='clerk', password='x', role=Role.RECEPTIONIST)
+        patient = Patient.objects.create(mrn='MRNKEY0001', first_name='Ann')
+        base = timezone.now().replace(microsecond=0)
+        # Three rows share a timestamp, two more share another: the id breaks the ties
+        offsets = [0, 0, 0, 1, 1, 2, 3, 4]
+        for index, hours in enumerate(offsets):
+            Visit.objects.create(patient=patient, visit_id=f'VKEY{index:04d}', admitted_at=base - timedelta(hours=hours))
+        cls.newest_first = list(Visit.objects.order_by('-admitted_at', '-pk').values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url=None, **params):
+        return self.client.get(url or reverse('visit-list'), params)
+
+    def test_cursors_round_trip_over_tied_timestamps(self):
+        pages, links = [], []
+        response = self.get(page_size=3)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append([row['id'] for row in response.data['results']])
+            links.append(response.data['previous'])
+            if not response.data['next']:
+                break
+            response = self.get(response.data['next'])
+        self.assertEqual(pages, [self.newest_first[0:3], self.newest_first[3:6], self.newest_first[6:8]])
+        self.assertIsNone(links[0])
+
+        # Walk back from the last page
+        back = self.get(links[-1]).data
+        self.assertEqual([row['id'] for row in back['results']], self.newest_first[3:6])
+        first = self.get(back['previous']).data
+        self.assertEqual([row['id'] for row in first['results']], self.newest_first[0:3])
+        self.assertIsNone(first['previous'])
+        self.assertEqual([row['id'] for row in self.get(first['next']).data['results']], self.newest_first[3:6])
+
+    def test_ascending_order(self):
+        oldest_first = list(reversed(self.newest_first))
+        seen, cursor = [], None
+        while True:
+            rows, cursor, _ = keyset_page(Visit.objects.all(), ['admitted_at'], cursor, 3)
+            seen += [row.pk for row in rows]
+            if cursor is None:
+                break
+        self.assertEqual(seen, oldest_first)
+
+    def test_invalid_cursors_are_rejected(self):
+        valid = encode_cursor([timezone.now(), 1])
+        for cursor in ['not-a-cursor', encode_cursor([1]), encode_cursor(['yesterday', 1]), valid[:-3]]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.get(cursor=cursor).status_code, 400)
+
+    def test_page_numbers_keep_the_count(self):
+        response = self.get(page=2, page_size=3)
+        self.assertEqual(response.data['count'], len(self.newest_first))
+        self.assertEqual([row['id'] for row in response.data['results']], self.newest_first[3:6])
+
+    def test_keyset_indexes_exist(self):
+        expected = {
+            AuditLog: ['timestamp', 'id'], Invoice: ['created_at', 'id'], LabResult: ['reported_at', 'id'],
+            Visit: ['admitted_at', 'id'], Vitals: ['recorded_at', 'id'],
+        }
+        with connection.cursor() as cursor:
+            for model, columns in expected.items():
+                with self.subTest(model=model.__name__):
+                    constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+                    self.assertIn(columns, [c['columns'] for c in constraints.values() if c['index']])
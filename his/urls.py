@@ -6,7 +6,8 @@ from .views import (
     UserViewSet, StaffViewSet, AuditLogListView, PatientViewSet, VisitViewSet, MedicalRecordViewSet,
     PrescriptionViewSet, MedicationDispenseViewSet, PharmacyStockViewSet, ProcurementViewSet,
     LabOrderViewSet, LabResultViewSet, RadiologyOrderViewSet, RadiologyReportViewSet,
-    InvoiceViewSet, PaymentViewSet, InsuranceClaimViewSet, AppointmentViewSet, VitalsViewSet,
+    InvoiceViewSet, PaymentViewSet, InsuranceClaimViewSet, AppointmentViewSet, VitalsViewSet, WardViewSet,
+    BedViewSet,
     
     # Authentication Views
     LoginPageView, DashboardView, LogoutView,
@@ -25,7 +26,7 @@ from .views import (
     InvoiceCreateView, BedAssignmentView, PatientReportView, QuickAdmitView,
     
     # API Views
-    PatientSearchAPIView, DoctorAvailabilityAPIView, NotificationAPIView
+    PatientSearchAPIView, DoctorAvailabilityAPIView, NotificationAPIView, DashboardCacheStatsAPIView
 )
 
 # API Router
@@ -48,6 +49,8 @@ router.register('radiology-reports', RadiologyReportViewSet)
 router.register('invoices', InvoiceViewSet)
 router.register('payments', PaymentViewSet)
 router.register('insurance-claims', InsuranceClaimViewSet)
+router.register('wards', WardViewSet)
+router.register('beds', BedViewSet)
 
 urlpatterns = [
     # API Routes
@@ -96,6 +99,7 @@ urlpatterns = [
     path('api/patients/search/', PatientSearchAPIView.as_view(), name='patient-search'),
     path('api/doctor-availability/', DoctorAvailabilityAPIView.as_view(), name='doctor-availability'),
     path('api/notifications/', NotificationAPIView.as_view(), name='notifications'),
+    path('api/dashboard-cache/stats/', DashboardCacheStatsAPIView.as_view(), name='dashboard-cache-stats'),
     
     # Legacy URLs (for compatibility)
     path('users/', UsersListView.as_view(), name='user-list'),
@@ -1,15 +1,17 @@
 # his/views.py
-from rest_framework import viewsets, permissions, filters, status, generics
+from rest_framework import viewsets, permissions, filters, serializers, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.views import APIView
 from django.views.generic import TemplateView, ListView, CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth import authenticate, login, logout
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
+from django.db import transaction
 from django.db.models import Q, Count, Sum, F
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.http import JsonResponse, HttpResponse
 from datetime import datetime, timedelta
 import uuid
@@ -20,29 +22,44 @@ from django.conf import settings
 from .models import (
     User, Staff, AuditLog, Patient, Visit, MedicalRecord, Department,
     Prescription, PrescriptionItem, MedicationDispense, PharmacyStock, Procurement, ProcurementItem,
-    LabOrder, LabOrderItem, LabResult, LabTest, RadiologyOrder, RadiologyReport, RadiologyStudy,
+    LabOrder, LabOrderItem, LabResult, LabTatRollup, LabTest, RadiologyOrder, RadiologyReport, RadiologyStudy,
     Invoice, InvoiceItem, Payment, InsuranceClaim, InsuranceProvider, Role, Ward, Bed,
     Appointment, Surgery, OperationTheatre, Vitals, Service, TreatmentPackage,
-    LeaveRequest, LeaveType, SystemConfiguration, Notification, FollowUp, EmergencyContact
+    LeaveRequest, LeaveType, SystemConfiguration, Notification, FollowUp, EmergencyContact, StockMovement
 )
 from .serializers import (
-    UserSerializer, StaffSerializer, AuditLogSerializer, PatientSerializer, VisitSerializer, MedicalRecordSerializer,
+    UserSerializer, StaffSerializer, AuditLogSerializer, PatientSerializer, VisitSerializer, VisitListSerializer,
+    MedicalRecordSerializer,
     PrescriptionSerializer, MedicationDispenseSerializer, PharmacyStockSerializer, ProcurementSerializer,
     LabOrderSerializer, LabResultSerializer, RadiologyOrderSerializer, RadiologyReportSerializer,
-    InvoiceSerializer, PaymentSerializer, InsuranceClaimSerializer, AppointmentSerializer, VitalsSerializer
+    InvoiceSerializer, PaymentSerializer, InsuranceClaimSerializer, AppointmentSerializer, VitalsSerializer,
+    WardSerializer, BedSerializer, StockMovementSerializer, LabWorklistItemSerializer
+)
+from . import (
+    audit, beds, counters, dashboard_cache, dispensing, duplicates, early_warning, lab_import, lab_trends, lab_worklist,
+    notifications, receiving, scheduling, search_index, stock_alerts, stock_ledger, vitals_ingest, vitals_series,
 )
+from .pagination import CustomPagination, InvalidCursor, KeysetListMixin, KeysetPagination, keyset_page
+from .sequences import generate_mrn, generate_visit_id, generate_invoice_number, generate_payment_number
 
 # Custom Pagination
-class CustomPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+def visit_read_serializer(request):
+    """Flat visit rows by default; the nested patient form only with ?expand=patient"""
+    if 'patient' in request.query_params.get('expand', '').split(','):
+        return VisitSerializer
+    return VisitListSerializer
 
 # Permission helpers
 class IsAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated and request.user.role == Role.ADMIN)
 
+class IsAdminOrReadOnly(permissions.BasePermission):
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return bool(request.user and request.user.is_authenticated)
+        return IsAdmin().has_permission(request, view)
+
 class IsDoctor(permissions.BasePermission):
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated and request.user.role == Role.DOCTOR)
@@ -63,43 +80,6 @@ class IsLab(permissions.BasePermission):
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated and request.user.role == Role.LAB)
 
-# Utility Functions
-def generate_mrn():
-    """Generate unique MRN"""
-    today = timezone.now().date()
-    prefix = today.strftime("%y%m%d")
-    last_patient = Patient.objects.filter(mrn__startswith=prefix).order_by('mrn').last()
-    if last_patient:
-        last_number = int(last_patient.mrn[-4:])
-        new_number = last_number + 1
-    else:
-        new_number = 1
-    return f"{prefix}{new_number:04d}"
-
-def generate_visit_id():
-    """Generate unique visit ID"""
-    today = timezone.now().date()
-    prefix = f"V{today.strftime('%y%m%d')}"
-    last_visit = Visit.objects.filter(visit_id__startswith=prefix).order_by('visit_id').last()
-    if last_visit:
-        last_number = int(last_visit.visit_id[-4:])
-        new_number = last_number + 1
-    else:
-        new_number = 1
-    return f"{prefix}{new_number:04d}"
-
-def generate_invoice_number():
-    """Generate unique invoice number"""
-    today = timezone.now().date()
-    prefix = f"INV{today.strftime('%y%m%d')}"
-    last_invoice = Invoice.objects.filter(invoice_number__startswith=prefix).order_by('invoice_number').last()
-    if last_invoice:
-        last_number = int(last_invoice.invoice_number[-4:])
-        new_number = last_number + 1
-    else:
-        new_number = 1
-    return f"{prefix}{new_number:04d}"
-
 # API ViewSets
 User = get_user_model()   # always use the swapped user model
 
@@ -134,6 +114,14 @@ class PatientViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['mrn', 'first_name', 'last_name', 'contact_number', 'aadhar_number']
 
+    def get_queryset(self):
+        return PatientSerializer.setup_eager_loading(super().get_queryset())
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        audit.record_request(request, 'VIEW', model='Patient', object_id=kwargs.get('pk'))
+        return response
+
     def perform_create(self, serializer):
         if not serializer.validated_data.get('mrn'):
             serializer.validated_data['mrn'] = generate_mrn()
@@ -143,15 +131,41 @@ class PatientViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def medical_history(self, request, pk=None):
         patient = self.get_object()
-        visits = patient.visits.all().order_by('-admitted_at')[:10]
-        visit_serializer = VisitSerializer(visits, many=True)
+        serializer_class = visit_read_serializer(request)
+        visits = serializer_class.setup_eager_loading(patient.visits.all().order_by('-admitted_at'))[:10]
+        visit_serializer = serializer_class(visits, many=True)
+        audit.record_request(request, 'VIEW_MEDICAL_HISTORY', model='Patient', object_id=patient.pk)
         return Response(visit_serializer.data)
 
+    @action(detail=True, methods=['get'], url_path='lab-trends')
+    def lab_trends(self, request, pk=None):
+        """Lab results per test as columnar series: ?codes=HBA1C,GLU&from=&to= (see his/lab_trends.py)"""
+        patient = self.get_object()
+        params = request.query_params
+        try:
+            start = parse_datetime(params['from']) if params.get('from') else None
+            end = parse_datetime(params['to']) if params.get('to') else None
+            valid = (start or not params.get('from')) and (end or not params.get('to'))
+        except ValueError:
+            valid = False
+        if not valid:
+            return Response({'error': '"from" and "to" must be ISO 8601 datetimes'}, status=status.HTTP_400_BAD_REQUEST)
+        if start and timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        if end and timezone.is_naive(end):
+            end = timezone.make_aware(end)
+        codes = [code.strip() for code in params.get('codes', '').split(',') if code.strip()]
+        data = lab_trends.series(patient.pk, codes, start, end)
+        data['patient'] = patient.pk
+        audit.record_request(request, 'VIEW_LAB_TRENDS', model='Patient', object_id=patient.pk)
+        return Response(data)
+
     @action(detail=True, methods=['get'])
     def active_visits(self, request, pk=None):
         patient = self.get_object()
-        active_visits = patient.visits.filter(status='active')
-        visit_serializer = VisitSerializer(active_visits, many=True)
+        serializer_class = visit_read_serializer(request)
+        active_visits = serializer_class.setup_eager_loading(patient.visits.filter(status='active'))
+        visit_serializer = serializer_class(active_visits, many=True)
         return Response(visit_serializer.data)
 
 class AppointmentViewSet(viewsets.ModelViewSet):
@@ -188,10 +202,23 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         return Response({'detail': 'Appointment cancelled'})
 
 class VisitViewSet(viewsets.ModelViewSet):
+    """
+    Visits, latest admission first. The list is keyset-paginated: {"next", "previous", "results"}
+    with no "count"; follow the links (?cursor=). ?page=N gives page-number
+    responses with "count". See his/pagination.py.
+    """
     queryset = Visit.objects.all().order_by('-admitted_at')
     serializer_class = VisitSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return visit_read_serializer(self.request)
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(super().get_queryset())
 
     def perform_create(self, serializer):
         if not serializer.validated_data.get('visit_id'):
@@ -201,25 +228,85 @@ class VisitViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def discharge(self, request, pk=None):
         visit = self.get_object()
-        visit.discharged_at = timezone.now()
-        visit.status = 'discharged'
-        visit.discharge_summary = request.data.get('discharge_summary', '')
-        if visit.bed:
-            visit.bed.is_occupied = False
-            visit.bed.save()
-        visit.save()
+        with transaction.atomic():
+            # Locked, so a repeated discharge waits and then sees the visit discharged
+            visit = Visit.objects.select_for_update().get(pk=visit.pk)
+            if visit.status == 'discharged':
+                return Response({'error': 'Visit is already discharged'}, status=status.HTTP_400_BAD_REQUEST)
+            visit.discharged_at = timezone.now()
+            visit.status = 'discharged'
+            visit.discharge_summary = request.data.get('discharge_summary', '')
+            beds.release(visit)
+            visit.save()
         return Response({'detail': 'Patient discharged successfully'})
 
+    @action(detail=True, methods=['get'], url_path='vitals/series')
+    def vitals_series(self, request, pk=None):
+        """Downsampled vitals as columnar arrays: ?from=&to=&bucket=5m&metrics=pulse,oxygen_saturation"""
+        visit = self.get_object()
+        try:
+            bucket_seconds = vitals_series.parse_bucket(request.query_params.get('bucket', '5m'))
+            end = parse_datetime(request.query_params.get('to') or timezone.now().isoformat())
+            if end is not None:
+                start = parse_datetime(request.query_params.get('from') or (end - timedelta(hours=24)).isoformat())
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if end is None or start is None:
+            return Response({'error': '"from" and "to" must be ISO 8601 datetimes'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end)
+        if start >= end:
+            return Response({'error': '"from" must be before "to"'}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start).total_seconds() / bucket_seconds > vitals_series.MAX_BUCKETS:
+            return Response(
+                {'error': f'Range needs more than {vitals_series.MAX_BUCKETS} buckets; use a larger bucket'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        metrics = [m for m in request.query_params.get('metrics', '').split(',') if m] or None
+        data = vitals_series.series(visit.pk, start, end, bucket_seconds, metrics)
+        data['visit'] = visit.pk
+        return Response(data)
+
 class VitalsViewSet(viewsets.ModelViewSet):
+    """
+    Vitals readings, latest first. The list is keyset-paginated: {"next", "previous", "results"}
+    with no "count"; follow the links (?cursor=). ?page=N gives page-number
+    responses with "count". See his/pagination.py.
+    """
     queryset = Vitals.objects.all().order_by('-recorded_at')
     serializer_class = VitalsSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
         serializer.validated_data['recorded_by'] = self.request.user
         serializer.save()
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Batch ingest of monitor readings as a JSON array or NDJSON (see his/vitals_ingest.py)"""
+        try:
+            readings, parse_errors = vitals_ingest.parse_payload(request.body, request.content_type or '')
+        except vitals_ingest.PayloadError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if len(readings) > vitals_ingest.max_readings():
+            return Response(
+                {'error': f'At most {vitals_ingest.max_readings()} readings per request'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        created, errors = vitals_ingest.ingest(readings, recorded_by=request.user)
+        errors = sorted(parse_errors + errors, key=lambda error: error['index'])
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'rejected': len(errors), 'errors': errors}, status=response_status)
+
 class MedicalRecordViewSet(viewsets.ModelViewSet):
     queryset = MedicalRecord.objects.all().order_by('-created_at')
     serializer_class = MedicalRecordSerializer
@@ -242,17 +329,39 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def dispense_all(self, request, pk=None):
+        """Dispense every outstanding item from the earliest-expiring batches (see his/dispensing.py)"""
         prescription = self.get_object()
-        dispensed_items = []
-        for item in prescription.items.all():
-            dispense = MedicationDispense.objects.create(
-                prescription_item=item,
-                quantity_dispensed=item.quantity,
-                dispensed_by=request.user,
-                patient_counseled=request.data.get('patient_counseled', False)
+        # Form and JSON bodies alike: "false", "0" and "no" are false
+        flag = serializers.BooleanField()
+        try:
+            patient_counseled = flag.to_internal_value(request.data.get('patient_counseled', False))
+            partial = flag.to_internal_value(request.data.get('partial', False))
+        except serializers.ValidationError:
+            return Response(
+                {'error': '"patient_counseled" and "partial" must be true or false'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            dispenses, shortages = dispensing.dispense_prescription(
+                prescription, dispensed_by=request.user, patient_counseled=patient_counseled, partial=partial,
             )
-            dispensed_items.append(dispense.id)
-        return Response({'detail': 'All items dispensed', 'dispensed_items': dispensed_items})
+        except dispensing.InsufficientStock as exc:
+            return Response(
+                {'error': 'Insufficient stock', 'shortages': exc.shortages},
+                status=status.HTTP_409_CONFLICT,
+            )
+        except stock_ledger.NegativeBalance as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'detail': 'All items dispensed' if not shortages else 'Items partially dispensed',
+            'dispensed_items': [dispense.id for dispense in dispenses],
+            'batches': [
+                {'item': dispense.prescription_item_id, 'batch_number': dispense.batch_number,
+                 'quantity': dispense.quantity_dispensed}
+                for dispense in dispenses
+            ],
+            'shortages': shortages,
+        })
 
 class MedicationDispenseViewSet(viewsets.ModelViewSet):
     queryset = MedicationDispense.objects.all().order_by('-dispensed_at')
@@ -260,23 +369,112 @@ class MedicationDispenseViewSet(viewsets.ModelViewSet):
     permission_classes = [IsPharmacist]
     pagination_class = CustomPagination
 
+    @action(detail=True, methods=['post'], url_path='return')
+    def return_to_stock(self, request, pk=None):
+        """Book returned medication back into the batch it was dispensed from"""
+        dispense = self.get_object()
+        try:
+            movement = stock_ledger.return_dispense(
+                dispense, request.data.get('quantity'), created_by=request.user, notes=request.data.get('notes', ''),
+            )
+        except (ValueError, ArithmeticError) as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(StockMovementSerializer(movement).data, status=status.HTTP_201_CREATED)
+
 class PharmacyStockViewSet(viewsets.ModelViewSet):
     queryset = PharmacyStock.objects.all().order_by('medication_name')
     serializer_class = PharmacyStockSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = CustomPagination
 
+    # Quantities change only through the stock ledger (his/stock_ledger.py)
+    def perform_create(self, serializer):
+        quantity = serializer.validated_data.pop('quantity', 0)
+        with transaction.atomic():
+            stock = serializer.save(quantity=0)
+            if quantity:
+                stock_ledger.adjust(stock, quantity, created_by=self.request.user, notes='Opening balance')
+        stock.refresh_from_db(fields=['quantity', 'last_updated'])
+
+    def perform_update(self, serializer):
+        quantity = serializer.validated_data.pop('quantity', None)
+        with transaction.atomic():
+            # save() writes every column back and recomputes low_stock: lock
+            # the batch and start from its current balance
+            serializer.instance.quantity = PharmacyStock.objects.select_for_update().values_list(
+                'quantity', flat=True,
+            ).get(pk=serializer.instance.pk)
+            stock = serializer.save()
+            if quantity is not None and quantity != stock.quantity:
+                stock_ledger.adjust(
+                    stock, quantity - stock.quantity, created_by=self.request.user, notes='Quantity edited',
+                )
+        stock.refresh_from_db(fields=['quantity', 'last_updated'])
+
+    @action(detail=True, methods=['post'])
+    def adjust(self, request, pk=None):
+        """Record a stock-take correction or write-off: {"quantity": -5, "notes": "Broken vials"}"""
+        stock = self.get_object()
+        try:
+            stock_ledger.adjust(
+                stock, request.data.get('quantity'), created_by=request.user, notes=request.data.get('notes', ''),
+            )
+        except stock_ledger.NegativeBalance as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        except (TypeError, ValueError, ArithmeticError):
+            return Response({'error': 'quantity must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        stock.refresh_from_db()
+        return Response(self.get_serializer(stock).data)
+
+    @action(detail=True, methods=['get'])
+    def movements(self, request, pk=None):
+        """The batch's ledger, newest first, paged with ?cursor="""
+        stock = self.get_object()
+        try:
+            rows, next_cursor, previous_cursor = keyset_page(
+                stock.movements.select_related('created_by'), ['-created_at'], request.query_params.get('cursor'), 50,
+            )
+        except InvalidCursor:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'next': next_cursor,
+            'previous': previous_cursor,
+            'results': StockMovementSerializer(rows, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def balances(self, request):
+        """On-hand quantity of every batch at ?at=<ISO datetime> (default now)"""
+        try:
+            moment = parse_datetime(request.query_params.get('at') or timezone.now().isoformat())
+        except ValueError:
+            moment = None
+        if moment is None:
+            return Response({'error': '"at" must be an ISO 8601 datetime'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        balances = stock_ledger.balance_at(moment, self.filter_queryset(self.get_queryset()))
+        return Response({'at': moment.isoformat(), 'balances': {str(pk): qty for pk, qty in balances.items()}})
+
+    # Both lists read the stored low_stock / expiry_bucket columns (his/stock_alerts.py)
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
-        low_stock_items = self.queryset.filter(quantity__lte=F('minimum_stock_level'))
-        serializer = self.get_serializer(low_stock_items, many=True)
-        return Response(serializer.data)
+        low_stock_items = self.queryset.filter(low_stock=True)
+        page = self.paginate_queryset(low_stock_items)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
     @action(detail=False, methods=['get'])
     def expired(self, request):
-        expired_items = self.queryset.filter(expiry_date__lt=timezone.now().date())
-        serializer = self.get_serializer(expired_items, many=True)
-        return Response(serializer.data)
+        """Expired batches, soonest first; ?bucket=30d or 90d lists batches expiring within that window instead"""
+        bucket = request.query_params.get('bucket', 'expired')
+        if bucket not in stock_alerts.ALERT_BUCKETS:
+            return Response(
+                {'error': f"bucket must be one of {', '.join(stock_alerts.ALERT_BUCKETS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        expired_items = PharmacyStock.objects.filter(stock_alerts.in_bucket(bucket)).order_by('expiry_date', 'pk')
+        page = self.paginate_queryset(expired_items)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
 class LabOrderViewSet(viewsets.ModelViewSet):
     queryset = LabOrder.objects.all().order_by('-created_at')
@@ -294,19 +492,144 @@ class LabOrderViewSet(viewsets.ModelViewSet):
         lab_order.sample_collected_at = timezone.now()
         lab_order.sample_collected_by = request.user
         lab_order.status = 'sample_collected'
-        lab_order.save()
+        with transaction.atomic():
+            lab_order.save()
+            lab_worklist.enqueue(lab_order, lab_order.sample_collected_at)
         return Response({'detail': 'Sample collected successfully'})
 
+    @action(detail=False, methods=['get'])
+    def tat(self, request):
+        """Daily turnaround-time percentiles (minutes) from the TAT rollups: ?from=&to= (dates), &lab_test=&priority="""
+        try:
+            end = parse_date(request.query_params.get('to') or timezone.localdate().isoformat())
+            start = parse_date(request.query_params.get('from') or (end - timedelta(days=6)).isoformat())
+        except (TypeError, ValueError):
+            end = start = None
+        if end is None or start is None:
+            return Response({'error': '"from" and "to" must be ISO 8601 dates'}, status=status.HTTP_400_BAD_REQUEST)
+        rollups = LabTatRollup.objects.filter(day__gte=start, day__lte=end)
+        if request.query_params.get('lab_test'):
+            lab_test = request.query_params['lab_test']
+            if not lab_test.isdigit():
+                return Response({'error': '"lab_test" must be a lab test id'}, status=status.HTTP_400_BAD_REQUEST)
+            rollups = rollups.filter(lab_test_id=int(lab_test))
+        if request.query_params.get('priority'):
+            rollups = rollups.filter(priority=request.query_params['priority'])
+        rows = rollups.order_by('day', 'lab_test__code', 'priority').values(
+            'day', 'lab_test', 'lab_test__code', 'lab_test__name', 'priority', 'results', 'stats',
+        )
+        return Response({
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'rows': [
+                {
+                    'day': row['day'], 'lab_test': row['lab_test'], 'test_code': row['lab_test__code'],
+                    'test_name': row['lab_test__name'], 'priority': row['priority'],
+                    'results': row['results'], 'stats': row['stats'],
+                }
+                for row in rows
+            ],
+        })
+
+    # Bench worklist (his/lab_worklist.py)
+    @action(detail=False, methods=['get'])
+    def worklist(self, request):
+        """Next items waiting in ?queue= (sample type or department), STAT first, and the depth of every queue"""
+        queue = request.query_params.get('queue')
+        items = []
+        if queue:
+            items = lab_worklist.waiting(queue).select_related('lab_test', 'lab_order__visit__patient')[:50]
+        return Response({
+            'queues': lab_worklist.summary(),
+            'items': LabWorklistItemSerializer(items, many=True).data,
+        })
+
+    @action(detail=False, methods=['post'], url_path='worklist/claim', permission_classes=[IsLab])
+    def claim(self, request):
+        """Take the next item of {"queue": ...}; 204 when the queue is empty"""
+        queue = request.data.get('queue')
+        if not queue:
+            return Response({'error': 'queue is required'}, status=status.HTTP_400_BAD_REQUEST)
+        item = lab_worklist.claim(queue, request.user)
+        if item is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(LabWorklistItemSerializer(item).data)
+
+    @action(detail=False, methods=['post'], url_path=r'worklist/(?P<item_id>[0-9]+)/complete', permission_classes=[IsLab])
+    def complete_item(self, request, item_id=None):
+        """Finish an item claimed by the requesting tech"""
+        item = get_object_or_404(LabOrderItem, pk=item_id)
+        try:
+            lab_worklist.complete(item, request.user)
+        except lab_worklist.WorklistError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        item.refresh_from_db()
+        return Response(LabWorklistItemSerializer(item).data)
+
+    @action(detail=False, methods=['post'], url_path=r'worklist/(?P<item_id>[0-9]+)/release', permission_classes=[IsLab])
+    def release_item(self, request, item_id=None):
+        """Return an item claimed by the requesting tech to its queue in its original place"""
+        item = get_object_or_404(LabOrderItem, pk=item_id)
+        try:
+            lab_worklist.release(item, request.user)
+        except lab_worklist.WorklistError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        item.refresh_from_db()
+        return Response(LabWorklistItemSerializer(item).data)
+
 class LabResultViewSet(viewsets.ModelViewSet):
+    """
+    Lab results, latest report first. The list is keyset-paginated: {"next", "previous", "results"}
+    with no "count"; follow the links (?cursor=). ?page=N gives page-number
+    responses with "count". See his/pagination.py.
+    """
     queryset = LabResult.objects.all().order_by('-reported_at')
     serializer_class = LabResultSerializer
     permission_classes = [IsLab]
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return LabResultSerializer.setup_eager_loading(super().get_queryset())
 
     def perform_create(self, serializer):
         serializer.validated_data['reported_by'] = self.request.user
         serializer.save()
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_results(self, request):
+        """
+        Analyzer result file as CSV or ASTM records, in the body or as a "file"
+        upload; ?file_format=csv|astm overrides detection (see his/lab_import.py)
+        """
+        if request.content_type and request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'error': 'Upload the result file as "file"'}, status=status.HTTP_400_BAD_REQUEST)
+            body, content_type = upload.read(), upload.content_type or ''
+        else:
+            body, content_type = request.body, request.content_type or ''
+        try:
+            results = lab_import.parse_payload(body, content_type, request.query_params.get('file_format'))
+        except lab_import.PayloadError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if len(results) > lab_import.max_results():
+            return Response(
+                {'error': f'At most {lab_import.max_results()} results per file'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        created, skipped, errors = lab_import.import_results(results, reported_by=request.user)
+        if not errors:
+            # A retransmitted file is skipped, not refused, so the analyzer sees success either way
+            response_status = status.HTTP_201_CREATED
+        elif created or skipped:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {'created': created, 'skipped': skipped, 'rejected': len(errors), 'errors': errors}, status=response_status,
+        )
+
 class RadiologyOrderViewSet(viewsets.ModelViewSet):
     queryset = RadiologyOrder.objects.all().order_by('-created_at')
     serializer_class = RadiologyOrderSerializer
@@ -318,10 +641,15 @@ class RadiologyOrderViewSet(viewsets.ModelViewSet):
         serializer.save()
 
 class InvoiceViewSet(viewsets.ModelViewSet):
+    """
+    Invoices, newest first. The list is keyset-paginated: {"next", "previous", "results"}
+    with no "count"; follow the links (?cursor=). ?page=N gives page-number
+    responses with "count". See his/pagination.py.
+    """
     queryset = Invoice.objects.all().order_by('-created_at')
     serializer_class = InvoiceSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
         if not serializer.validated_data.get('invoice_number'):
@@ -337,7 +665,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         
         payment = Payment.objects.create(
             invoice=invoice,
-            payment_number=f"PAY{timezone.now().strftime('%y%m%d%H%M%S')}",
+            payment_number=generate_payment_number(),
             amount=amount,
             method=method,
             recorded_by=request.user
@@ -368,12 +696,7 @@ class LoginPageView(View):
         if user:
             login(request, user)
             # Log the login
-            AuditLog.objects.create(
-                actor=user,
-                action='LOGIN',
-                details={'ip_address': request.META.get('REMOTE_ADDR')},
-                ip_address=request.META.get('REMOTE_ADDR')
-            )
+            audit.record_request(request, 'LOGIN', actor=user)
             return redirect('dashboard')
         else:
             return render(request, self.template_name, {'error': 'Invalid credentials'})
@@ -381,12 +704,7 @@ class LoginPageView(View):
 class LogoutView(View):
     def get(self, request):
         if request.user.is_authenticated:
-            AuditLog.objects.create(
-                actor=request.user,
-                action='LOGOUT',
-                details={'ip_address': request.META.get('REMOTE_ADDR')},
-                ip_address=request.META.get('REMOTE_ADDR')
-            )
+            audit.record_request(request, 'LOGOUT')
         logout(request)
         return redirect('/')
 
@@ -401,51 +719,47 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         today = timezone.now().date()
         
         # Common stats
-        context.update({
-            'total_patients': Patient.objects.count(),
-            'active_visits': Visit.objects.filter(status='active').count(),
-            'today_appointments': Appointment.objects.filter(
-                appointment_date__date=today
-            ).count(),
-        })
+        context.update(counters.read({
+            'total_patients': 'patients.total',
+            'active_visits': 'visits.active',
+            'today_appointments': ('appointments.scheduled', today),
+        }))
         
         # Role-specific data
         if user.role == Role.ADMIN:
-            context.update({
-                'total_staff': Staff.objects.filter(active=True).count(),
-                'pending_leave_requests': LeaveRequest.objects.filter(status='pending').count(),
-                'low_stock_items': PharmacyStock.objects.filter(
-                    quantity__lte=F('minimum_stock_level')
-                ).count(),
-            })
+            context.update(counters.read({
+                'total_staff': 'staff.active',
+                'pending_leave_requests': 'leave_requests.pending',
+                'low_stock_items': 'pharmacy.low_stock',
+            }))
         
         elif user.role == Role.DOCTOR:
-            context.update({
+            context.update(dashboard_cache.cached_fragment('doctor', user.id, lambda: {
                 'my_appointments_today': Appointment.objects.filter(
                     doctor=user, appointment_date__date=today
                 ).count(),
                 'my_patients': Visit.objects.filter(
                     attending_doctor=user, status='active'
                 ).count(),
-            })
+            }))
         
         elif user.role == Role.NURSE:
-            context.update({
+            context.update(dashboard_cache.cached_fragment('nurse', user.id, lambda: {
                 'patients_in_ward': Visit.objects.filter(
                     status='active', bed__ward__nurse_in_charge=user
                 ).count(),
+            }))
+            context.update(dashboard_cache.cached_fragment('nurse', None, lambda: {
                 'vitals_pending': Visit.objects.filter(
                     status='active', vitals__recorded_at__date__lt=today
                 ).count(),
-            })
+            }))
         
         elif user.role == Role.FINANCE:
-            context.update({
-                'pending_invoices': Invoice.objects.filter(status='sent').count(),
-                'today_revenue': Payment.objects.filter(
-                    paid_at__date=today
-                ).aggregate(total=Sum('amount'))['total'] or 0,
-            })
+            context.update(dashboard_cache.cached_fragment('finance', None, lambda: counters.read({
+                'pending_invoices': 'invoices.sent',
+                'today_revenue': ('payments.revenue', today),
+            })))
         
         return context
 
@@ -455,13 +769,7 @@ from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils import timezone
 from django.db import transaction
-from .models import Patient, MRNCounter, Visit, Appointment, Department, User, Role
-
-
-def generate_visit_id():
-    # Replace with your actual logic for generating visit IDs
-    import uuid
-    return str(uuid.uuid4())[:8].upper()
+from .models import Patient, Visit, Appointment, Department, User, Role
 
 
 class OPRegistrationView(LoginRequiredMixin, View):
@@ -476,25 +784,60 @@ class OPRegistrationView(LoginRequiredMixin, View):
         })
 
     def post(self, request):
-        with transaction.atomic():  # ensure MRN is unique even under concurrency
-            # Generate MRN
-            year = timezone.now().year
-            counter, created = MRNCounter.objects.select_for_update().get_or_create(year=year)
-            counter.last_seq += 1
-            counter.save()
-            mrn = f"MRN{year}{counter.last_seq:04d}"
-
-            # Create patient
-            patient = Patient.objects.create(
-                mrn=mrn,
-                first_name=request.POST.get('first_name'),
-                last_name=request.POST.get('last_name', ''),
-                age=request.POST.get('age') or None,
-                gender=request.POST.get('gender', ''),
+        errors = []
+        dob, age = request.POST.get('dob') or None, request.POST.get('age') or None
+        if dob is not None:
+            try:
+                dob = parse_date(dob)
+            except ValueError:  # well formed but impossible, e.g. 2024-02-30
+                dob = None
+            if dob is None:
+                errors.append('Enter the date of birth as YYYY-MM-DD.')
+        if age is not None:
+            if age.isdigit():
+                age = int(age)
+            else:
+                errors.append('Enter the age as a whole number of years.')
+        if errors:
+            return render(request, self.template_name, {
+                'departments': Department.objects.filter(is_active=True),
+                'doctors': User.objects.filter(role=Role.DOCTOR, is_active=True),
+                'errors': errors,
+            }, status=400)
+
+        # Offer likely existing records before creating a duplicate MRN
+        if not request.POST.get('confirm_new'):
+            possible_duplicates = duplicates.find_candidates(
+                request.POST.get('first_name', ''),
+                request.POST.get('last_name', ''),
+                dob=dob,
+                age=age,
                 contact_number=request.POST.get('contact_number', ''),
-                address=request.POST.get('address', ''),
-                created_by=request.user
             )
+            if possible_duplicates:
+                return render(request, self.template_name, {
+                    'departments': Department.objects.filter(is_active=True),
+                    'doctors': User.objects.filter(role=Role.DOCTOR, is_active=True),
+                    'possible_duplicates': possible_duplicates,
+                    # lists(), so fields sent more than once come back whole
+                    'submitted': [
+                        (name, value) for name, values in request.POST.lists()
+                        if name != 'csrfmiddlewaretoken' for value in values
+                    ],
+                })
+
+        # Create patient
+        patient = Patient.objects.create(
+            mrn=generate_mrn(),
+            first_name=request.POST.get('first_name'),
+            last_name=request.POST.get('last_name', ''),
+            dob=dob,
+            age=age,
+            gender=request.POST.get('gender', ''),
+            contact_number=request.POST.get('contact_number', ''),
+            address=request.POST.get('address', ''),
+            created_by=request.user
+        )
 
         # Create visit
         visit = Visit.objects.create(
@@ -543,16 +886,21 @@ class EmergencyRegistrationView(LoginRequiredMixin, View):
             reason=request.POST.get('reason', 'Emergency admission')
         )
         
+        # Emergencies are never held up; likely duplicates are reported for later merging
         return JsonResponse({
             'status': 'success',
             'patient_id': str(patient.uid),
             'mrn': patient.mrn,
-            'visit_id': visit.visit_id
+            'visit_id': visit.visit_id,
+            'possible_duplicates': duplicates.describe(duplicates.find_candidates(
+                patient.first_name, patient.last_name, age=patient.age,
+                contact_number=patient.contact_number, exclude=patient.uid,
+            )),
         })
 
 # Specialized Views for different roles
 class WardManagementView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
-    template_name = 'nurse/ward_management.html'
+    template_name = 'ward_management.html'
 
     def test_func(self):
         return self.request.user.role in [Role.NURSE, Role.ADMIN]
@@ -560,9 +908,12 @@ class WardManagementView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['wards'] = Ward.objects.filter(is_active=True).prefetch_related('beds')
-        context['active_patients'] = Visit.objects.filter(
-            status='active', visit_type='ipd'
-        ).select_related('patient', 'bed__ward')
+        ward = None
+        if self.request.GET.get('ward', '').isdigit():
+            ward = Ward.objects.filter(pk=self.request.GET['ward']).first()
+        # Active IPD visits sorted by NEWS2 acuity from their latest vitals
+        context['selected_ward'] = ward
+        context['worklist'] = early_warning.worklist(ward=ward)
         return context
 
 from django.db.models import Count
@@ -581,18 +932,29 @@ class PharmacyDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateVie
             dispensed_count=Count('items__dispenses')
         ).filter(dispensed_count=0).count()
         
+        # One query over the expiry index, by expiry date in case the buckets have not been aged yet
+        windows = {bucket: stock_alerts.in_bucket(bucket) for bucket in stock_alerts.ALERT_BUCKETS}
+        expiring = Q()
+        for window in windows.values():
+            expiring |= window
+        expiry = PharmacyStock.objects.filter(expiring).aggregate(
+            **{bucket: Count('pk', filter=window) for bucket, window in windows.items()}
+        )
         context.update({
             'pending_prescriptions': pending_count,
-            'low_stock_count': PharmacyStock.objects.filter(
-                quantity__lte=F('minimum_stock_level')
-            ).count(),
-            'expired_items': PharmacyStock.objects.filter(
-                expiry_date__lt=timezone.now().date()
-            ).count(),
-            'recent_dispenses': MedicationDispense.objects.filter(
-                dispensed_at__date=timezone.now().date()
-            ).count()
+            'expired_items': expiry.get('expired', 0),
+            'expiring_30_days': expiry.get('30d', 0),
+            'expiring_90_days': expiry.get('90d', 0),
+            'low_stock_medications': PharmacyStock.objects.filter(low_stock=True).order_by('medication_name')[:20],
+            'expiring_medications': PharmacyStock.objects.filter(
+                windows['expired'] | windows['30d'],
+            ).order_by('expiry_date')[:20],
+            'recent_procurements': Procurement.objects.select_related('supplier', 'ordered_by').order_by('-order_date')[:10],
         })
+        context.update(counters.read({
+            'low_stock_count': 'pharmacy.low_stock',
+            'recent_dispenses': ('dispenses.recorded', timezone.localdate()),
+        }))
         return context
 
 class LabDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
@@ -603,18 +965,13 @@ class LabDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context.update({
-            'pending_orders': LabOrder.objects.filter(status='ordered').count(),
-            'sample_collection_pending': LabOrder.objects.filter(
-                status='ordered'
-            ).count(),
-            'results_pending': LabOrder.objects.filter(
-                status__in=['sample_collected', 'in_progress']
-            ).count(),
-            'today_completed': LabResult.objects.filter(
-                reported_at__date=timezone.now().date()
-            ).count()
-        })
+        context.update(counters.read({
+            'pending_orders': 'lab_orders.ordered',
+            'sample_collection_pending': 'lab_orders.ordered',
+            'results_pending': 'lab_orders.processing',
+            'today_completed': ('lab_results.reported', timezone.localdate()),
+        }))
+        context['worklist_queues'] = lab_worklist.summary()
         return context
 
 class SystemConfigView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
@@ -661,21 +1018,16 @@ class BillingDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateView
         context = super().get_context_data(**kwargs)
         today = timezone.now().date()
         
-        context.update({
-            'pending_invoices': Invoice.objects.filter(status='sent').count(),
-            'overdue_invoices': Invoice.objects.filter(
-                status='sent', due_date__lt=today
-            ).count(),
-            'today_revenue': Payment.objects.filter(
-                paid_at__date=today
-            ).aggregate(total=Sum('amount'))['total'] or 0,
-            'monthly_revenue': Payment.objects.filter(
-                paid_at__month=today.month, paid_at__year=today.year
-            ).aggregate(total=Sum('amount'))['total'] or 0,
-            'pending_insurance_claims': InsuranceClaim.objects.filter(
-                status='submitted'
-            ).count()
-        })
+        context.update(counters.read({
+            'pending_invoices': 'invoices.sent',
+            'today_revenue': ('payments.revenue', today),
+            'monthly_revenue': ('payments.revenue_monthly', today),
+            'pending_insurance_claims': 'insurance_claims.submitted',
+        }))
+        # Depends on the date as much as on the rows, so it stays a live query
+        context['overdue_invoices'] = Invoice.objects.filter(
+            status='sent', due_date__lt=today
+        ).count()
         return context
 
 class InvoiceCreateView(LoginRequiredMixin, View):
@@ -743,48 +1095,30 @@ class AnalyticsDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateVi
         last_30_days = today - timedelta(days=30)
         last_month = today.replace(day=1) - timedelta(days=1)
         
-        # Patient Analytics
-        context.update({
-            'total_patients': Patient.objects.count(),
-            'new_patients_month': Patient.objects.filter(
-                created_at__date__gte=last_30_days
-            ).count(),
-            'active_visits': Visit.objects.filter(status='active').count(),
-            'today_admissions': Visit.objects.filter(
-                admitted_at__date=today
-            ).count(),
-            'today_discharges': Visit.objects.filter(
-                discharged_at__date=today
-            ).count(),
-        })
-        
-        # Financial Analytics
-        monthly_revenue = Payment.objects.filter(
-            paid_at__month=today.month,
-            paid_at__year=today.year
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        outstanding_amount = Invoice.objects.exclude(
-            status='paid'
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        context.update({
-            'monthly_revenue': monthly_revenue,
-            'outstanding_amount': outstanding_amount,
-            'insurance_pending': InsuranceClaim.objects.filter(
-                status__in=['submitted', 'under_review']
-            ).aggregate(total=Sum('claim_amount'))['total'] or 0
+        last_30_days_range = [last_30_days + timedelta(days=n) for n in range((today - last_30_days).days + 1)]
+        figures = counters.read({
+            # Patient Analytics
+            'total_patients': 'patients.total',
+            'new_patients_month': ('patients.registered', last_30_days_range),
+            'active_visits': 'visits.active',
+            'today_admissions': ('visits.admitted', today),
+            'today_discharges': ('visits.discharged', today),
+            # Financial Analytics
+            'monthly_revenue': ('payments.revenue_monthly', today),
+            'outstanding_amount': 'invoices.outstanding',
+            'insurance_pending': 'insurance_claims.pending_amount',
+            # Operational Analytics
+            'occupied_beds': 'beds.occupied',
+            'total_beds': 'beds.in_service',
         })
+        context.update(figures)
         
-        # Operational Analytics
-        bed_occupancy = Bed.objects.filter(is_occupied=True).count()
-        total_beds = Bed.objects.filter(is_maintenance=False).count()
+        bed_occupancy = figures['occupied_beds']
+        total_beds = figures['total_beds']
         occupancy_rate = (bed_occupancy / total_beds * 100) if total_beds > 0 else 0
         
         context.update({
             'bed_occupancy_rate': round(occupancy_rate, 1),
-            'occupied_beds': bed_occupancy,
-            'total_beds': total_beds,
         })
         
         return context
@@ -797,60 +1131,79 @@ class PatientSearchAPIView(generics.ListAPIView):
     def get_queryset(self):
         query = self.request.GET.get('q', '')
         if len(query) >= 3:
-            return Patient.objects.filter(
-                Q(mrn__icontains=query) |
-                Q(first_name__icontains=query) |
-                Q(last_name__icontains=query) |
-                Q(contact_number__icontains=query)
-            )[:10]
+            ids = search_index.search(query, limit=10)
+            patients = PatientSerializer.setup_eager_loading(Patient.objects.filter(uid__in=ids))
+            rank = {patient_id: position for position, patient_id in enumerate(ids)}
+            return sorted(patients, key=lambda patient: rank[patient.uid])
         return Patient.objects.none()
 
 class DoctorAvailabilityAPIView(View):
+    """
+    Free appointment slots.
+
+    ?doctor_id=<id>&date=<YYYY-MM-DD> answers one doctor and one day as
+    {'available_slots': ['HH:MM', ...]}. Adding department=<id> (or several
+    comma-separated doctor_id values), start=<YYYY-MM-DD>, days=<n> and
+    slot_minutes=<n> returns a grid for every matching doctor and day.
+    """
+
     def get(self, request):
-        doctor_id = request.GET.get('doctor_id')
-        date = request.GET.get('date')
-        
-        if not doctor_id or not date:
-            return JsonResponse({'error': 'Missing parameters'})
-        
-        # Get existing appointments for the doctor on that date
-        existing_appointments = Appointment.objects.filter(
-            doctor_id=doctor_id,
-            appointment_date__date=date
-        ).values_list('appointment_date', flat=True)
-        
-        # Generate available slots (9 AM to 5 PM, 30-min slots)
-        available_slots = []
-        start_time = datetime.strptime(f"{date} 09:00", "%Y-%m-%d %H:%M")
-        end_time = datetime.strptime(f"{date} 17:00", "%Y-%m-%d %H:%M")
-        
-        current_time = start_time
-        while current_time < end_time:
-            if current_time not in existing_appointments:
-                available_slots.append(current_time.strftime("%H:%M"))
-            current_time += timedelta(minutes=30)
-        
-        return JsonResponse({'available_slots': available_slots})
+        doctor_ids = [value for value in request.GET.get('doctor_id', '').split(',') if value]
+        department_id = request.GET.get('department')
+        start = request.GET.get('start') or request.GET.get('date')
+        grid = bool(department_id or len(doctor_ids) > 1 or 'days' in request.GET)
+
+        if not start and grid:
+            start = timezone.localdate().isoformat()
+        if not start or not (doctor_ids or department_id):
+            return JsonResponse({'error': 'Missing parameters'}, status=400)
+        try:
+            doctor_ids = [int(value) for value in doctor_ids]
+            department_id = int(department_id) if department_id else None
+            start_date = datetime.strptime(start, "%Y-%m-%d").date()
+            days = min(max(int(request.GET.get('days', 1)), 1), scheduling.MAX_DAYS)
+            slot_minutes = max(int(request.GET.get('slot_minutes', scheduling.DEFAULT_SLOT_MINUTES)), 5)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid parameters'}, status=400)
+
+        doctors = scheduling.doctors_for(department_id=department_id, doctor_ids=doctor_ids)
+        free = scheduling.availability(doctors, start_date, days=days, slot_minutes=slot_minutes)
+
+        def times(day_slots):
+            return [timezone.localtime(slot).strftime("%H:%M") for slot in day_slots]
+
+        if not grid:
+            day_slots = free[doctors[0].id][start_date] if doctors else []
+            return JsonResponse({'available_slots': times(day_slots)})
+
+        return JsonResponse({
+            'start': start_date.isoformat(),
+            'days': days,
+            'slot_minutes': slot_minutes,
+            'doctors': [{
+                'id': doctor.id,
+                'name': doctor.get_full_name() or doctor.username,
+                'slots': {day.isoformat(): times(day_slots) for day, day_slots in free[doctor.id].items()},
+            } for doctor in doctors],
+        })
+
+class DashboardCacheStatsAPIView(APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(dashboard_cache.stats())
 
 class NotificationAPIView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
-        notifications = Notification.objects.filter(
-            recipient=request.user,
-            is_read=False
-        ).order_by('-created_at')[:10]
-        
-        data = [{
-            'id': n.id,
-            'title': n.title,
-            'message': n.message,
-            'priority': n.priority,
-            'created_at': n.created_at.isoformat(),
-            'action_url': n.action_url
-        } for n in notifications]
-        
-        return JsonResponse({'notifications': data})
+        # Open pages receive these by WebSocket push (his/consumers.py); this
+        # endpoint remains for clients without a socket.
+        snapshot = notifications.snapshot(request.user.id)
+        return JsonResponse({
+            'notifications': snapshot['notifications'],
+            'unread_count': snapshot['unread_count'],
+        })
 
     def post(self, request):
         notification_id = request.data.get('notification_id')
@@ -867,6 +1220,40 @@ class NotificationAPIView(generics.ListAPIView):
             return JsonResponse({'error': 'Notification not found'})
 
 # Ward and Bed Management
+class WardViewSet(viewsets.ModelViewSet):
+    queryset = Ward.objects.all().select_related('nurse_in_charge').order_by('name')
+    serializer_class = WardSerializer
+    # Ward set-up is an admin task; occupancy only changes through his/beds.py
+    permission_classes = [IsAdminOrReadOnly]
+
+    @action(detail=False, methods=['get'])
+    def census(self, request):
+        """Availability of every active ward for the bed board, from the ward occupancy counters"""
+        return Response(beds.census())
+
+
+class BedViewSet(viewsets.ReadOnlyModelViewSet):
+    # Occupancy changes go through his/beds.py (BedAssignmentView, discharge), which keep the ward counters
+    queryset = Bed.objects.all().order_by('ward__name', 'bed_number')
+    serializer_class = BedSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = BedSerializer.setup_eager_loading(super().get_queryset())
+        ward = self.request.query_params.get('ward')
+        if ward:
+            queryset = queryset.filter(ward_id=ward)
+        return queryset
+
+    @action(detail=False, methods=['get'], url_path='map')
+    def bed_map(self, request):
+        """Every bed of the active wards with its occupant, unpaginated, for the bed board"""
+        wards = Ward.objects.filter(is_active=True)
+        if request.query_params.get('ward'):
+            wards = wards.filter(pk=request.query_params['ward'])
+        return Response(self.get_serializer(beds.bed_map(wards), many=True).data)
+
+
 class BedAssignmentView(LoginRequiredMixin, View):
     def post(self, request):
         visit_id = request.POST.get('visit_id')
@@ -875,26 +1262,18 @@ class BedAssignmentView(LoginRequiredMixin, View):
         try:
             visit = Visit.objects.get(id=visit_id)
             bed = Bed.objects.get(id=bed_id)
-            
-            if bed.is_occupied:
-                return JsonResponse({'error': 'Bed is already occupied'})
-            
-            # Free up previous bed if any
-            if visit.bed:
-                visit.bed.is_occupied = False
-                visit.bed.save()
-            
-            # Assign new bed
-            visit.bed = bed
-            visit.save()
-            
-            bed.is_occupied = True
-            bed.save()
-            
-            return JsonResponse({'status': 'success', 'message': 'Bed assigned successfully'})
-        
-        except (Visit.DoesNotExist, Bed.DoesNotExist):
-            return JsonResponse({'error': 'Visit or bed not found'})
+        except (Visit.DoesNotExist, Bed.DoesNotExist, ValueError):
+            return JsonResponse({'error': 'Visit or bed not found'}, status=404)
+
+        # Claims the bed only if it is still free, and frees the previous one
+        try:
+            beds.assign(visit, bed)
+        except beds.VisitNotActive:
+            return JsonResponse({'error': 'Visit is not active'}, status=409)
+        except beds.BedUnavailable:
+            return JsonResponse({'error': 'Bed is already occupied'}, status=409)
+
+        return JsonResponse({'status': 'success', 'message': 'Bed assigned successfully'})
 
 # Report Generation Views
 class PatientReportView(LoginRequiredMixin, View):
@@ -927,7 +1306,10 @@ class PatientsListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         queryset = Patient.objects.all().order_by('-created_at')
         search_query = self.request.GET.get('search')
-        if search_query:
+        if search_query and len(search_query.strip()) >= search_index.MIN_QUERY_LENGTH:
+            # A subquery, so the ordering and pagination cover the whole match set in the database
+            queryset = queryset.filter(pk__in=search_index.matching(search_query))
+        elif search_query:
             queryset = queryset.filter(
                 Q(mrn__icontains=search_query) |
                 Q(first_name__icontains=search_query) |
@@ -945,7 +1327,7 @@ class UsersListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     def test_func(self):
         return self.request.user.role == Role.ADMIN
 
-class AuditLogListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class AuditLogListView(LoginRequiredMixin, UserPassesTestMixin, KeysetListMixin, ListView):
     model = AuditLog
     template_name = 'admin/audit_logs.html'
     context_object_name = 'logs'
@@ -955,7 +1337,7 @@ class AuditLogListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         return self.request.user.role == Role.ADMIN
 
     def get_queryset(self):
-        return AuditLog.objects.all().order_by('-timestamp')
+        return AuditLog.objects.select_related('actor').order_by('-timestamp')
 
 # Emergency and Quick Access Views
 class QuickAdmitView(LoginRequiredMixin, View):
@@ -985,7 +1367,11 @@ class QuickAdmitView(LoginRequiredMixin, View):
             'status': 'success',
             'patient_id': str(patient.uid),
             'visit_id': visit.visit_id,
-            'mrn': patient.mrn
+            'mrn': patient.mrn,
+            'possible_duplicates': duplicates.describe(duplicates.find_candidates(
+                patient.first_name, patient.last_name, age=patient.age,
+                contact_number=patient.contact_number, exclude=patient.uid,
+            )),
         })
 
 # Discharge Management
@@ -997,21 +1383,20 @@ class DischargeView(LoginRequiredMixin, View):
         return render(request, self.template_name, {'visit': visit})
     
     def post(self, request, visit_id):
-        visit = get_object_or_404(Visit, id=visit_id)
-        
-        # Update visit
-        visit.discharged_at = timezone.now()
-        visit.status = 'discharged'
-        visit.discharge_summary = request.POST.get('discharge_summary', '')
-        visit.follow_up_date = request.POST.get('follow_up_date') or None
-        
-        # Free up bed
-        if visit.bed:
-            visit.bed.is_occupied = False
-            visit.bed.save()
-            visit.bed = None
-        
-        visit.save()
+        with transaction.atomic():
+            visit = get_object_or_404(Visit.objects.select_for_update(), id=visit_id)
+            if visit.status == 'discharged':
+                return redirect('visit-detail', pk=visit.id)
+
+            # Update visit
+            visit.discharged_at = timezone.now()
+            visit.status = 'discharged'
+            visit.discharge_summary = request.POST.get('discharge_summary', '')
+            visit.follow_up_date = request.POST.get('follow_up_date') or None
+
+            # Free up bed
+            beds.release(visit)
+            visit.save()
         
         # Create follow-up if specified
         if request.POST.get('follow_up_date'):
@@ -1034,6 +1419,27 @@ class ProcurementViewSet(viewsets.ModelViewSet):
     queryset = Procurement.objects.all()
     serializer_class = ProcurementSerializer
 
+    @action(detail=True, methods=['post'])
+    def receive(self, request, pk=None):
+        """
+        Receive a delivery into pharmacy stock (see his/receiving.py). Optional
+        body: {"items": [{"id", "received_quantity", "batch_number", "expiry_date"}]}.
+        """
+        procurement = self.get_object()
+        if procurement.status == 'cancelled':
+            return Response({'error': 'Procurement is cancelled'}, status=status.HTTP_400_BAD_REQUEST)
+        lines = request.data.get('items')
+        if lines is not None and not isinstance(lines, list):
+            return Response({'error': '"items" must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            movements = receiving.receive(procurement, received_by=request.user, lines=lines)
+        except receiving.ReceivingError as exc:
+            return Response({'errors': exc.errors}, status=status.HTTP_400_BAD_REQUEST)
+        procurement.refresh_from_db()
+        data = self.get_serializer(procurement).data
+        data['booked'] = len(movements)
+        return Response(data)
+
 class RadiologyReportViewSet(viewsets.ModelViewSet):
     queryset = RadiologyReport.objects.all()
     serializer_class = RadiologyReportSerializer
@@ -0,0 +1,204 @@
+# his/vitals_ingest.py
+"""
+Batch ingest of bedside monitor readings.
+
+A batch is a JSON array (or {"readings": [...]}) or NDJSON, one reading per
+object, keyed by the visit's visit_id:
+
+    {"visit_id": "V2509160012", "recorded_at": "2025-09-16T10:01:00Z",
+     "pulse": 88, "oxygen_saturation": 97.5, "systolic_bp": 124}
+
+Validation runs column by column over the whole batch rather than through a
+serializer per row, visits are resolved with one query, and the valid rows
+are written with bulk_create in chunks inside one transaction. Invalid rows
+are reported by index and never block the valid ones.
+"""
+import json
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import dashboard_cache, vitals_series
+from .models import Visit, Vitals
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_MAX_READINGS = 10000
+
+# field -> (type, minimum, maximum); bounds reject sensor noise, not clinical extremes
+MEASUREMENTS = {
+    'temperature': (Decimal, Decimal('25'), Decimal('45')),
+    'pulse': (int, 0, 300),
+    'systolic_bp': (int, 0, 300),
+    'diastolic_bp': (int, 0, 250),
+    'respiratory_rate': (int, 0, 100),
+    'oxygen_saturation': (Decimal, Decimal('0'), Decimal('100')),
+    'blood_sugar': (Decimal, Decimal('0'), Decimal('2000')),
+    'weight': (Decimal, Decimal('0'), Decimal('500')),
+    'height': (Decimal, Decimal('0'), Decimal('300')),
+}
+TWO_PLACES = Decimal('0.01')
+# Monitor clocks drift; readings stamped slightly ahead are accepted
+FUTURE_TOLERANCE = timedelta(minutes=5)
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def max_readings():
+    return getattr(settings, 'HIS_VITALS_INGEST_MAX_READINGS', DEFAULT_MAX_READINGS)
+
+
+def parse_payload(body, content_type=''):
+    """
+    Readings from a raw request body. Returns (readings, errors) where
+    unparseable NDJSON lines become errors and their slot in readings is None.
+    """
+    try:
+        text = body.decode('utf-8') if isinstance(body, bytes) else body
+    except UnicodeDecodeError:
+        raise PayloadError('Body is not UTF-8 text')
+    if 'ndjson' in content_type or 'jsonlines' in content_type:
+        readings, errors = [], []
+        for index, line in enumerate(line for line in text.splitlines() if line.strip()):
+            try:
+                readings.append(json.loads(line))
+            except ValueError:
+                readings.append(None)
+                errors.append({'index': index, 'errors': {'non_field_errors': ['Invalid JSON']}})
+        return readings, errors
+
+    try:
+        payload = json.loads(text or 'null')
+    except ValueError:
+        raise PayloadError('Body is not valid JSON')
+    if isinstance(payload, dict):
+        payload = payload.get('readings')
+    if not isinstance(payload, list):
+        raise PayloadError('Expected a JSON array of readings or {"readings": [...]}')
+    return payload, []
+
+
+def _to_number(kind, value):
+    if kind is int:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError
+        return int(value)
+    return Decimal(str(value)).quantize(TWO_PLACES)
+
+
+def validate(readings):
+    """
+    Column-wise validation of a batch. Returns (rows, errors): rows maps the
+    reading index to cleaned values, errors maps it to {field: [messages]}.
+    """
+    errors = {}
+
+    def fail(index, field, message):
+        errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+    indices = []
+    for index, reading in enumerate(readings):
+        if isinstance(reading, dict):
+            indices.append(index)
+        elif reading is not None:
+            fail(index, 'non_field_errors', 'Expected an object')
+
+    rows = {index: {} for index in indices}
+
+    # visit_id: one query for the whole batch
+    visit_ids = {index: str(readings[index].get('visit_id') or '') for index in indices}
+    visits = {
+        visit_id: (pk, discharged_at)
+        for visit_id, pk, discharged_at in Visit.objects.filter(
+            visit_id__in={value for value in visit_ids.values() if value}
+        ).values_list('visit_id', 'pk', 'discharged_at')
+    }
+    for index, visit_id in visit_ids.items():
+        if not visit_id:
+            fail(index, 'visit_id', 'This field is required.')
+        elif visit_id not in visits:
+            fail(index, 'visit_id', f'Unknown visit "{visit_id}".')
+        else:
+            rows[index]['visit_id'] = visits[visit_id][0]
+
+    # recorded_at: optional, never in the future, never after discharge
+    now = timezone.now()
+    for index in indices:
+        raw = readings[index].get('recorded_at')
+        if raw in (None, ''):
+            rows[index]['recorded_at'] = now
+            continue
+        value = parse_datetime(str(raw))
+        if value is None:
+            fail(index, 'recorded_at', 'Invalid datetime.')
+            continue
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        discharged_at = visits.get(visit_ids[index], (None, None))[1]
+        if value > now + FUTURE_TOLERANCE:
+            fail(index, 'recorded_at', 'Reading is in the future.')
+        elif discharged_at and value > discharged_at:
+            fail(index, 'recorded_at', 'Reading is after the visit was discharged.')
+        rows[index]['recorded_at'] = value
+
+    # measurements, one column at a time
+    for field, (kind, minimum, maximum) in MEASUREMENTS.items():
+        for index in indices:
+            raw = readings[index].get(field)
+            if raw in (None, ''):
+                continue
+            try:
+                value = _to_number(kind, raw)
+            except (TypeError, ValueError, InvalidOperation):
+                fail(index, field, 'A valid number is required.')
+                continue
+            if not minimum <= value <= maximum:
+                fail(index, field, f'Must be between {minimum} and {maximum}.')
+                continue
+            rows[index][field] = value
+
+    for index in indices:
+        if not any(field in rows[index] for field in MEASUREMENTS) and index not in errors:
+            fail(index, 'non_field_errors', 'At least one measurement is required.')
+        notes = readings[index].get('notes')
+        if notes:
+            rows[index]['notes'] = str(notes)
+
+    return {index: row for index, row in rows.items() if index not in errors}, errors
+
+
+def ingest(readings, recorded_by=None, chunk_size=None):
+    """
+    Validate and store a batch. Returns (created, errors) with errors as a
+    list of {'index', 'visit_id', 'errors'} for the rejected readings.
+    """
+    chunk_size = chunk_size or getattr(settings, 'HIS_VITALS_INGEST_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    rows, errors = validate(readings)
+    objects = [
+        Vitals(recorded_by=recorded_by, **row)
+        for index, row in sorted(rows.items())
+    ]
+    if objects:
+        with transaction.atomic():
+            for start in range(0, len(objects), chunk_size):
+                Vitals.objects.bulk_create(objects[start:start + chunk_size])
+            # bulk_create skips post_save, so do what the signals would have: invalidate
+            # the nurse dashboard and re-roll hours already rolled up that got late readings
+            transaction.on_commit(lambda: dashboard_cache.invalidate('nurse', [None]))
+            late = [(vitals.visit_id, vitals.recorded_at) for vitals in objects]
+            transaction.on_commit(lambda: vitals_series.reroll(late))
+
+    report = [
+        {
+            'index': index,
+            'visit_id': readings[index].get('visit_id') if isinstance(readings[index], dict) else None,
+            'errors': field_errors,
+        }
+        for index, field_errors in sorted(errors.items())
+    ]
+    return len(objects), report
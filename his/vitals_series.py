@@ -0,0 +1,230 @@
+# his/vitals_series.py
+"""
+Downsampled vitals time series for trend charts.
+
+series() answers "min / max / avg of each metric per bucket" for one visit
+and time range as columnar arrays: one list of bucket start times (epoch
+seconds, UTC-aligned) and one list per metric and statistic. Only buckets
+holding readings are returned.
+
+Raw readings are read through the (visit, recorded_at) index with only the
+metric columns. When the bucket is a whole number of hours, the part of the
+range already summarised in VitalsRollup (hourly rows written by the
+rollup_vitals command) is read from there instead, so charting weeks of
+ICU data touches one row per hour rather than one per reading. Hours of
+that part with no rollup row for the visit (never rolled up, e.g. skipped
+by rollup_vitals --since, or simply without readings) are read raw.
+
+A reading saved, ingested or deleted in an hour that is already rolled up
+(a late or backdated reading) re-rolls that hour for its visit once the
+transaction commits, so the rollup rows never go stale.
+"""
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Vitals, VitalsRollup
+
+METRICS = ['pulse', 'respiratory_rate', 'systolic_bp', 'diastolic_bp', 'oxygen_saturation', 'temperature', 'blood_sugar']
+ROLLUP_SECONDS = 3600
+MAX_BUCKETS = 2000
+# More gaps than this in the rolled-up hours and the whole range is read raw
+MAX_RAW_RANGES = 50
+
+_BUCKET = re.compile(r'^(\d+)([smhd])$')
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_bucket(value):
+    """'30s', '5m', '1h', '1d' -> seconds; ValueError otherwise."""
+    match = _BUCKET.match((value or '').strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f'Invalid bucket "{value}"; use e.g. 30s, 5m, 1h, 1d')
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+def _epoch(moment):
+    return int(moment.timestamp())
+
+
+def _floor(seconds, bucket):
+    return seconds - seconds % bucket
+
+
+def _hour(moment):
+    return datetime.fromtimestamp(_floor(_epoch(moment), ROLLUP_SECONDS), tz=dt_timezone.utc)
+
+
+def _gaps(first_hour, end, covered):
+    """[start, end) runs of the hours from first_hour to end that are not in `covered`."""
+    gaps = []
+    hour = first_hour
+    step = timedelta(seconds=ROLLUP_SECONDS)
+    while hour < end:
+        if hour not in covered:
+            if gaps and gaps[-1][1] == hour:
+                gaps[-1][1] = hour + step
+            else:
+                gaps.append([hour, hour + step])
+        hour += step
+    return [tuple(gap) for gap in gaps]
+
+
+def _merge(target, metric, low, high, total, count):
+    current = target.get(metric)
+    if current is None:
+        target[metric] = [low, high, total, count]
+    else:
+        current[0] = min(current[0], low)
+        current[1] = max(current[1], high)
+        current[2] += total
+        current[3] += count
+
+
+def rollup_watermark():
+    """End of the newest rolled-up hour, or None before the first rollup run."""
+    latest = VitalsRollup.objects.order_by('-bucket_start').values_list('bucket_start', flat=True).first()
+    return latest + timedelta(seconds=ROLLUP_SECONDS) if latest else None
+
+
+def series(visit_id, start, end, bucket_seconds, metrics=None):
+    metrics = [metric for metric in (metrics or METRICS) if metric in METRICS]
+    buckets = {}  # bucket start (epoch) -> {'n': readings, metric: [min, max, sum, count]}
+
+    raw_ranges = [(start, end)]
+    watermark = rollup_watermark() if bucket_seconds % ROLLUP_SECONDS == 0 else None
+    if watermark:
+        # Rollup rows cover whole hours; the ragged edges come from raw readings
+        first_hour = datetime.fromtimestamp(
+            _floor(_epoch(start) + ROLLUP_SECONDS - 1, ROLLUP_SECONDS), tz=dt_timezone.utc
+        )
+        rolled_end = min(watermark, _hour(end))
+        rows = []
+        if first_hour < rolled_end:
+            rows = list(VitalsRollup.objects.filter(
+                visit_id=visit_id, bucket_start__gte=first_hour, bucket_start__lt=rolled_end,
+            ).values_list('bucket_start', 'readings', 'stats'))
+            gaps = _gaps(first_hour, rolled_end, {row[0] for row in rows})
+            if len(gaps) <= MAX_RAW_RANGES:
+                raw_ranges = [(start, first_hour), *gaps, (rolled_end, end)]
+            else:
+                rows = []
+        for bucket_start, readings, stats in rows:
+            bucket = buckets.setdefault(_floor(_epoch(bucket_start), bucket_seconds), {'n': 0})
+            bucket['n'] += readings
+            for metric in metrics:
+                if metric in stats:
+                    _merge(bucket, metric, *stats[metric])
+
+    ranges = Q()
+    for range_start, range_end in raw_ranges:
+        if range_start < range_end:
+            ranges |= Q(recorded_at__gte=range_start, recorded_at__lt=range_end)
+    if ranges:
+        rows = Vitals.objects.filter(ranges, visit_id=visit_id).order_by().values_list('recorded_at', *metrics)
+        for recorded_at, *values in rows.iterator(chunk_size=5000):
+            bucket = buckets.setdefault(_floor(_epoch(recorded_at), bucket_seconds), {'n': 0})
+            bucket['n'] += 1
+            for metric, value in zip(metrics, values):
+                if value is not None:
+                    value = float(value)
+                    _merge(bucket, metric, value, value, value, 1)
+
+    ordered = sorted(buckets)
+    result = {
+        'bucket_seconds': bucket_seconds,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        't': ordered,
+        'count': [buckets[key]['n'] for key in ordered],
+    }
+    for metric in metrics:
+        columns = {'min': [], 'max': [], 'avg': []}
+        for key in ordered:
+            stats = buckets[key].get(metric)
+            columns['min'].append(stats[0] if stats else None)
+            columns['max'].append(stats[1] if stats else None)
+            columns['avg'].append(round(stats[2] / stats[3], 2) if stats else None)
+        result[metric] = columns
+    return result
+
+
+def rollup(start, end, visit_ids=None):
+    """
+    (Re)build the hourly VitalsRollup rows for every hour in [start, end),
+    aggregated in the database, for all visits or only `visit_ids`.
+    Returns the number of rows written.
+    """
+    start = _hour(start)
+    aggregates = {'readings': Count('id')}
+    for metric in METRICS:
+        aggregates[f'{metric}__min'] = Min(metric)
+        aggregates[f'{metric}__max'] = Max(metric)
+        aggregates[f'{metric}__sum'] = Sum(metric)
+        aggregates[f'{metric}__count'] = Count(metric)
+    readings = Vitals.objects.filter(recorded_at__gte=start, recorded_at__lt=end, visit__isnull=False)
+    existing = VitalsRollup.objects.filter(bucket_start__gte=start, bucket_start__lt=end)
+    if visit_ids is not None:
+        readings = readings.filter(visit_id__in=visit_ids)
+        existing = existing.filter(visit_id__in=visit_ids)
+    rows = (
+        readings.annotate(hour=TruncHour('recorded_at', tzinfo=dt_timezone.utc))
+        .order_by().values('visit_id', 'hour').annotate(**aggregates)
+    )
+    rollups = []
+    for row in rows.iterator(chunk_size=2000):
+        stats = {
+            metric: [
+                float(row[f'{metric}__min']), float(row[f'{metric}__max']),
+                float(row[f'{metric}__sum']), row[f'{metric}__count'],
+            ]
+            for metric in METRICS if row[f'{metric}__count']
+        }
+        rollups.append(VitalsRollup(
+            visit_id=row['visit_id'], bucket_start=row['hour'], readings=row['readings'], stats=stats,
+        ))
+    with transaction.atomic():
+        existing.delete()
+        VitalsRollup.objects.bulk_create(rollups, batch_size=2000)
+    return len(rollups)
+
+
+def reroll(readings):
+    """
+    Rebuild the rolled-up hours that `readings` ((visit_id, recorded_at)
+    pairs) fall in, for those visits only. Hours past the watermark are left
+    to the next rollup run. Returns the number of rows written.
+    """
+    watermark = rollup_watermark()
+    if watermark is None:
+        return 0
+    hours = {}
+    for visit_id, recorded_at in readings:
+        if visit_id and recorded_at < watermark:
+            hours.setdefault(_hour(recorded_at), set()).add(visit_id)
+    return sum(
+        rollup(hour, hour + timedelta(seconds=ROLLUP_SECONDS), visit_ids)
+        for hour, visit_ids in sorted(hours.items())
+    )
+
+
+def rollup_cutoff(delay_hours):
+    """Start of the newest hour that is at least `delay_hours` old."""
+    moment = timezone.now() - timedelta(hours=delay_hours)
+    return datetime.fromtimestamp(_floor(_epoch(moment), ROLLUP_SECONDS), tz=dt_timezone.utc)
+
+
+def _reroll_on_change(sender, instance, raw=False, **kwargs):
+    if raw or not instance.visit_id:
+        return
+    reading = (instance.visit_id, instance.recorded_at)
+    transaction.on_commit(lambda: reroll([reading]))
+
+
+post_save.connect(_reroll_on_change, sender=Vitals, dispatch_uid='vitals_series_reroll_save')
+post_delete.connect(_reroll_on_change, sender=Vitals, dispatch_uid='vitals_series_reroll_delete')
@@ -8,6 +8,7 @@ For details see:
     https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # -----------------------------------------------------------------------------
@@ -63,6 +64,15 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'hospital_his.urls'
 ASGI_APPLICATION = 'hospital_his.asgi.application'
 
+# Channel layer for WebSocket notification push (see his/notifications.py).
+# The in-memory layer only reaches sockets served by the same process; use
+# channels_redis.core.RedisChannelLayer when running several ASGI workers.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -136,6 +146,11 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # -----------------------------------------------------------------------------
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# -----------------------------------------------------------------------------
+# TESTS
+# -----------------------------------------------------------------------------
+TEST_RUNNER = 'his.test_runner.HISTestRunner'
+
 # -----------------------------------------------------------------------------
 # REST FRAMEWORK (optional defaults)
 # -----------------------------------------------------------------------------
@@ -151,3 +166,51 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
+
+# -----------------------------------------------------------------------------
+# CACHES
+# -----------------------------------------------------------------------------
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Cache alias for dashboard fragments (see his/dashboard_cache.py).
+# Invalidations only reach the cache the saving process can see: local memory
+# is fine for a single worker process, anything more needs a shared backend
+# (Redis or Memcached) configured here or as 'default'.
+HIS_DASHBOARD_CACHE = 'default'
+HIS_DASHBOARD_CACHE_TIMEOUT = 300  # seconds
+
+# -----------------------------------------------------------------------------
+# DOCUMENT NUMBER SEQUENCES (see his/sequences.py)
+# -----------------------------------------------------------------------------
+# Numbers each worker reserves per round trip to the counter row.
+# Use 1 for any document type that must be gap-free.
+HIS_SEQUENCE_BLOCK_SIZES = {
+    'mrn': 20,
+    'visit': 50,
+    'invoice': 20,
+    'payment': 20,
+}
+
+# -----------------------------------------------------------------------------
+# AUDIT LOG WRITER (see his/audit.py)
+# -----------------------------------------------------------------------------
+# Entries are buffered in-process and written in batches; the spill directory
+# holds them on local disk until they are in the database.
+# HIS_AUDIT_ASYNC=0 in the environment writes each entry immediately (one-off
+# scripts); the test runner (TEST_RUNNER) always does.
+HIS_AUDIT_ASYNC = os.environ.get('HIS_AUDIT_ASYNC', '1').lower() not in ('0', 'false', 'no')
+HIS_AUDIT_MAX_ATTEMPTS = 10  # failed flushes before an entry goes to the dead-letter file
+HIS_AUDIT_BATCH_SIZE = 200
+HIS_AUDIT_FLUSH_INTERVAL = 2.0  # seconds
+HIS_AUDIT_SPILL_DIR = BASE_DIR / 'spool' / 'audit'
+HIS_AUDIT_FSYNC = False  # True survives power loss too, at one fsync per entry
+
+# -----------------------------------------------------------------------------
+# VITALS BATCH INGEST (see his/vitals_ingest.py)
+# -----------------------------------------------------------------------------
+HIS_VITALS_INGEST_MAX_READINGS = 10000  # per request
+HIS_VITALS_INGEST_CHUNK_SIZE = 1000     # rows per INSERT